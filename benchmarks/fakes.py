@@ -0,0 +1,190 @@
+import asyncio
+import itertools
+
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from discord import utils
+from typing import Dict, List, Optional
+
+# In-process stand-ins for the discord.py objects the bot touches.
+# Every REST call sleeps for `latency` seconds and is counted, nothing leaves the process.
+
+class FakeHTTP:
+	def __init__(self, latency: float):
+		self.latency = latency
+		self.calls: Counter = Counter()
+		self._ids = itertools.count()
+
+	async def request(self, name: str) -> None:
+		self.calls[name] += 1
+		if self.latency:
+			await asyncio.sleep(self.latency)
+
+	def snowflake(self) -> int:
+		# ids with the current time, so message age checks behave like Discord
+		return utils.time_snowflake(datetime.now(timezone.utc)) + next(self._ids) % (1 << 22)
+
+@dataclass
+class FakeUser:
+	id: int
+	name: str = ""
+	global_name: str = ""
+	http: Optional[FakeHTTP] = None
+
+	async def send(self, content=None, **kwargs):
+		await self.http.request("user.send")
+
+@dataclass
+class FakeTag:
+	id: int
+	name: str = ""
+	emoji: str = ""
+
+@dataclass
+class FakeGuild:
+	id: int
+	owner_id: int
+
+class FakeMessage:
+	def __init__(self, channel: "FakeChannel", author: FakeUser, content: str="", message_id: int=None):
+		self.channel = channel
+		self.author = author
+		self.content = content
+		self.components = []
+		self.id = channel.http.snowflake() if message_id is None else message_id
+
+	async def edit(self, content=None, **kwargs):
+		await self.channel.http.request("message.edit")
+		if content is not None:
+			self.content = content
+		return self
+
+	async def delete(self):
+		await self.channel.http.request("message.delete")
+		self.channel.messages.pop(self.id, None)
+
+class FakeChannel:
+	"""
+	Text channel, forum channel, thread or DM channel
+	"""
+	def __init__(self, http: FakeHTTP, bot_user: FakeUser, channel_id: int, name: str="", tags: List[int]=(), guild: FakeGuild=None):
+		self.http = http
+		self.bot_user = bot_user
+		self.id = channel_id
+		self.name = name
+		self.guild = guild
+		self.messages: Dict[int, FakeMessage] = {}
+		self._tags = {tag_id: FakeTag(tag_id, f"tag {tag_id}") for tag_id in tags}
+		self._applied_tags: List[int] = []
+
+	@property
+	def applied_tags(self) -> List[FakeTag]:
+		return [FakeTag(tag_id) for tag_id in self._applied_tags]
+
+	def get_tag(self, tag_id: int) -> Optional[FakeTag]:
+		return self._tags.get(tag_id)
+
+	def add_message(self, author: FakeUser, content: str="") -> FakeMessage:
+		message = FakeMessage(self, author, content)
+		self.messages[message.id] = message
+		return message
+
+	async def send(self, content=None, **kwargs) -> FakeMessage:
+		await self.http.request("channel.send")
+		return self.add_message(self.bot_user, content)
+
+	async def override_tags(self, *tags, reason=None):
+		await self.http.request("thread.override_tags")
+		self._applied_tags = [tag.id for tag in tags if tag is not None]
+
+	def get_partial_message(self, message_id: int) -> FakeMessage:
+		return self.messages.get(message_id) or FakeMessage(self, self.bot_user, message_id=message_id)
+
+	async def fetch_message(self, message_id: int) -> FakeMessage:
+		await self.http.request("channel.fetch_message")
+		return self.get_partial_message(message_id)
+
+	async def history(self, limit: int=100):
+		await self.http.request("channel.history")
+		for message in sorted(self.messages.values(), key=lambda m: m.id, reverse=True)[:limit]:
+			yield message
+
+	async def delete_messages(self, messages, reason=None):
+		await self.http.request("channel.delete_messages")
+		for message in messages:
+			self.messages.pop(message.id, None)
+
+class FakeResponse:
+	def __init__(self, interaction: "FakeInteraction"):
+		self._interaction = interaction
+		self._done = False
+
+	def is_done(self) -> bool:
+		return self._done
+
+	async def send_message(self, content=None, **kwargs):
+		await self._interaction.client.http.request("interaction.response")
+		self._done = True
+		self._interaction.responses.append(content)
+
+	async def defer(self, **kwargs):
+		await self._interaction.client.http.request("interaction.response")
+		self._done = True
+
+@dataclass
+class FakeInteraction:
+	client: "FakeBot"
+	user: FakeUser
+	channel: FakeChannel
+	responses: List[str] = field(default_factory=list)
+
+	def __post_init__(self):
+		self.response = FakeResponse(self)
+
+	@property
+	def channel_id(self) -> int:
+		return self.channel.id
+
+	@property
+	def guild_id(self) -> int:
+		return self.channel.guild.id
+
+class FakeBot:
+	"""
+	The parts of commands.Bot the bot code uses, with every channel and user in the "gateway cache"
+	"""
+	def __init__(self, latency: float=0.0, user_id: int=1):
+		self.http = FakeHTTP(latency)
+		self.user = FakeUser(user_id, "bot", "bot", self.http)
+		self.guild = FakeGuild(1, owner_id=2)
+		self.channels: Dict[int, FakeChannel] = {}
+		self.users: Dict[int, FakeUser] = {}
+
+	def add_channel(self, channel_id: int, name: str="", tags: List[int]=()) -> FakeChannel:
+		self.channels[channel_id] = FakeChannel(self.http, self.user, channel_id, name, tags, self.guild)
+		return self.channels[channel_id]
+
+	def add_user(self, user_id: int) -> FakeUser:
+		self.users[user_id] = FakeUser(user_id, f"user{user_id}", f"User {user_id}", self.http)
+		return self.users[user_id]
+
+	def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+		return self.channels.get(channel_id)
+
+	def get_partial_messageable(self, channel_id: int) -> FakeChannel:
+		return self.channels.get(channel_id) or self.add_channel(channel_id)
+
+	def get_user(self, user_id: int) -> Optional[FakeUser]:
+		return self.users.get(user_id) or self.add_user(user_id)
+
+	async def fetch_channel(self, channel_id: int) -> FakeChannel:
+		await self.http.request("bot.fetch_channel")
+		return self.get_partial_messageable(channel_id)
+
+	async def fetch_user(self, user_id: int) -> FakeUser:
+		await self.http.request("bot.fetch_user")
+		return self.get_user(user_id)
+
+	def add_listener(self, function, name: str) -> None:
+		pass
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import time
+import yaml
+
+import config
+
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List
+
+# channel, tag and role ids of the benchmark config
+FORUM_CHANNEL_ID = 10
+AUCTION_CHANNEL_ID = 11
+NOTIFICATION_CHANNEL_ID = 12
+AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID = 13
+HONEYPOT_CHANNEL_ID = 14
+ROOM_STATUS_TAGS = {"occupied": 101, "available": 102, "reserved": 103}
+ROOM_TYPE_TAGS = {"vanilla": 104, "spice": 105}
+AUCTION_STATUS_TAGS = {"ready": 106, "in_progress": 107, "archived": 108}
+
+BENCHMARK_CONFIG = {
+	"bot_token": "benchmark",
+	"testing": True,
+	"channel_id": {
+		"room": FORUM_CHANNEL_ID,
+		"auction": AUCTION_CHANNEL_ID,
+		"notifier": NOTIFICATION_CHANNEL_ID,
+		"auction_public_notifier": AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID,
+		"honeypot": HONEYPOT_CHANNEL_ID,
+	},
+	"role_notification_id": {"auction": 20},
+	"thread_status_tags": {"room": ROOM_STATUS_TAGS, "room_type": ROOM_TYPE_TAGS, "auction": AUCTION_STATUS_TAGS},
+	"room_time_selection_frequency": 30,
+	"room_time_selection_count": 10,
+	"triggers": {},
+	# the fake client has no rate limits to respect
+	"outbound": {"route_rate": 1_000_000, "route_burst": 1_000_000},
+}
+
+@contextmanager
+def environment():
+	"""
+	Run the bot code against fresh databases in a temporary directory
+	"""
+	cwd = os.getcwd()
+	with tempfile.TemporaryDirectory(prefix="benchmark-") as directory:
+		os.chdir(directory)
+		try:
+			with open("benchmark.yml", "w") as f:
+				yaml.safe_dump(BENCHMARK_CONFIG, f)
+			config.setup("benchmark.yml")
+			yield directory
+		finally:
+			config.queue_db.close()
+			config.telemetry_db.close()
+			os.chdir(cwd)
+
+def percentile(values: List[float], fraction: float) -> float:
+	"""
+	Nearest-rank percentile, 0 for no values
+	"""
+	if not values:
+		return 0
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+@dataclass
+class Result:
+	scenario: str
+	operations: int = 0
+	elapsed: float = 0
+	latencies: List[float] = field(default_factory=list)
+	statements: Dict[str, int] = field(default_factory=dict)
+	requests: Counter = field(default_factory=Counter)
+
+	@property
+	def throughput(self) -> float:
+		return self.operations / self.elapsed if self.elapsed else 0
+
+	def row(self) -> List:
+		return [
+			self.scenario,
+			self.operations,
+			f"{self.elapsed:.3f}",
+			f"{self.throughput:,.1f}",
+			f"{percentile(self.latencies, 0.50) * 1000:.2f}",
+			f"{percentile(self.latencies, 0.99) * 1000:.2f}",
+			self.statements.get("queue", 0),
+			self.statements.get("telemetry", 0),
+			sum(self.requests.values()),
+		]
+
+HEADERS = ["Scenario", "Ops", "Seconds", "Ops/s", "p50 ms", "p99 ms", "Queue SQL", "Telemetry SQL", "Discord calls"]
+
+class Recorder:
+	"""
+	Times operations and counts the SQL statements run by both databases while it is active
+	"""
+	def __init__(self, scenario: str):
+		self.result = Result(scenario)
+		self._statements = Counter()
+
+	def __enter__(self) -> "Recorder":
+		config.queue_db.trace(lambda sql: self._statements.update(["queue"]))
+		config.telemetry_db.trace(lambda sql: self._statements.update(["telemetry"]))
+		self._started = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.result.elapsed = time.perf_counter() - self._started
+		config.queue_db.trace(None)
+		config.telemetry_db.trace(None)
+		self.result.statements = dict(self._statements)
+
+	async def time(self, function: Callable[..., Awaitable], *args, **kwargs):
+		"""
+		Await function(*args, **kwargs) and record its latency as one operation
+		"""
+		started = time.perf_counter()
+		try:
+			return await function(*args, **kwargs)
+		finally:
+			self.result.latencies.append(time.perf_counter() - started)
+			self.result.operations += 1
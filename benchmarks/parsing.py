@@ -0,0 +1,145 @@
+#!/bin/python3
+# Micro-benchmark and seeded fuzzing of the amount and duration parsers.
+# Run from the repository root: python -m benchmarks.parsing [--iterations 100000] [--fuzz 100000] [--seed 0]
+import argparse
+import random
+import sys
+import time
+
+from datetime import timedelta
+from src import parsing
+from src.parsing import parse_amount, parse_duration, ParseError, MAX_AMOUNT, MAX_DURATION
+from tabulate import tabulate
+from typing import Callable, List, Optional, Tuple
+
+# inputs seen in bids and auction commands, plus the edge cases fixed so far
+AMOUNT_CORPUS = [
+	"1m", "1.5m", "300k", "1m250k", "1m 250k", "500000", "500,000", "1,000,000", " 2M ", "1.1m", ".5m", "12.k",
+	"", "m", "k", "0", "0k", "1x", "1k1m", "1..5m", "-5", "1e9", "١٢٣", "9" * 40,
+	"1,5m", "1,2,3", "1m 5", "2.5", "1.0005k", "1,0000",
+]
+DURATION_CORPUS = [
+	"1d", "2h", "2hr", "30m", "45s", "1d3h", "1d2h3m4s", " 1D 3H ", "90m",
+	"", "d", "0h", "0d0h0m0s", "3h1d", "1.5h", "-1h", "366d", "100000000000h", "9" * 40,
+]
+# characters random inputs are drawn from, mostly grammar characters so the fuzzer gets past the first symbol
+FUZZ_ALPHABET = "0123456789.,mkMKdhrs -e١ x"
+
+#######################################
+# MICRO-BENCHMARK
+#######################################
+def _bench(function: Callable[[str], object], inputs: List[str], iterations: int, cold: bool) -> float:
+	"""
+	Mean seconds per call, `cold` clears the cache before every pass over the inputs
+	"""
+	passes = max(1, iterations // len(inputs))
+	elapsed = 0.0
+	for _ in range(passes):
+		if cold:
+			parsing._parse_amount.cache_clear()
+			parsing._parse_duration.cache_clear()
+		started = time.perf_counter()
+		for value in inputs:
+			try:
+				function(value)
+			except ParseError:
+				pass
+		elapsed += time.perf_counter() - started
+	return elapsed / (passes * len(inputs))
+
+def benchmark(iterations: int) -> List[List]:
+	rows = []
+	for name, function, corpus in (("amount", parse_amount, AMOUNT_CORPUS), ("duration", parse_duration, DURATION_CORPUS)):
+		for cold in (True, False):
+			seconds = _bench(function, corpus, iterations, cold)
+			rows.append([name, "uncached" if cold else "cached", f"{seconds * 1e6:.2f}", f"{1 / seconds:,.0f}"])
+	return rows
+
+#######################################
+# FUZZING
+#######################################
+def _random_number(rng: random.Random, fractions: bool) -> Tuple[str, float]:
+	whole = rng.randint(0, 999)
+	if fractions and rng.random() < 0.3:
+		fraction = rng.randint(0, 99)
+		return f"{whole}.{fraction:02d}", whole + fraction / 100
+	return str(whole), whole
+
+def _valid_amount(rng: random.Random) -> Tuple[str, int]:
+	text, total = "", 0.0
+	for suffix, multiplier in (("m", 1_000_000), ("k", 1_000), ("", 1)):
+		if rng.random() < 0.5:
+			# hundredths of a k or m are whole Gil, of a single Gil they are not
+			number, value = _random_number(rng, fractions=bool(suffix))
+			text += number + (suffix.upper() if rng.random() < 0.2 else suffix)
+			total += value * multiplier
+	if rng.random() < 0.2:
+		text = f" {text} "
+	return text, round(total)
+
+def _valid_duration(rng: random.Random) -> Tuple[str, timedelta]:
+	text, seconds = "", 0
+	for suffix, unit in (("d", 86400), (rng.choice(["h", "hr"]), 3600), ("m", 60), ("s", 1)):
+		if rng.random() < 0.5:
+			value = rng.randint(0, 99)
+			text += f"{value}{suffix}"
+			seconds += value * unit
+	return text, timedelta(seconds=seconds)
+
+def _check(function: Callable[[str], object], value: str, expected: Optional[object], valid: Callable[[object], bool]) -> Optional[str]:
+	"""
+	The failure for one input, None when the parser behaved
+	"""
+	try:
+		result = function(value)
+	except ParseError:
+		if expected is not None and valid(expected):
+			return f"{value!r} was rejected, expected {expected!r}"
+		return None
+	except Exception as e:
+		return f"{value!r} raised {type(e).__name__}: {e}"
+
+	if not valid(result):
+		return f"{value!r} parsed to out of range {result!r}"
+	if expected is not None and result != expected:
+		return f"{value!r} parsed to {result!r}, expected {expected!r}"
+	# a cached result has to match a fresh one
+	if function(value) != result:
+		return f"{value!r} parsed differently the second time"
+	return None
+
+def fuzz(count: int, seed: int) -> Tuple[int, List[str]]:
+	rng = random.Random(seed)
+	valid_amount = lambda amount: isinstance(amount, int) and 0 < amount <= MAX_AMOUNT
+	valid_duration = lambda duration: isinstance(duration, timedelta) and timedelta(0) < duration <= MAX_DURATION
+
+	cases = [(parse_amount, value, None, valid_amount) for value in AMOUNT_CORPUS]
+	cases += [(parse_duration, value, None, valid_duration) for value in DURATION_CORPUS]
+	for _ in range(count):
+		roll = rng.random()
+		if roll < 0.25:
+			cases.append((parse_amount, *_valid_amount(rng), valid_amount))
+		elif roll < 0.5:
+			cases.append((parse_duration, *_valid_duration(rng), valid_duration))
+		else:
+			value = "".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 14)))
+			function, valid = (parse_amount, valid_amount) if roll < 0.75 else (parse_duration, valid_duration)
+			cases.append((function, value, None, valid))
+
+	failures = [failure for failure in (_check(*case) for case in cases) if failure is not None]
+	return len(cases), failures
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--iterations", type=int, default=100_000, help="parser calls timed per row")
+	parser.add_argument("--fuzz", type=int, default=100_000, help="random inputs checked, 0 to skip")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	print(tabulate(benchmark(args.iterations), headers=["Parser", "Cache", "us/call", "Calls/s"]))
+	if args.fuzz:
+		checked, failures = fuzz(args.fuzz, args.seed)
+		print(f"\nFuzzed {checked} inputs with seed {args.seed}, {len(failures)} failure(s)")
+		for failure in failures[:20]:
+			print(f"  {failure}")
+		sys.exit(1 if failures else 0)
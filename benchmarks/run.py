@@ -0,0 +1,174 @@
+#!/bin/python3
+# Offline benchmarks of the bid, check in and expiry paths against a fake Discord client.
+# Run from the repository root: python -m benchmarks.run [--scenario bids] [--latency 0.02]
+import argparse
+import asyncio
+import random
+import time
+
+import config
+
+from benchmarks.fakes import FakeBot, FakeChannel, FakeInteraction
+from cogs.auction import _place_bid
+from benchmarks.harness import environment, Recorder, Result, BENCHMARK_CONFIG, HEADERS
+from benchmarks.harness import AUCTION_CHANNEL_ID, AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID, AUCTION_STATUS_TAGS
+from benchmarks.harness import FORUM_CHANNEL_ID, NOTIFICATION_CHANNEL_ID, ROOM_STATUS_TAGS, ROOM_TYPE_TAGS
+from contextlib import contextmanager
+from src import auction, auto_reception
+from src.cache import entity_cache
+from src.messages import edit_coalescer
+from src.outbound import outbound
+from src.telemetry import telemetry
+from tabulate import tabulate
+from typing import Dict, List
+
+#######################################
+# SETUP
+#######################################
+def make_bot(latency: float) -> FakeBot:
+	bot = FakeBot(latency)
+	bot.add_channel(FORUM_CHANNEL_ID, "rooms", [*ROOM_STATUS_TAGS.values(), *ROOM_TYPE_TAGS.values()])
+	bot.add_channel(AUCTION_CHANNEL_ID, "auctions", AUCTION_STATUS_TAGS.values())
+	bot.add_channel(NOTIFICATION_CHANNEL_ID, "notifications")
+	bot.add_channel(AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID, "auction announcements")
+	entity_cache.bind(bot)
+	return bot
+
+async def make_rooms(bot: FakeBot, count: int, end_time: int) -> List[FakeChannel]:
+	threads = []
+	for i in range(count):
+		thread = bot.add_channel(2000 + i, f"Room {i}")
+		thread._applied_tags = [ROOM_TYPE_TAGS["vanilla"], ROOM_STATUS_TAGS["occupied"]]
+		message = thread.add_message(bot.user, "Check out time")
+		await auto_reception.check_in(auto_reception.CheckInData(thread.id, message, 3000 + i, 3600, end_time, thread_name=thread.name))
+		threads.append(thread)
+	return threads
+
+async def make_auctions(bot: FakeBot, count: int, end_time: int, bids: int=0, messages: int=0) -> List[FakeChannel]:
+	announcements = bot.get_channel(AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID)
+	threads = []
+	for i in range(count):
+		thread = bot.add_channel(4000 + i, f"Auction {i}")
+		thread._applied_tags = [AUCTION_STATUS_TAGS["in_progress"]]
+		info = thread.add_message(bot.user, "Auction info")
+		price = thread.add_message(bot.user, "Current bid")
+		announcement = announcements.add_message(bot.user, "An auction has started")
+		for _ in range(messages):
+			thread.add_message(bot.user, "Auction message")
+
+		async with config.queue_db.transaction() as tx:
+			await tx.execute(
+				"insert into auction(thread_id, end_time, bid_increment, bid_current, bid_count, last_bid_user_id) values (?, ?, ?, ?, ?, ?)",
+				(thread.id, end_time, 100, 1_000 + 100 * bids, bids, 5000 + bids if bids else -1)
+			)
+			await tx.execute("insert into auction_info values (?, ?, ?, ?)", (thread.id, info.id, price.id, announcement.id))
+			for bid in range(bids):
+				await auction.add_auction_bid(tx, thread.id, 5000 + bid, 100, 1_000 + 100 * (bid + 1), False)
+		threads.append(thread)
+	return threads
+
+@contextmanager
+def timed(module, name: str, recorder: Recorder):
+	"""
+	Time every call of module.name as one operation while in scope
+	"""
+	function = getattr(module, name)
+	setattr(module, name, lambda *args, **kwargs: recorder.time(function, *args, **kwargs))
+	try:
+		yield
+	finally:
+		setattr(module, name, function)
+
+async def drain(bot: FakeBot) -> None:
+	while len(edit_coalescer) or edit_coalescer._tasks:
+		await asyncio.sleep(0.01)
+	await telemetry.close()
+
+#######################################
+# SCENARIOS
+#######################################
+async def bids(args) -> Result:
+	bot = make_bot(args.latency)
+	threads = await make_auctions(bot, args.auctions, int(time.time()) + 3600)
+	users = [bot.add_user(6000 + i) for i in range(args.bidders)]
+	rng = random.Random(args.seed)
+
+	async def bid(delay: float):
+		await asyncio.sleep(delay)
+		await recorder.time(_place_bid, FakeInteraction(bot, rng.choice(users), rng.choice(threads)), "")
+
+	with Recorder(f"{args.bids} bids / {args.duration:g}s / {args.auctions} auctions") as recorder:
+		await asyncio.gather(*[bid(args.duration * i / args.bids) for i in range(args.bids)])
+	await drain(bot)
+	recorder.result.requests = bot.http.calls
+	return recorder.result
+
+async def check_ins(args) -> Result:
+	bot = make_bot(args.latency)
+	with Recorder(f"{args.rooms} check ins") as recorder, timed(auto_reception, "check_in", recorder):
+		await make_rooms(bot, args.rooms, int(time.time()) + 3600)
+		await drain(bot)
+	recorder.result.requests = bot.http.calls
+	return recorder.result
+
+async def room_expiry(args) -> Result:
+	bot = make_bot(args.latency)
+	await make_rooms(bot, args.rooms, int(time.time()) - 1)
+	await drain(bot)
+	bot.http.calls.clear()
+
+	with Recorder(f"{args.rooms} rooms expiring") as recorder, timed(auto_reception, "_expire_room", recorder):
+		await auto_reception.room_task(bot)
+		await drain(bot)
+	recorder.result.requests = bot.http.calls
+	return recorder.result
+
+async def auction_close(args) -> Result:
+	bot = make_bot(args.latency)
+	await make_auctions(bot, args.auctions, int(time.time()) - 1, bids=args.auction_bids, messages=args.auction_messages)
+	bot.http.calls.clear()
+
+	with Recorder(f"{args.auctions} auctions closing") as recorder, timed(auction, "_expire_auction", recorder):
+		await auction.auction_task(bot)
+		await drain(bot)
+	recorder.result.requests = bot.http.calls
+	return recorder.result
+
+SCENARIOS: Dict = {
+	"bids": bids,
+	"check_in": check_ins,
+	"room_expiry": room_expiry,
+	"auction_close": auction_close,
+}
+
+async def main(args) -> List[Result]:
+	results = []
+	for name in (SCENARIOS if args.scenario == "all" else [args.scenario]):
+		with environment():
+			results.append(await SCENARIOS[name](args))
+		await outbound.close()
+	return results
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+	parser.add_argument("--latency", type=float, default=0.02, help="seconds every fake Discord request takes")
+	parser.add_argument("--bids", type=int, default=500)
+	parser.add_argument("--duration", type=float, default=10, help="seconds the bids are spread over")
+	parser.add_argument("--auctions", type=int, default=20)
+	parser.add_argument("--bidders", type=int, default=50)
+	parser.add_argument("--rooms", type=int, default=200)
+	parser.add_argument("--auction-bids", type=int, default=25, help="bids already made on each closing auction")
+	parser.add_argument("--auction-messages", type=int, default=30, help="bot messages to clean up in each closing auction")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--verbose", action="store_true", help="keep the bot's info logs")
+	args = parser.parse_args()
+
+	if not args.verbose:
+		# config.setup applies the logging level of the config
+		BENCHMARK_CONFIG["logging"] = {"level": "WARNING"}
+
+	results = asyncio.run(main(args))
+	print(tabulate([result.row() for result in results], headers=HEADERS))
+	for result in results:
+		print(f"\n{result.scenario}: " + ", ".join(f"{name} x{count}" for name, count in sorted(result.requests.items())))
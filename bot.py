@@ -1,6 +1,7 @@
 #!/bin/python3
 import asyncio, discord, argparse
 import logging
+import time
 import traceback
 
 import config
@@ -8,11 +9,19 @@ import config
 from cogs import *
 from cogs.admin import trigger_event
 from cogs.auction import BidView
-from datetime import datetime
-from discord.ext import commands, tasks
-from logger import logger
+from discord.ext import commands
+from logger import logger, stop_logging
 from src.auction import auction_task
-from src.auto_reception import room_task
+from src.auto_reception import load_queue_size, room_task
+from src.cache import entity_cache
+from src.honeypot import honeypot
+from src.metrics import metrics_server, COMMAND_LATENCY
+from src.outbound import outbound
+from src.profiling import profiler
+from src.report import nightly_report
+from src.scheduler import scheduler, trigger_engine, ROOM, AUCTION
+from src.startup import check_forum_tags, command_tree_hash, get_state, set_state, StartupTimer, COMMAND_TREE_HASH
+from src.telemetry import telemetry
 
 bot_intents = discord.Intents(
 	members=True,
@@ -22,57 +31,73 @@ bot_intents = discord.Intents(
 	message_content=True,
 )
 
-class Bot(commands.Bot):
+# one process serves every guild in config.GUILDS, Discord decides the shard count from the number of guilds
+class Bot(commands.AutoShardedBot):
 	def __init__(self, **kwargs):
 		super().__init__(**kwargs)
-		# TODO: add loop exception
-		# self.queue_checker.add_exception_type(AttributeError)
 
 	async def setup_hook(self) -> None:
-		active_auctions = config.queue_cursor.execute(f"""
-				select auction_info.message_id
-				from auction
-				join auction_info where auction.thread_id = auction_info.thread_id;
-			""").fetchall()
-
-		# set up known auctions to the bot to interact with
-		# in the case when the bot was restarted
-		for message_id in active_auctions:
+		timer = StartupTimer()
+		entity_cache.bind(self)
+		if config.METRICS_ENABLED:
+			with timer.phase("metrics"):
+				await metrics_server.start(config.METRICS_HOST, config.METRICS_PORT)
+
+		# a tag of another guild's forum would fail every room and auction update, refuse to start instead
+		with timer.phase("forum tags"):
+			await check_forum_tags(self)
+
+		# the bid buttons have static custom ids, one persistent view handles them on every auction
+		# including those started before a restart
+		with timer.phase("views"):
 			self.add_view(BidView())
 
-		self.queue_checker.start()
-		await self.tree.sync()
+		with timer.phase("state"):
+			await asyncio.gather(nightly_report.load(), load_queue_size(), scheduler.load(), trigger_engine.load())
 
-	@tasks.loop(seconds=10)
-	async def queue_checker(self):
-		# check check-in data
-		# remove all check in data after time expired
+		# rooms and auctions are expired by the deadline scheduler
+		scheduler.register(ROOM, room_task)
+		scheduler.register(AUCTION, auction_task)
+		self.loop.create_task(scheduler.run(self))
 
-		await room_task(self)
-		await auction_task(self)
+		# the configured events fire at their scheduled times
+		trigger_engine.register(trigger_event)
+		self.loop.create_task(trigger_engine.run(self))
 
-		# event trigger checker
-		time_now: datetime = datetime.now()
-		for event in config.EVENTS_TRIGGER:
-			if not config.EVENTS_TRIGGER[event]['triggered']:
+		profiler.instrument(self.tree)
+		if config.PROFILING_ENABLED:
+			profiler.start(config.PROFILING_INTERVAL, config.PROFILING_PATH)
 
-				# hardcoded special condition for skipping
-				if event in ["open", "close", "last_call"] and datetime.now().weekday() not in [5, 6]:
-					# logger.info(f"event is part of [open, close, last_call] and it is not the weekend, skipping")
-					continue
-
-				event_time: datetime = config.EVENTS_TRIGGER[event]['time']
-				if time_now.hour == event_time.hour and time_now.minute == event_time.minute:
-					await trigger_event(self, event)
-					config.EVENTS_TRIGGER[event]['triggered'] = True
+		# syncing is a slow, rate limited request, only made when the commands changed since the last sync
+		with timer.phase("command tree"):
+			tree_hash = command_tree_hash(self.tree, self.application_id)
+			if tree_hash != await get_state(COMMAND_TREE_HASH):
+				self.loop.create_task(self._sync_commands(tree_hash))
 			else:
-				# resets trigger at 1 am
-				if time_now.hour == 1 and time_now.minute == 0:
-					config.EVENTS_TRIGGER[event]['triggered'] = False
-
-	@queue_checker.before_loop
-	async def queue_checker_before(self):
-		await self.wait_until_ready()
+				logger.info("Command tree is unchanged, skipping sync")
+
+		timer.log()
+
+	async def _sync_commands(self, tree_hash: str) -> None:
+		started = time.perf_counter()
+		try:
+			synced = await self.tree.sync()
+		except discord.HTTPException as e:
+			logger.error(f"Command tree sync failed: {type(e)} {e}")
+			return
+
+		# only remembered once Discord has the commands, a failed sync is retried on the next start
+		await set_state(COMMAND_TREE_HASH, tree_hash)
+		duration_ms = (time.perf_counter() - started) * 1000
+		logger.info(f"Synced {len(synced)} command(s) in {duration_ms:.0f} ms", extra={"duration_ms": round(duration_ms, 1)})
+
+	async def close(self) -> None:
+		await telemetry.close()
+		await honeypot.close()
+		await outbound.close()
+		await metrics_server.close()
+		profiler.stop()
+		await super().close()
 
 bot = Bot(
 	command_prefix=commands.when_mentioned_or("!"),
@@ -83,8 +108,19 @@ bot = Bot(
 @bot.event
 async def on_ready():
 	logger.info(f"Current environment: {config.CURRENT_ENV.name}")
+	logger.info(f"Serving {len(bot.guilds)} guild(s) on {bot.shard_count} shard(s), configured for {len(config.GUILDS)} guild(s)")
 	logger.info("Ready")
 
+@bot.event
+async def on_shard_ready(shard_id: int):
+	logger.info(f"Shard {shard_id + 1}/{bot.shard_count} ready")
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+	# measured from the interaction's creation, so it includes the gateway delay before we saw it
+	latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+	COMMAND_LATENCY.labels(command=command.qualified_name).observe(latency)
+
 @bot.event
 async def on_message(message: discord.Message):
 	if message.author.id != bot.user.id:
@@ -95,7 +131,7 @@ async def on_message(message: discord.Message):
 
 async def main():
 	# load some stuff
-	await bot.add_cog(Room(bot, config.FORUM_CHANNEL_ID, config.ROOM_STATUS_TAGS, config.ROOM_TYPE_TAGS))
+	await bot.add_cog(Room(bot))
 	await bot.add_cog(Check(bot))
 	await bot.add_cog(Misc(bot))
 	await bot.add_cog(Auction(bot))
@@ -112,7 +148,9 @@ if __name__ == '__main__':
 	from src import auto_reception
 
 	asyncio.run(main())
-	bot.run(config.BOT_TOKEN)
+	# discord.py logs through the root logger's queue instead of its own stream handler
+	bot.run(config.BOT_TOKEN, log_handler=None)
 
-	config.queue_connection.commit()
-	config.queue_connection.close()
+	config.queue_db.close()
+	config.telemetry_db.close()
+	stop_logging()
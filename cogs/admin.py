@@ -1,64 +1,75 @@
 import discord
 import config
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from discord import app_commands, Interaction, Client, TextChannel, Message
 from discord.ext import commands
 from logger import logger
 from tabulate import tabulate
 from typing import List
-from pathlib import Path
 
 from src.misc import number_suffix
 
 from src import auto_reception
+from src.cache import entity_cache
+from src.honeypot import honeypot
+from src.outbound import outbound, Priority
+from src.profiling import profiler
+from src.report import nightly_report
+from src.scheduler import trigger_engine
+from src.telemetry import get_daily_usage, get_hourly_usage
 
 #
 # Helper functions
 #
-async def trigger_event(bot: Client, event: str, set_event:bool=False):
+async def trigger_event(bot: Client, event: str, guild_id: int=0, set_event:bool=False):
 	"""
 	manually trigger an event
 
 	Args:
 		bot (Client): The discord client object
 		event (str): the event string
-		set_event (bool): set the event to true when set
+		guild_id (int): the guild whose event it is
+		set_event (bool): record the event's latest scheduled occurrence as fired when set
 
 	Returns:
 		None
 	"""
-	if event in config.EVENTS_TRIGGER:
-		target_channel: TextChannel = await bot.fetch_channel(config.NOTIFICATION_CHANNEL_ID)
-		m = config.EVENTS_TRIGGER[event]["message"]
-		if len(config.EVENTS_TRIGGER[event]['remindee']) > 0:
-			m += "\n-# Also paging " + ', '.join(f"<@&{remindee}>" for remindee in config.EVENTS_TRIGGER[event]['remindee'])
+	guild = config.guild(guild_id)
+	if guild is not None and event in guild.events_trigger:
+		rule = guild.events_trigger[event]
+		target_channel: TextChannel = await entity_cache.channel(guild.notification_channel_id)
+		m = rule.message
+		if len(rule.remindee) > 0:
+			m += "\n-# Also paging " + ', '.join(f"<@&{remindee}>" for remindee in rule.remindee)
 
-		await target_channel.send(m)
+		await outbound.run(Priority.NOTIFICATION, target_channel.id, target_channel.send, m)
 
 		# hard coded this event
 		# TODO: create more dynamic way for this
 		if event == "close":
-			await send_nightly_report(bot)
+			await send_nightly_report(bot, guild.guild_id)
 
-		logger.info(f"Triggering event [{event}]")
+		logger.info(f"Triggering event [{event}] of guild [{guild.guild_id}]")
 		if set_event:
-			logger.info(f"Event [{event}] is now true")
-			config.EVENTS_TRIGGER[event]["triggered"] = True
+			logger.info(f"Event [{event}] of guild [{guild.guild_id}] is now true")
+			await trigger_engine.mark_fired(event, guild.guild_id)
 
-async def send_nightly_report(bot: Client):
+async def send_nightly_report(bot: Client, guild_id: int=0):
 	"""
-	Send a nightly report message to the bot and clears the nighty reporting table
+	Send a nightly report message to the bot and archives the nighty report
 
 	Args:
 		bot (Client): The discord client object
+		guild_id (int): the guild whose night is closed
 
 	Returns:
 		None
 	"""
 
-	target_channel: TextChannel = await bot.fetch_channel(config.NOTIFICATION_CHANNEL_ID)
-	report = config.queue_cursor.execute("SELECT * FROM queue_report").fetchall()
+	target_channel: TextChannel = await entity_cache.channel(config.guild(guild_id).notification_channel_id)
+	# archive and reset the report in one go, so rooms checked in meanwhile count towards the next report
+	report = await nightly_report.close_night(guild_id)
 	today = datetime.today()
 
 	tabulate_table = []
@@ -68,8 +79,11 @@ async def send_nightly_report(bot: Client):
 	ROOM_RATE = 25_000
 	total = 0
 	total_hours = 0
-	for thread_id, hours in report:
-		thread_name = bot.get_channel(thread_id).name
+	for thread_id, thread_name, hours in report:
+		if thread_name is None:
+			# rows from before names were stored
+			thread = bot.get_channel(thread_id)
+			thread_name = thread.name if thread is not None else f"Room {thread_id}"
 		room_total = int(ROOM_RATE * hours)
 
 		tabulate_table.append([thread_name, hours, room_total])
@@ -81,10 +95,18 @@ async def send_nightly_report(bot: Client):
 	m += f"{tabulate(tabulate_table, headers=['Room', 'Hours', 'Night Total'])}"
 	m += "```"
 
-	config.queue_cursor.execute("delete from queue_report;")
-	config.queue_connection.commit()
+	await outbound.run(Priority.REPORT, target_channel.id, target_channel.send, m)
 
-	await target_channel.send(m)
+def is_bot_owner():
+	"""
+	Check that only lets the bot's owner (or team members) use a command, for commands that act on the whole process
+
+	Returns:
+		Callable - the app command check decorator
+	"""
+	async def predicate(interaction: Interaction) -> bool:
+		return await interaction.client.is_owner(interaction.user)
+	return app_commands.check(predicate)
 #
 # DISCORD COMMANDS
 #
@@ -95,17 +117,27 @@ class Check(commands.Cog):
 		self.bot.tree.add_command(CheckGroup(name="check", description="Check bot information while it is running"))
 
 class CheckGroup(app_commands.Group):
+	async def interaction_check(self, interaction: Interaction) -> bool:
+		# the queue and usage are the ones of the guild the command is used in
+		return config.guild(interaction.guild_id) is not None
+
 	@app_commands.command(name="queue", description="Check the queue")
 	@app_commands.checks.has_permissions(administrator=True)
 	async def queue(self, interaction: Interaction):
-		checkin_queue = config.queue_cursor.execute("SELECT * FROM queue").fetchall()
+		# rows are matched to guilds like the expiry does, rows without a guild belong to the first venue
+		guild = config.guild(interaction.guild_id)
+		checkin_queue = [
+			(thread_id, end_time, cc_user_id)
+			for thread_id, end_time, cc_user_id, guild_id in await config.queue_db.read.fetchall("SELECT thread_id, end_time, cc_user, guild_id FROM queue")
+			if config.guild(guild_id) is guild
+		]
 
 		m = f"**Current queue has {len(checkin_queue)} items**\n"
 
 		# change to raw
 		tabulate_table = []
 		table_title = ["Room", "Checkout Time", "CC User"]
-		for thread_id, message_id, user_id, end_time, cc_user_id, is_reservation in checkin_queue:
+		for thread_id, end_time, cc_user_id in checkin_queue:
 			thread_name = interaction.guild.get_thread(thread_id).name
 			cc_user = interaction.client.get_user(cc_user_id)
 
@@ -118,18 +150,55 @@ class CheckGroup(app_commands.Group):
 		m += f"```{tabulate(tabulate_table, headers=table_title)}```"
 		await interaction.response.send_message(m)
 
+	@app_commands.command(name="usage", description="Check room usage per day, or per hour of the last day")
+	@app_commands.checks.has_permissions(administrator=True)
+	@app_commands.describe(
+		days="How many days to show, including today",
+		hourly="Show the last 24 hours per hour instead"
+	)
+	async def usage(self, interaction: Interaction, days: app_commands.Range[int, 1, 31]=7, hourly: bool=False):
+		guild = config.guild(interaction.guild_id)
+		now = datetime.now()
+		if hourly:
+			since = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=23)
+			rows = await get_hourly_usage(int(since.timestamp()), guild_id=guild.guild_id)
+			bucket_format = '%a %I %p'
+		else:
+			since = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+			rows = await get_daily_usage(int(since.timestamp()), guild_id=guild.guild_id)
+			bucket_format = '%a %b %d'
+
+		# rented hours are sold time, occupied hours end at the check out
+		tabulate_table = [
+			[datetime.fromtimestamp(bucket).strftime(bucket_format), check_ins, extensions, check_outs, reservations, round(hours, 1), round(occupied_hours, 1)]
+			for bucket, check_ins, extensions, check_outs, reservations, hours, occupied_hours in rows
+		]
+		table_title = ["Hour" if hourly else "Day", "Check ins", "Extensions", "Check outs", "Reservations", "Rented h", "Occupied h"]
+		await interaction.response.send_message(f"```{tabulate(tabulate_table, headers=table_title)}```", ephemeral=True)
+
+	# the profiler samples every guild the process serves and writes to its disk
+	@app_commands.command(name="profiling", description="Start or stop profiling commands and background tasks")
+	@is_bot_owner()
+	async def profiling(self, interaction: Interaction, enabled: bool):
+		if enabled:
+			profiler.start(config.PROFILING_INTERVAL, config.PROFILING_PATH)
+			await interaction.response.send_message("Profiling started.", ephemeral=True)
+		else:
+			path = profiler.stop()
+			await interaction.response.send_message(
+				f"Profile written to `{path}`." if path is not None else "Profiling was not running.",
+				ephemeral=True
+			)
+
 
 async def auto_complete_triggers(interaction: Interaction, current: str) -> List[app_commands.Choice[str]]:
-	return [app_commands.Choice(name=choice_value, value=choice_value) for choice_value in config.EVENTS_TRIGGER.keys()]
+	guild = config.guild(interaction.guild_id)
+	events = guild.events_trigger.keys() if guild is not None else []
+	return [app_commands.Choice(name=choice_value, value=choice_value) for choice_value in events]
 
 class Misc(commands.Cog):
 	def __init__(self, bot):
 		self.bot: commands.Bot = bot
-		self.spammer_content_directory = "spammer_content"
-		self.spammer_content_path: Path = Path.cwd() / self.spammer_content_directory
-
-		if not self.spammer_content_path.exists():
-			self.spammer_content_path.mkdir()
 
 	@app_commands.command(name="trigger", description="Manually trigger an event")
 	@app_commands.autocomplete(
@@ -138,50 +207,13 @@ class Misc(commands.Cog):
 	async def trigger(self, interaction: Interaction, trigger: str):
 		logger.info(f"Manually triggering event [{trigger}]")
 		await interaction.response.send_message("Done", delete_after=5)
-		await trigger_event(self.bot, trigger)
+		await trigger_event(self.bot, trigger, interaction.guild_id)
 
 	@commands.Cog.listener()
 	async def on_message(self, message: Message):
 
 		# setup honey pot
-		if message.channel.id == config.HONEYPOT_CHANNEL_ID:
-			author = message.author
-			message_time = message.created_at
-
-			spammer_content_filename = self.spammer_content_path / f"{author.id}.txt"
-			logger.info(f"Spammer detected as {author.display_name} ({author.name}, ID: {author.id})")
-
-			with spammer_content_filename.open("a+") as f:
-				f.write(f"at {message_time.ctime()} ({message_time})\n")
-				f.write(message.content)
-				f.write("\n\n")
-
-			logger.info(f"Spammer content has been saved to {spammer_content_filename}")
-			server_owner_id = message.guild.owner_id
-			server_owner = self.bot.get_user(server_owner_id)
-			try:
-
-				# send message to user, in case that if the user is a real user
-				await author.send((
-					"Hello,\n"
-					f"If you are receiving this message, you have been banned from `{message.guild.name}` for "
-					"**suspicions of being a spam bot**.\n\n"
-					f"If you think this ban was made in error, please contact {server_owner.display_name} (`{server_owner.name}`)."
-				))
-				await author.ban(delete_message_days=7, reason="Auto-mod banned via honeypot channel.")
-
-				# send message to server owner, notifying of auto ban
-				await server_owner.send((
-					"## A user was banned via honeypot channel.\n"
-					f"User {author.display_name} ({author.name}, ID: {author.id}) was banned.\n"
-					"Message conntent (up to 200 characters):\n"
-					f"`{message.content[:200]}`"
-				))
-			except discord.Forbidden:
-				await server_owner.send((
-					"## A user sent a message in the honeypot channel.\n"
-					"### I do not have persmission to ban them.\n"
-					f"User {author.display_name} ({author.name}, ID: {author.id}) was typing in the honeypot channel.\n\n"
-					"Message conntent (up to 200 characters):\n"
-					f"`{message.content[:200]}`"
-				))
+		# bans, evidence and the owner's digest are batched so a raid does not flood the event loop
+		guild = config.guild(message.guild.id) if message.guild is not None else None
+		if guild is not None and message.channel.id == guild.honeypot_channel_id:
+			honeypot.catch(message)
@@ -8,8 +8,13 @@ from discord.ext import commands
 from icecream import ic
 from logger import logger
 from typing import List
-from src.misc import number_abbreviation_parser, parse_duration
-from src.auction import create_auction_history_table, get_auction_info, remove_auction
+from src.auction import clear_auction_history, get_auction_info, get_top_bids, place_bid, remove_auction, BidStatus, MAX_BID_MULTIPLIER
+from src.cache import entity_cache
+from src.messages import delete_bot_messages, edit_coalescer, message_cache
+from src.metrics import timed, BID_LATENCY, BIDS
+from src.outbound import outbound, Priority
+from src.parsing import parse_amount, parse_duration, ParseError
+from src.scheduler import scheduler, AUCTION
 
 
 #####################################################################
@@ -48,19 +53,7 @@ class CustomBidModel(discord.ui.Modal, title='Auction Bid'):
 	)
 
 	async def on_submit(self, interaction: discord.Interaction):
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
-		# checking to see if this thread has an auction in it
-		thread_ids = config.queue_cursor.execute(f"""
-				select thread_id, bid_increment, bid_current
-				from auction
-				where thread_id = {thread.id}
-			""").fetchall()
-		_, bid_increment, bid_current = thread_ids[0]
-
-		if number_abbreviation_parser(self.bid_amount_input.value) > bid_current * 3:
-			await interaction.response.send_message(f"You cannot bid more than 3 times the current bid!\nMaximum bid right now: `{bid_current*3:,}` Gil", ephemeral=True)
-		else:
-			await _place_bid(interaction, bid_amount=self.bid_amount_input.value)
+		await _place_bid(interaction, bid_amount=self.bid_amount_input.value)
 
 	async def on_error(self, interaction: discord.Interaction, error: Exception) -> None:
 		await interaction.response.send_message('Oops! Something went wrong.', ephemeral=True)
@@ -86,6 +79,7 @@ class BidView(ui.View):
 #####################################################################
 
 
+@timed(BID_LATENCY)
 async def _place_bid(interaction: Interaction, bid_amount: str=""):
 	"""
 	Place a bid in an active auction
@@ -96,148 +90,116 @@ async def _place_bid(interaction: Interaction, bid_amount: str=""):
 	Returns:
 
 	"""
-	thread = await interaction.guild.fetch_channel(interaction.channel_id)
-	# checking to see if this thread has an auction in it
-	auction_data = get_auction_info(thread, ["bid_increment", "bid_current", "bid_count", "last_bid_user_id", "message_id"])
-	if not auction_data:
+	thread = await entity_cache.channel(interaction.channel_id)
+
+	# user made custom bid
+	custom_bid = None
+	if len(bid_amount) > 0:
+		try:
+			# try to parse bid
+			custom_bid = parse_amount(bid_amount)
+		except ParseError as e:
+			# can't parse
+			BIDS.labels(status="unparseable").inc()
+			await interaction.response.send_message(
+				f"I am having trouble understanding the value `{bid_amount}`, {e.reason}. Please try again.",
+				ephemeral=True
+			)
+			return
+
+	result = await place_bid(thread.id, interaction.user.id, custom_bid)
+	BIDS.labels(status=result.status.name.lower()).inc()
+
+	if result.status == BidStatus.NO_AUCTION:
 		await interaction.response.send_message(
 			"There is no auction in this thread. Please navigate to an active auction.",
 			ephemeral=True
 		)
 		return
-
-	# parsing bid
-	bid_increment, bid_current, bid_count, last_bid_user_id, msg_id= auction_data[0]
-	set_fix_value = False
-
-	# checking to see if user was the last person who place a bid
-	if last_bid_user_id == interaction.user.id:
+	elif result.status == BidStatus.ENDED:
+		await interaction.response.send_message(
+			"This auction has ended. No more bids are accepted.",
+			ephemeral=True
+		)
+		return
+	elif result.status == BidStatus.DOUBLE_BID:
 		await interaction.response.send_message(
 			"You are the current bidder. You cannot double bid!",
 			ephemeral=True
 		)
 		return
+	elif result.status == BidStatus.TOO_LOW:
+		# check to see if bid is larger than current bid
+		await interaction.response.send_message(
+			f"This amount must be larger than the current bid!\n"
+			f"You bid: `{result.bid_amount:,}`\n"
+			f"Current bid: `{result.bid_current:,}`",
+			ephemeral=True
+		)
+		return
+	elif result.status == BidStatus.BELOW_INCREMENT:
+		# check to see if bid is larger than increment bid
+		await interaction.response.send_message(
+			f"This amount must be larger than the increment bid!\n"
+			f"You bid: `{result.bid_amount:,}`\n"
+			f"Current bid: `{result.bid_current:,}`\n"
+			f"--------------------------\n"
+			f"Difference: `{result.bid_amount - result.bid_current:,}`\n"
+			f"Incremental bid: `{result.bid_increment:,}`",
+			ephemeral=True
+		)
+		return
+	elif result.status == BidStatus.TOO_HIGH:
+		await interaction.response.send_message(
+			f"You cannot bid more than {MAX_BID_MULTIPLIER} times the current bid!\n"
+			f"Maximum bid right now: `{result.bid_current * MAX_BID_MULTIPLIER:,}` Gil",
+			ephemeral=True
+		)
+		return
+	elif result.status == BidStatus.CONFLICT:
+		await interaction.response.send_message(
+			"The auction changed while your bid was being placed. Please try again.",
+			ephemeral=True
+		)
+		return
 
-	# user made custom bid
-	if len(bid_amount) > 0:
-		try:
-			# try to parse bid
-			if "," in bid_amount:
-				bid_amount = bid_amount.replace(",", "")
-
-			bid_amount = number_abbreviation_parser(bid_amount)
-
-			if bid_amount <= bid_current:
-				# check to see if bid is larger than current bid
-				await interaction.response.send_message(
-					f"This amount must be larger than the current bid!\n"
-					f"You bid: `{bid_amount:,}`\n"
-					f"Current bid: `{bid_current:,}`",
-					ephemeral=True
-				)
-				return
-			elif bid_amount - bid_current < bid_increment:
-				# check to see if bid is larger than increment bid
-				await interaction.response.send_message(
-					f"This amount must be larger than the increment bid!\n"
-					f"You bid: `{bid_amount:,}`\n"
-					f"Current bid: `{bid_current:,}`\n"
-					f"--------------------------\n"
-					f"Difference: `{bid_amount - bid_current:,}`\n"
-					f"Incremental bid: `{bid_increment:,}`",
-					ephemeral=True
-				)
-				return
-
-			# user's custom bid is valid
-			set_fix_value = True
-			await interaction.response.send_message(
-				f"You have raise the bid to `{bid_amount:,}`!",
-				ephemeral=True
-			)
-		except ValueError:
-			# can't parse
-			await interaction.response.send_message(
-				f"I am having trouble understanding the value `{bid_amount}`. Please try again.",
-				ephemeral=True
-			)
-			return
+	# bid was accepted
+	# edit price message
+	# edits are coalesced, during a bidding war only the latest price is sent once per interval.
+	# they are scheduled before the first await, so an expiry waiting on the bid lock flushes them before the auction closes
+	edit_coalescer.schedule(thread, result.message_id, content=
+		f"Current bid: `{result.bid_current:,}` Gil\n"
+		f"{result.bid_count} Bid{'' if result.bid_count == 1 else 's'}"
+	)
+
+	# edit announcement message
+	guild = config.guild(interaction.guild_id)
+	auction_announcement_chn = interaction.client.get_partial_messageable(guild.auction_public_notifier_channel_id)
+	edit_coalescer.schedule(auction_announcement_chn, result.notification_id, content=
+		f"## An auction has been extended!\n"
+		f"<#{thread.id}>. Currently at `{result.bid_current:,}` Gil.\n"
+		f"Ends on <t:{result.end_time}:f> (<t:{result.end_time}:R>)\n"
+		f"-# <@&{guild.role_notification_id['auction']}>"
+	)
+
+	if custom_bid is not None:
+		await interaction.response.send_message(
+			f"You have raise the bid to `{result.bid_current:,}`!",
+			ephemeral=True
+		)
 	else:
-		if bid_count == 0:
-			# user made the initial bid, set their bid as the current bid
-			bid_amount = bid_current
-			set_fix_value = True
-			await interaction.response.send_message(
-				f"You have made a bid for `{bid_current:,}`!",
-				ephemeral=True
-			)
-		else:
-			# user made normal bid
-			bid_amount = bid_increment
-			await interaction.response.send_message(
-				f"You have made a bid for `{bid_current + bid_amount:,}`!",
-				ephemeral=True
-			)
-	new_bid_value = bid_amount if set_fix_value else bid_current + bid_amount
-	# update master record
-	config.queue_cursor.execute(f"""
-						update auction
-						set 
-							bid_current = {new_bid_value},
-							last_bid_user_id = {interaction.user.id},
-							bid_count = bid_count + 1
-						where thread_id = {thread.id}
-					""")
-	# add to bid history
-	config.queue_cursor.execute(f"""
-						INSERT INTO auction_history_{thread.id}(user_id, bid, current_bid, set_bid)
-						VALUES (?, ?, ?, ?)
-					""", (interaction.user.id, bid_amount, new_bid_value, set_fix_value))
-	config.queue_connection.commit()
+		await interaction.response.send_message(
+			f"You have made a bid for `{result.bid_current:,}`!",
+			ephemeral=True
+		)
 
 	# log bid
 	logger.info(
 		f"[{interaction.channel.name}] has a bid for "
-		f"[{bid_amount:,} Gil] "
+		f"[{result.bid_amount:,} Gil] "
 		f"by [{interaction.user.global_name} ({interaction.user.name}, {interaction.user.id})]. "
-		f"Current total is {new_bid_value:,}."
-	)
-
-	# edit price message
-	msgs = thread.history()
-	msg_to_edit = [m async for m in msgs if m.id == msg_id]
-	if len(msg_to_edit) == 0:
-		await interaction.channel.send(
-			"Fatal error has occurred. Current price message is not found.\n"
-			"-# Paging <@1082827074189930536>"
-		)
-		return
-
-	notification_channels = get_auction_info(thread, ["notification_id", "end_time"])
-	if len(notification_channels) == 0:
-		await interaction.channel.send(
-			"An error has occurred. Current price message is not found.\n"
-			"-# Paging <@1082827074189930536>"
-		)
-		return
-	if len(notification_channels) == 1:
-		auction_announcement_chn = await interaction.guild.fetch_channel(config.AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID)
-		history = auction_announcement_chn.history()
-		chn_id, end_time = notification_channels[0]
-
-		_, end_time = parse_duration(end_time, datetime.fromtimestamp(end_time))
-		
-		msg = [m async for m in history if m.id == chn_id][0]
-		await msg.edit(content=
-           f"## An auction has been extended!\n"
-           f"<#{thread.id}>. Currently at `{new_bid_value:,}` Gil.\n"
-           f"Ends on <t:{end_time}:f> (<t:{end_time}:R>)\n"
-           f"-# <@&{config.ROLE_NOTIFICATION_ID['auction']}>"
-       )
-
-	await msg_to_edit[0].edit(
-		content=f"Current bid: `{new_bid_value:,}` Gil\n"
-		        f"{bid_count+1} Bid{'' if bid_count+1 == 1 else 's'}"
+		f"Current total is {result.bid_current:,}.",
+		extra={"thread_id": thread.id, "user_id": interaction.user.id, "amount": result.bid_amount}
 	)
 
 # table columns:
@@ -252,6 +214,10 @@ class Auction(commands.GroupCog):
 	def __init__(self, bot):
 		self.bot: Client = bot
 
+	async def interaction_check(self, interaction: Interaction) -> bool:
+		# the channels, tags and roles come from the guild the command is used in
+		return config.guild(interaction.guild_id) is not None
+
 	@app_commands.command(name="begin", description="Begin auction in this thread")
 	@app_commands.checks.has_permissions(administrator=True)
 	@app_commands.describe(
@@ -261,40 +227,48 @@ class Auction(commands.GroupCog):
 		test_bid="Test bid, does not notify auction role"
 	)
 	async def begin(self, interaction: Interaction, duration: str, starting_bid: str, bid_increment: str, test_bid:bool=False):
-		channel = await interaction.guild.fetch_channel(config.AUCTION_CHANNEL_ID)
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
+		# parse bid values and duration before changing anything
+		try:
+			starting_bid = parse_amount(starting_bid)
+			bid_increment = parse_amount(bid_increment)
+			auction_duration = parse_duration(duration)
+		except ParseError as e:
+			await interaction.response.send_message(f"I am having trouble understanding `{e.value}`, {e.reason}.", ephemeral=True)
+			return
+
+		guild = config.guild(interaction.guild_id)
+		channel = await entity_cache.channel(guild.auction_channel_id)
+		thread = await entity_cache.channel(interaction.channel_id)
 
-		if config.AUCTION_STATUS_TAGS['ready'] not in [t.id for t in thread.applied_tags]:
+		if guild.auction_status_tags['ready'] not in [t.id for t in thread.applied_tags]:
 			# needs ready tag to get able to start
-			tag = channel.get_tag(config.AUCTION_STATUS_TAGS['ready'])
+			tag = channel.get_tag(guild.auction_status_tags['ready'])
 			await interaction.response.send_message(
 				f"This thread needs the [**{tag.emoji} {tag.name}**] tag to begin auction. Please review it before marking it as ready and initializing.",
 				ephemeral=True
 			)
 			return
-		await thread.override_tags(
-			channel.get_tag(config.AUCTION_STATUS_TAGS['in_progress'])
+		await outbound.run(
+			Priority.INTERACTION, thread.id, thread.override_tags,
+			channel.get_tag(guild.auction_status_tags['in_progress'])
 		)
 
 		# checking to see if this thread has an auction in it
-		if get_auction_info(thread, ["thread_id"]):
+		if await get_auction_info(thread, ["thread_id"]):
 			await interaction.response.send_message(
 				"There is an active auction going on. Please wait until the auction ends.",
 				ephemeral=True
 			)
 			return
 
-		# parse bid values
-		starting_bid = number_abbreviation_parser(starting_bid)
-		bid_increment = number_abbreviation_parser(bid_increment)
-
-		# parse duration and set up times
-		auction_duration, auction_endtime_timestamp = parse_duration(duration)
+		# set up times
+		auction_endtime_timestamp = int((datetime.now() + auction_duration).timestamp())
 
 		view = BidView()
 		# send messages
 		await interaction.response.send_message("Request Processing", delete_after=5)
-		auction_info_msg = await interaction.channel.send(
+		auction_info_msg = await outbound.run(
+			Priority.INTERACTION, interaction.channel_id, interaction.channel.send,
 			"# This auction has begun\n"
 			f"## You may bid until <t:{auction_endtime_timestamp}:f>\n"
 			f"## Auction closes <t:{auction_endtime_timestamp}:R>\n"
@@ -302,7 +276,7 @@ class Auction(commands.GroupCog):
 		)
 
 		# send notification
-		chn = await self.bot.fetch_channel(config.AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID)
+		chn = await entity_cache.channel(guild.auction_public_notifier_channel_id)
 		notification_msg_content = (
 			f"## A new auction as started!\n"
 			f"<#{thread.id}>. Starting at `{starting_bid:,}` Gil.\n"
@@ -312,30 +286,32 @@ class Auction(commands.GroupCog):
 		if test_bid:
 			notification_msg_content += "-# This is a test bid, please ignore."
 		else:
-			notification_msg_content += f"-# <@&{config.ROLE_NOTIFICATION_ID['auction']}>"
+			notification_msg_content += f"-# <@&{guild.role_notification_id['auction']}>"
 
-		notification_msg = await chn.send(
+		notification_msg = await outbound.run(
+			Priority.NOTIFICATION, chn.id, chn.send,
 			notification_msg_content
 		)
 
-		msg = await interaction.channel.send(
+		msg = await outbound.run(
+			Priority.INTERACTION, interaction.channel_id, interaction.channel.send,
 			f"Starting bid: `{starting_bid:,}` Gil",
 			view=view
 		)
 
 		# add entry to table
-		config.queue_cursor.execute(f"""
-			INSERT INTO auction (thread_id, end_time, bid_increment, bid_current, bid_count, last_bid_user_id)
-			VALUES (?, ?, ?, ?, ?, ?)
-		""", (thread.id, auction_endtime_timestamp, bid_increment, starting_bid, 0, -1))
-		config.queue_cursor.execute(f"""
-			INSERT INTO auction_info (thread_id, auction_info_msg_id, message_id, notification_id)
-			VALUES (?, ?, ?, ?)
-		""", (thread.id, auction_info_msg.id, msg.id, notification_msg.id))
-		config.queue_connection.commit()
-
-		# initialize history table
-		create_auction_history_table(thread.id)
+		async with config.queue_db.transaction() as tx:
+			# reset bid history left over from a previous auction in this thread
+			await clear_auction_history(tx, thread.id)
+			await tx.execute(f"""
+				INSERT INTO auction (thread_id, end_time, bid_increment, bid_current, bid_count, last_bid_user_id, guild_id)
+				VALUES (?, ?, ?, ?, ?, ?, ?)
+			""", (thread.id, auction_endtime_timestamp, bid_increment, starting_bid, 0, -1, guild.guild_id))
+			await tx.execute(f"""
+				INSERT INTO auction_info (thread_id, auction_info_msg_id, message_id, notification_id)
+				VALUES (?, ?, ?, ?)
+			""", (thread.id, auction_info_msg.id, msg.id, notification_msg.id))
+		scheduler.schedule(AUCTION, thread.id, auction_endtime_timestamp, guild.guild_id)
 
 		# log
 		logger.info(
@@ -348,10 +324,9 @@ class Auction(commands.GroupCog):
 	@app_commands.command(name="cancel", description="Cancel this auction")
 	@app_commands.checks.has_permissions(administrator=True)
 	async def cancel(self, interaction: Interaction, cancel_reason: str):
-		channel = await interaction.guild.fetch_channel(config.AUCTION_CHANNEL_ID)
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
+		thread = await entity_cache.channel(interaction.channel_id)
 		# checking to see if this thread has an auction in it
-		thread_ids = get_auction_info(thread, ['thread_id'])
+		thread_ids = await get_auction_info(thread, ['thread_id'])
 		if not thread_ids:
 			await interaction.response.send_message(
 				"There is no auction in this thread. Please navigate to an active auction.",
@@ -373,17 +348,15 @@ class Auction(commands.GroupCog):
 		if delete_confirmation.value is None:
 			logger.warning("delete_confirmation has timed out.")
 		elif delete_confirmation.value:
-			remove_auction(thread.id)
+			await remove_auction(thread.id)
 
 			# remove tags
-			await thread.override_tags()
+			await outbound.run(Priority.INTERACTION, thread.id, thread.override_tags)
 
 			# remove all of bot's messages in this thread
-			msgs = thread.history()
-			async for m in msgs:
-				if m.author.id == self.bot.user.id:
-					await m.delete()
-			await interaction.channel.send(
+			await delete_bot_messages(thread, self.bot.user.id)
+			await outbound.run(
+				Priority.INTERACTION, interaction.channel_id, interaction.channel.send,
 				"This auction has been cancelled.\nReason: " + ("No reason given" if not cancel_reason else cancel_reason)
 			)
 		else:
@@ -393,11 +366,18 @@ class Auction(commands.GroupCog):
 	@app_commands.command(name="extend", description="Extends the duration of this auction")
 	@app_commands.checks.has_permissions(administrator=True)
 	async def extend(self, interaction: Interaction, duration: str):
-		channel = await interaction.guild.fetch_channel(config.AUCTION_CHANNEL_ID)
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
+		try:
+			extend_duration = parse_duration(duration)
+		except ParseError as e:
+			await interaction.response.send_message(f"I am having trouble understanding `{e.value}`, {e.reason}.", ephemeral=True)
+			return
+
+		guild = config.guild(interaction.guild_id)
+		channel = await entity_cache.channel(guild.auction_channel_id)
+		thread = await entity_cache.channel(interaction.channel_id)
 
 		# check if auction is actually active in backend
-		auction_data = get_auction_info(thread, [
+		auction_data = await get_auction_info(thread, [
 			"thread_id",
 			"auction_info_msg_id",
 			"message_id",
@@ -411,13 +391,13 @@ class Auction(commands.GroupCog):
 			logger.warning(f"Auction {thread.id} does not exists in database.")
 
 		# check to see if auction is active in discord
-		if config.AUCTION_STATUS_TAGS['in_progress'] not in [t.id for t in thread.applied_tags]:
+		if guild.auction_status_tags['in_progress'] not in [t.id for t in thread.applied_tags]:
 			# needs in progress tag to get able to extend
 			logger.info(
 				f"Auction extension attempted by [{interaction.user.global_name} ({interaction.user.name})], but auction is not in progressed, "
 			)
 
-			tag = channel.get_tag(config.AUCTION_STATUS_TAGS['in_progress'])
+			tag = channel.get_tag(guild.auction_status_tags['in_progress'])
 			await interaction.response.send_message(
 				f"This thread needs the [**{tag.emoji} {tag.name}**] tag to extend auction. Please review it before extending it.",
 				ephemeral=True
@@ -426,12 +406,12 @@ class Auction(commands.GroupCog):
 
 		thread_id, auction_info_msg_id, msg_id, notification_id, end_time, bid_increment, current_bid, bid_count = auction_data[0]
 
-		extend_duration, auction_new_timestamp = parse_duration(duration, datetime.fromtimestamp(end_time))
+		auction_new_timestamp = int((datetime.fromtimestamp(end_time) + extend_duration).timestamp())
 
 		# modifying message
-		history = interaction.channel.history()
-		msg = [m async for m in history if m.id == auction_info_msg_id][0]
-		await msg.edit(content=
+		await outbound.run(
+			Priority.INTERACTION, thread.id, message_cache.edit,
+			thread, auction_info_msg_id, content=
 			"# This auction has begun\n"
 			f"## You may bid until <t:{auction_new_timestamp}:f>\n"
 			f"## Auction closes <t:{auction_new_timestamp}:R>\n"
@@ -439,23 +419,26 @@ class Auction(commands.GroupCog):
 		)
 
 		# modifying announcement message
-		auction_announcement_chn = await interaction.guild.fetch_channel(config.AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID)
-		history = auction_announcement_chn.history()
-		msg = [m async for m in history if m.id == notification_id][0]
-		await msg.edit(content=
+		# drop a pending bid update, it still carries the old end time
+		edit_coalescer.discard(notification_id)
+		auction_announcement_chn = self.bot.get_partial_messageable(guild.auction_public_notifier_channel_id)
+		await outbound.run(
+			Priority.INTERACTION, auction_announcement_chn.id, message_cache.edit,
+			auction_announcement_chn, notification_id, content=
 			f"## An auction has been extended!\n"
 			f"<#{thread.id}>. Currently at `{current_bid:,}` Gil.\n"
 			f"Ends on <t:{auction_new_timestamp}:f> (<t:{auction_new_timestamp}:R>)\n"
-			f"-# <@&{config.ROLE_NOTIFICATION_ID['auction']}>"
-        )
+			f"-# <@&{guild.role_notification_id['auction']}>"
+		)
 
 		# updating the auction master table
-		config.queue_cursor.execute(f"""
+		await config.queue_db.execute(f"""
 			update auction
 			set
 				end_time = {auction_new_timestamp}
 			where thread_id = {thread_id}
 		""")
+		scheduler.schedule(AUCTION, thread_id, auction_new_timestamp)
 
 
 		logger.info(
@@ -474,9 +457,9 @@ class Auction(commands.GroupCog):
 	@app_commands.command(name="participants", description="Get all of the participants in bidding order of this auction")
 	@app_commands.checks.has_permissions(administrator=True)
 	async def participants(self, interaction: Interaction):
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
+		thread = await entity_cache.channel(interaction.channel_id)
 
-		_participants = config.queue_cursor.execute(f"select user_id, current_bid from auction_history_{thread.id} order by current_bid desc limit 10;").fetchall()
+		_participants = await get_top_bids(thread.id)
 		if len(_participants) > 0:
 			m = ""
 			for participant_data in _participants:
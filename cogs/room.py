@@ -7,24 +7,25 @@ from icecream import ic
 from logger import logger
 from typing import List
 
+from src.cache import entity_cache
+from src.messages import delete_bot_messages, message_cache
+from src.misc import format_duration
+from src.outbound import outbound, Priority
 from src.auto_reception import check_out, check_in, extension, get_thread_end_times, CheckInData, is_room_occupied
 
 
-async def auto_complete_time(interaction: Interaction, current: str) -> List[app_commands.Choice[timedelta]]:
-	time_choices = [
-		[
-			datetime.strptime(str(timedelta(minutes=config.ROOM_SELECT_DEFAULT_FREQUENCY_TIME*i)), "%H:%M:%S").strftime("%#Hh %#Mm"),
-			i
-		] for i in range(1, config.ROOM_SELECT_DEFAULT_FREQUENCY_COUNT+1)
-	]
-	return [app_commands.Choice(name=choice_name, value=choice_value) for choice_name, choice_value in time_choices]
+async def auto_complete_time(interaction: Interaction, current: str) -> List[app_commands.Choice[int]]:
+	# precomputed in config.setup, typing only filters the table
+	guild = config.guild(interaction.guild_id)
+	return guild.room_time_choices.match(current) if guild is not None else []
 
 class Room(commands.GroupCog):
-	def __init__(self, client, forum_id, room_status_tag_id, room_type_tag_id):
+	def __init__(self, client):
 		self.client = client
-		self.forum_id = forum_id
-		self.room_status_tag_id = room_status_tag_id
-		self.room_type_tag_id = room_type_tag_id
+
+	async def interaction_check(self, interaction: Interaction) -> bool:
+		# the forum, tags and durations come from the guild the command is used in
+		return config.guild(interaction.guild_id) is not None
 
 	#######################################
 	# HELPER FUNCTIONS
@@ -40,23 +41,22 @@ class Room(commands.GroupCog):
 		Returns:
 			None
 		"""
-		channel = await interaction.guild.fetch_channel(self.forum_id)
+		guild = config.guild(interaction.guild_id)
+		channel = await entity_cache.channel(guild.forum_channel_id)
 		thread = interaction.channel
 
 		logger.info(f"[{interaction.channel.name}] status cleared by {interaction.user.global_name} ({interaction.user.name})")
 
-		room_type = list(set(list(self.room_type_tag_id.values())) & set(thread._applied_tags))
-		await thread.override_tags(
+		room_type = list(set(list(guild.room_type_tags.values())) & set(thread._applied_tags))
+		await outbound.run(
+			Priority.INTERACTION, thread.id, thread.override_tags,
 			channel.get_tag(room_type[0]),
-			channel.get_tag(self.room_status_tag_id['available']),
+			channel.get_tag(guild.room_status_tags['available']),
 			reason="Guest Check In"
 		)
-		msg = thread.history()
-		msg_to_delete = [m async for m in msg if m.author.id == self.client.user.id]
-		await thread.delete_messages(msg_to_delete)
-
-		for m in msg_to_delete:
-			check_out(msg_id=m.id)
+		# awaited before the interaction is answered, so it cannot wait behind background cleanup
+		for message_id in await delete_bot_messages(thread, self.client.user.id, priority=Priority.INTERACTION):
+			await check_out(msg_id=message_id)
 
 	#######################################
 	# MAIN COG FUNCTIONS
@@ -73,16 +73,17 @@ class Room(commands.GroupCog):
 	async def occupied(self, interaction: Interaction, time: int, cc_user: discord.User=None):
 		# note: add tags to  thread requires "Send Messages in Posts" (also allow to add messages in that thread)
 		# note: delete messages in thread requires "Manage Messages"
-		channel = await interaction.guild.fetch_channel(self.forum_id)
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
-		room_type = list(set(list(self.room_type_tag_id.values())) & set(thread._applied_tags))
+		guild = config.guild(interaction.guild_id)
+		channel = await entity_cache.channel(guild.forum_channel_id)
+		thread = await entity_cache.channel(interaction.channel_id)
+		room_type = list(set(list(guild.room_type_tags.values())) & set(thread._applied_tags))
 
-		duration = timedelta(minutes=config.ROOM_SELECT_DEFAULT_FREQUENCY_TIME*time)
+		duration = timedelta(minutes=guild.room_select_frequency_time*time)
 		start_time: datetime = interaction.created_at
 		end_time: datetime = start_time + duration
 
 		# check if room is already occupied
-		if is_room_occupied(thread.id):
+		if await is_room_occupied(thread.id):
 			await interaction.response.send_message(
 				"This room is already occupied!",
 				ephemeral=True
@@ -90,38 +91,42 @@ class Room(commands.GroupCog):
 			return
 
 		# check to see if there is a reservation tag
-		if self.room_status_tag_id['reserved'] in thread._applied_tags:
+		if guild.room_status_tags['reserved'] in thread._applied_tags:
 			# reset room statuses before occupying
 			await self._clear_room(interaction)
 
 		try:
 			# add occupied tag and availble time
-			# await thread.remove_tags(channel.get_tag(self.room_status_tag_id['available']), reason="Guest Check In")
-			# await thread.add_tags(channel.get_tag(self.room_status_tag_id['occupied']), reason="Guest Check In")
-			await thread.override_tags(
+			# await thread.remove_tags(channel.get_tag(guild.room_status_tags['available']), reason="Guest Check In")
+			# await thread.add_tags(channel.get_tag(guild.room_status_tags['occupied']), reason="Guest Check In")
+			await outbound.run(
+				Priority.INTERACTION, thread.id, thread.override_tags,
 				channel.get_tag(room_type[0]),
-				channel.get_tag(self.room_status_tag_id['occupied']),
+				channel.get_tag(guild.room_status_tags['occupied']),
 				reason="Guest Check In"
 			)
 			await interaction.response.send_message("Request Processing", delete_after=1, ephemeral=True)
 
-			msg = await interaction.channel.send(f"Available <t:{end_time.timestamp():.0f}:R>")
-			check_in(
+			msg = await outbound.run(Priority.INTERACTION, interaction.channel_id, interaction.channel.send, f"Available <t:{end_time.timestamp():.0f}:R>")
+			await check_in(
 				CheckInData(
 					thread.id,
 					msg,
 					interaction.user.id,
 					duration.total_seconds(),
 					int(end_time.timestamp()),
-					cc_user_id=cc_user.id if cc_user is not None else None
+					cc_user_id=cc_user.id if cc_user is not None else None,
+					thread_name=thread.name,
+					guild_id=guild.guild_id
 				)
 			)
 
 			logger.info(
 				f"[{interaction.channel.name}] is occupied for "
-				f"[{datetime.strptime(str(duration), '%H:%M:%S').strftime('%#Hh %#Mm')}] until "
+				f"[{format_duration(duration)}] until "
 				f"[{end_time.astimezone().strftime('%I:%M:%S %p %z %Z')}] set "
-				f"by [{interaction.user.global_name} ({interaction.user.name})]"
+				f"by [{interaction.user.global_name} ({interaction.user.name})]",
+				extra={"thread_id": interaction.channel_id, "user_id": interaction.user.id}
 			)
 		except (discord.errors.Forbidden, discord.errors.HTTPException) as e:
 			logger.error(f"Exception {type(e)}: {e}")
@@ -130,51 +135,57 @@ class Room(commands.GroupCog):
 	async def reserve(self, interaction: Interaction):
 		# note: add tags to  thread requires "Send Messages in Posts" (also allow to add messages in that thread)
 		# note: delete messages in thread requires "Manage Messages"
-		channel = await interaction.guild.fetch_channel(self.forum_id)
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
-		room_type = list(set(list(self.room_type_tag_id.values())) & set(thread._applied_tags))
+		guild = config.guild(interaction.guild_id)
+		channel = await entity_cache.channel(guild.forum_channel_id)
+		thread = await entity_cache.channel(interaction.channel_id)
+		room_type = list(set(list(guild.room_type_tags.values())) & set(thread._applied_tags))
 
-		duration = timedelta(minutes=config.ROOM_SELECT_DEFAULT_FREQUENCY_TIME * 2)
+		duration = timedelta(minutes=guild.room_select_frequency_time * 2)
 		start_time: datetime = interaction.created_at
 		end_time: datetime = start_time + duration
 
 		# check if this room is already occupied
-		room_occupied = is_room_occupied(thread.id)
+		room_occupied = await is_room_occupied(thread.id)
 
 		if not room_occupied:
 			try:
 				# set reseve tag and availble time
-				await thread.override_tags(
+				await outbound.run(
+					Priority.INTERACTION, thread.id, thread.override_tags,
 					channel.get_tag(room_type[0]),
-					channel.get_tag(self.room_status_tag_id['reserved']),
+					channel.get_tag(guild.room_status_tags['reserved']),
 					reason="Room reservation"
 				)
 				await interaction.response.send_message("Request Processing", delete_after=1, ephemeral=True)
 
-				msg = await interaction.channel.send(f"Reservation ends <t:{end_time.timestamp():.0f}:R>")
-				check_in(
+				msg = await outbound.run(Priority.INTERACTION, interaction.channel_id, interaction.channel.send, f"Reservation ends <t:{end_time.timestamp():.0f}:R>")
+				await check_in(
 					CheckInData(
 						thread.id,
 						msg,
 						interaction.user.id,
 						duration.total_seconds(),
 						int(end_time.timestamp()),
-						is_reservation=True
+						is_reservation=True,
+						thread_name=thread.name,
+						guild_id=guild.guild_id
 					)
 				)
 
 				logger.info(
 					f"[{interaction.channel.name}] is reserved for "
-					f"[{datetime.strptime(str(duration), '%H:%M:%S').strftime('%#Hh %#Mm')}] until "
+					f"[{format_duration(duration)}] until "
 					f"[{end_time.astimezone().strftime('%I:%M:%S %p %z %Z')}] set "
-					f"by [{interaction.user.global_name} ({interaction.user.name})]"
+					f"by [{interaction.user.global_name} ({interaction.user.name})]",
+					extra={"thread_id": interaction.channel_id, "user_id": interaction.user.id}
 				)
 			except (discord.errors.Forbidden, discord.errors.HTTPException) as e:
 				logger.error(f"Exception {type(e)}: {e}")
 		else:
 			# if this room is already occupied, add reservation tag
-			await thread.add_tags(
-				channel.get_tag(self.room_status_tag_id['reserved']),
+			await outbound.run(
+				Priority.INTERACTION, thread.id, thread.add_tags,
+				channel.get_tag(guild.room_status_tags['reserved']),
 				reason="Room reservation"
 			)
 			await interaction.response.send_message(
@@ -198,15 +209,16 @@ class Room(commands.GroupCog):
 	async def extend(self, interaction: Interaction, time: int):
 		# note: add tags to  thread requires "Send Messages in Posts" (also allow to add messages in that thread)
 		# note: delete messages in thread requires "Manage Messages"
-		channel = await interaction.guild.fetch_channel(self.forum_id)
-		thread = await interaction.guild.fetch_channel(interaction.channel_id)
-		room_type = list(set(list(self.room_type_tag_id.values())) & set(thread._applied_tags))
+		guild = config.guild(interaction.guild_id)
+		channel = await entity_cache.channel(guild.forum_channel_id)
+		thread = await entity_cache.channel(interaction.channel_id)
+		room_type = list(set(list(guild.room_type_tags.values())) & set(thread._applied_tags))
 
 		# set time stuff
-		duration = timedelta(minutes=config.ROOM_SELECT_DEFAULT_FREQUENCY_TIME*time)
+		duration = timedelta(minutes=guild.room_select_frequency_time*time)
 		start_time: datetime = interaction.created_at
 		end_time: datetime = start_time + duration
-		if not config.ROOM_STATUS_TAGS['occupied'] in thread._applied_tags:
+		if not guild.room_status_tags['occupied'] in thread._applied_tags:
 			# no occupied tag, send error
 			await interaction.response.send_message(
 				"This room is not currently occupied!\n"
@@ -218,7 +230,7 @@ class Room(commands.GroupCog):
 
 			# grab old time
 			msg_id = 0
-			old_end_time = get_thread_end_times(thread.id)
+			old_end_time = await get_thread_end_times(thread.id)
 			if len(old_end_time) > 1:
 				logger.warning(f"Multiple messages are found with thread id {thread.id}")
 			elif len(old_end_time) == 1:
@@ -231,17 +243,16 @@ class Room(commands.GroupCog):
 			try:
 				await interaction.response.send_message("Request Processing", delete_after=1, ephemeral=True)
 
-				history = interaction.channel.history()
-				msg = [m async for m in history if m.id == msg_id][0]
-				extension(thread.id, duration)
+				await extension(thread.id, duration)
 
-				await msg.edit(content=f"Available <t:{end_time.timestamp():.0f}:R>")
+				await outbound.run(Priority.INTERACTION, thread.id, message_cache.edit, thread, msg_id, content=f"Available <t:{end_time.timestamp():.0f}:R>")
 
 				logger.info(
 					f"[{interaction.channel.name}] has extension for "
-					f"[{datetime.strptime(str(duration), '%H:%M:%S').strftime('%#Hh %#Mm')}] until "
+					f"[{format_duration(duration)}] until "
 					f"[{end_time.astimezone().strftime('%I:%M:%S %p %z %Z')}] set "
-					f"by [{interaction.user.global_name} ({interaction.user.name})]"
+					f"by [{interaction.user.global_name} ({interaction.user.name})]",
+					extra={"thread_id": interaction.channel_id, "user_id": interaction.user.id}
 				)
 
 			except (discord.errors.Forbidden, discord.errors.HTTPException) as e:
@@ -1,10 +1,11 @@
 import yaml
-import sqlite3
 
-from datetime import datetime
 from icecream import ic
-from logger import logger
-from typing import Dict
+from logger import logger, setup_logging
+from src.database import Database
+from src.migrations import migrate, QUEUE_MIGRATIONS, TELEMETRY_MIGRATIONS
+from src.guilds import parse_guilds, GuildConfig, ANY_GUILD
+from typing import Dict, Optional
 from enum import IntEnum, auto
 
 class ENVIRONMENT(IntEnum):
@@ -13,31 +14,52 @@ class ENVIRONMENT(IntEnum):
 
 CURRENT_ENV = ENVIRONMENT.LIVE
 BOT_TOKEN = ""
-NOTIFICATION_CHANNEL_ID = 0
-FORUM_CHANNEL_ID = 0
-AUCTION_CHANNEL_ID = 0
-AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID = 0
-HONEYPOT_CHANNEL_ID = 0
-ROLE_NOTIFICATION_ID = {}
-ROOM_STATUS_TAGS = {}
-AUCTION_STATUS_TAGS = {}
-ROOM_TYPE_TAGS = {}
-EVENTS_TRIGGER: Dict = {}
-ROOM_SELECT_DEFAULT_FREQUENCY_TIME = 0
-ROOM_SELECT_DEFAULT_FREQUENCY_COUNT = 0
+# guild id: configuration of the venue in that guild
+GUILDS: Dict[int, GuildConfig] = {}
+AUCTION_EDIT_INTERVAL = 1.0
+OUTBOUND_WORKERS = 4
+OUTBOUND_RESERVED_WORKERS = 1
+OUTBOUND_ROUTE_RATE = 1.0
+OUTBOUND_ROUTE_BURST = 5
+ENTITY_CACHE_TTL = 300
+EXPIRY_CONCURRENCY = 5
+TELEMETRY_FLUSH_INTERVAL = 5.0
+TELEMETRY_BATCH_SIZE = 100
+DB_JOURNAL_MODE = "wal"
+DB_SYNCHRONOUS = "normal"
+DB_CACHE_SIZE = -8000
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_READ_CONNECTIONS = 2
+METRICS_ENABLED = False
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+PROFILING_ENABLED = False
+PROFILING_INTERVAL = 0.01
+PROFILING_PATH = "profile.txt"
+HONEYPOT_BAN_WORKERS = 2
+HONEYPOT_DEDUP_TTL = 3600
+HONEYPOT_FLUSH_INTERVAL = 2.0
+HONEYPOT_DIGEST_INTERVAL = 300
+LOG_LEVEL = "INFO"
+LOG_JSON = False
+LOG_FILE = None
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
 DB_NAME = "queue.db"
 TELEMETRY_DB_NAME = "telemetry.db"
-queue_connection = None
-queue_cursor = None
-telemetry_db_connection = None
-telemetry_db_cursor = None
+queue_db: Database = None
+telemetry_db: Database = None
 
 def setup(config_file: str):
-	global BOT_TOKEN, FORUM_CHANNEL_ID, ROOM_STATUS_TAGS, ROOM_TYPE_TAGS, NOTIFICATION_CHANNEL_ID, AUCTION_CHANNEL_ID, AUCTION_STATUS_TAGS
-	global HONEYPOT_CHANNEL_ID
-	global ROLE_NOTIFICATION_ID, TELEMETRY_DB_NAME
-	global EVENTS_TRIGGER, ROOM_SELECT_DEFAULT_FREQUENCY_TIME, ROOM_SELECT_DEFAULT_FREQUENCY_COUNT, CURRENT_ENV, AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID
-	global DB_NAME, queue_connection, queue_cursor, telemetry_db_connection, telemetry_db_cursor
+	global BOT_TOKEN, GUILDS, TELEMETRY_DB_NAME, CURRENT_ENV
+	global DB_NAME, queue_db, telemetry_db, AUCTION_EDIT_INTERVAL
+	global OUTBOUND_WORKERS, OUTBOUND_RESERVED_WORKERS, OUTBOUND_ROUTE_RATE, OUTBOUND_ROUTE_BURST, ENTITY_CACHE_TTL, EXPIRY_CONCURRENCY
+	global TELEMETRY_FLUSH_INTERVAL, TELEMETRY_BATCH_SIZE
+	global DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE, DB_READ_CONNECTIONS
+	global METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+	global PROFILING_ENABLED, PROFILING_INTERVAL, PROFILING_PATH
+	global HONEYPOT_BAN_WORKERS, HONEYPOT_DEDUP_TTL, HONEYPOT_FLUSH_INTERVAL, HONEYPOT_DIGEST_INTERVAL
+	global LOG_LEVEL, LOG_JSON, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT
 
 	logger.info(f"Bot is using config file: {config_file}")
 	with open(config_file) as f:
@@ -49,76 +71,79 @@ def setup(config_file: str):
 			else:
 				CURRENT_ENV = ENVIRONMENT.LIVE
 		BOT_TOKEN = data['bot_token']
-		NOTIFICATION_CHANNEL_ID = data['channel_id']['notifier']
-		FORUM_CHANNEL_ID = data['channel_id']['room']
-		AUCTION_CHANNEL_ID = data['channel_id']['auction']
-		HONEYPOT_CHANNEL_ID = data['channel_id']['honeypot']
-		ROLE_NOTIFICATION_ID = data['role_notification_id']
-		AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID = data['channel_id']['auction_public_notifier']
-		AUCTION_STATUS_TAGS = data['thread_status_tags']['auction']
-		ROOM_STATUS_TAGS = data['thread_status_tags']['room']
-		ROOM_TYPE_TAGS = data['thread_status_tags']['room_type']
-		EVENTS_TRIGGER = data['triggers']
-		ROOM_SELECT_DEFAULT_FREQUENCY_TIME = data['room_time_selection_frequency']
-		ROOM_SELECT_DEFAULT_FREQUENCY_COUNT = data['room_time_selection_count']
-		# adjust time to datatime and add triggered variable
-		for events in EVENTS_TRIGGER:
-			EVENTS_TRIGGER[events]['triggered'] = False
-			EVENTS_TRIGGER[events]['time'] = datetime.strptime(EVENTS_TRIGGER[events]['time'], "%I:%M %p")
-
-		assert len(ROOM_STATUS_TAGS) > 0, "No status tags, set your tag in config.yml"
-		assert len(ROOM_TYPE_TAGS) > 0, "No type tags, set your tag in config.yml"
-		assert FORUM_CHANNEL_ID, "No channel ID, set your channel ID in config.yml"
+		GUILDS = parse_guilds(data)
+		AUCTION_EDIT_INTERVAL = data.get('auction_edit_interval', AUCTION_EDIT_INTERVAL)
+		ENTITY_CACHE_TTL = data.get('entity_cache_ttl', ENTITY_CACHE_TTL)
+		EXPIRY_CONCURRENCY = data.get('expiry_concurrency', EXPIRY_CONCURRENCY)
+		if "outbound" in data:
+			OUTBOUND_WORKERS = data['outbound'].get('workers', OUTBOUND_WORKERS)
+			OUTBOUND_RESERVED_WORKERS = data['outbound'].get('reserved_workers', OUTBOUND_RESERVED_WORKERS)
+			OUTBOUND_ROUTE_RATE = data['outbound'].get('route_rate', OUTBOUND_ROUTE_RATE)
+			OUTBOUND_ROUTE_BURST = data['outbound'].get('route_burst', OUTBOUND_ROUTE_BURST)
+		if "telemetry" in data:
+			TELEMETRY_FLUSH_INTERVAL = data['telemetry'].get('flush_interval', TELEMETRY_FLUSH_INTERVAL)
+			TELEMETRY_BATCH_SIZE = data['telemetry'].get('batch_size', TELEMETRY_BATCH_SIZE)
+		if "database" in data:
+			DB_JOURNAL_MODE = data['database'].get('journal_mode', DB_JOURNAL_MODE)
+			DB_SYNCHRONOUS = data['database'].get('synchronous', DB_SYNCHRONOUS)
+			DB_CACHE_SIZE = data['database'].get('cache_size', DB_CACHE_SIZE)
+			DB_MMAP_SIZE = data['database'].get('mmap_size', DB_MMAP_SIZE)
+			DB_READ_CONNECTIONS = data['database'].get('read_connections', DB_READ_CONNECTIONS)
+		if "metrics" in data:
+			METRICS_ENABLED = data['metrics'].get('enabled', METRICS_ENABLED)
+			METRICS_HOST = data['metrics'].get('host', METRICS_HOST)
+			METRICS_PORT = data['metrics'].get('port', METRICS_PORT)
+		if "profiling" in data:
+			PROFILING_ENABLED = data['profiling'].get('enabled', PROFILING_ENABLED)
+			PROFILING_INTERVAL = data['profiling'].get('interval', PROFILING_INTERVAL)
+			PROFILING_PATH = data['profiling'].get('path', PROFILING_PATH)
+		if "honeypot" in data:
+			HONEYPOT_BAN_WORKERS = data['honeypot'].get('ban_workers', HONEYPOT_BAN_WORKERS)
+			HONEYPOT_DEDUP_TTL = data['honeypot'].get('dedup_ttl', HONEYPOT_DEDUP_TTL)
+			HONEYPOT_FLUSH_INTERVAL = data['honeypot'].get('flush_interval', HONEYPOT_FLUSH_INTERVAL)
+			HONEYPOT_DIGEST_INTERVAL = data['honeypot'].get('digest_interval', HONEYPOT_DIGEST_INTERVAL)
+		if "logging" in data:
+			LOG_LEVEL = data['logging'].get('level', LOG_LEVEL)
+			LOG_JSON = data['logging'].get('json', LOG_JSON)
+			LOG_FILE = data['logging'].get('file', LOG_FILE)
+			LOG_MAX_BYTES = data['logging'].get('max_bytes', LOG_MAX_BYTES)
+			LOG_BACKUP_COUNT = data['logging'].get('backup_count', LOG_BACKUP_COUNT)
+		setup_logging(LOG_LEVEL, LOG_JSON, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT)
 
 		# establishing database connection
 		if CURRENT_ENV == ENVIRONMENT.TESTING:
 			DB_NAME = "queue_testing.db"
 			TELEMETRY_DB_NAME = "telemetry_testing.db"
-		queue_connection = sqlite3.connect(DB_NAME)
-		telemetry_db_connection = sqlite3.connect(TELEMETRY_DB_NAME)
-		queue_cursor = queue_connection.cursor()
-		telemetry_db_cursor = telemetry_db_connection.cursor()
-
-		# create tables
-
-		# create hotel queue table
-		queue_cursor.execute("""
-			CREATE TABLE IF NOT EXISTS queue(
-		        thread_id, message_id, user_id, end_time, cc_user, is_reservation
-		    )
-		""")
+		database_settings = dict(
+			journal_mode=DB_JOURNAL_MODE,
+			synchronous=DB_SYNCHRONOUS,
+			cache_size=DB_CACHE_SIZE,
+			mmap_size=DB_MMAP_SIZE,
+			read_connections=DB_READ_CONNECTIONS,
+		)
+		queue_db = Database(DB_NAME, **database_settings)
+		telemetry_db = Database(TELEMETRY_DB_NAME, **database_settings)
 
-		# create hotel nightly report table
-		# this table should be cleared nightly after "close" event is triggered
-		queue_cursor.execute("""
-			CREATE TABLE IF NOT EXISTS queue_report(
-				thread_id, hours
-			)
-		""")
+		# create or update tables
+		queue_db.run_blocking(migrate, QUEUE_MIGRATIONS)
+		telemetry_db.run_blocking(migrate, TELEMETRY_MIGRATIONS)
 
-		# create information table
-		queue_cursor.execute("""
-			CREATE TABLE IF NOT EXISTS auction_info(
-				thread_id primary key, 
-				auction_info_msg_id,
-				message_id,
-				notification_id
-			)
-		""")
-
-		# create auction history table
-		queue_cursor.execute("""
-			CREATE TABLE IF NOT EXISTS auction(
-				thread_id primary key, 
-				end_time, 
-				bid_increment, 
-				bid_current,
-				bid_count,
-				last_bid_user_id
-			)
-		""")
+		del data
 
-		# creates hotel room telemetry table
-		telemetry_db_cursor.execute("create table if not exists room_stats(thread_id, rent_count, extension_count, rent_total_time)")
+def guild(guild_id: Optional[int]) -> Optional[GuildConfig]:
+	"""
+	The configuration of a guild
+	Args:
+		guild_id (int): the guild id, rows written before guilds were stored have 0
 
-		del data
+	Returns:
+		GuildConfig - None if the bot does not serve this guild
+	"""
+	if guild_id in GUILDS:
+		return GUILDS[guild_id]
+	if ANY_GUILD in GUILDS:
+		return GUILDS[ANY_GUILD]
+	if not guild_id and GUILDS:
+		# rows from before guilds were stored belong to the first venue
+		return next(iter(GUILDS.values()))
+	return None
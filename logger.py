@@ -1,9 +1,91 @@
+import atexit
+import json
 import logging
+import queue
 
-logger = logging.getLogger()
-handler = logging.StreamHandler()
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# structured fields callers may pass with `extra=`, written as their own keys by the json format
+STRUCTURED_FIELDS = ("thread_id", "user_id", "amount", "duration_ms")
+
+class JsonFormatter(logging.Formatter):
+	"""
+	One JSON object per line with the time, level, logger name, message and any structured fields
+	"""
+	def format(self, record: logging.LogRecord) -> str:
+		entry = {
+			"time": self.formatTime(record, self.datefmt),
+			"level": record.levelname,
+			"logger": record.name,
+			"message": record.getMessage(),
+		}
+		for name in STRUCTURED_FIELDS:
+			value = getattr(record, name, None)
+			if value is not None:
+				entry[name] = value
+		if record.exc_info:
+			entry["exception"] = self.formatException(record.exc_info)
+		return json.dumps(entry, default=str)
+
+class _QueueHandler(QueueHandler):
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		# only merge the arguments into the message, formatting is left to the listener's thread
+		record = logging.makeLogRecord(record.__dict__)
+		record.msg = record.getMessage()
+		record.args = None
+		return record
 
 log_fmtter = logging.Formatter(fmt=f"[%(asctime)s] [%(levelname)-8s] [%(name)s] %(msg)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+logger = logging.getLogger()
+handler = logging.StreamHandler()
 handler.setFormatter(log_fmtter)
+
+# records are queued on the calling thread and written by the listener's thread
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+_listener = QueueListener(_queue, handler, respect_handler_level=True)
 logger.setLevel(logging.INFO)
-logger.addHandler(handler)
\ No newline at end of file
+logger.addHandler(_QueueHandler(_queue))
+_listener.start()
+
+def setup_logging(level: str="INFO", json_format: bool=False, file: str=None, max_bytes: int=10 * 1024 * 1024, backup_count: int=5) -> None:
+	"""
+	Replace the handlers the listener writes to
+	Args:
+		level (str): minimum level logged
+		json_format (bool): write JSON lines instead of text
+		file (str): also write to this file, rotated when it reaches max_bytes
+		max_bytes (int): size of a log file before it is rotated
+		backup_count (int): rotated files kept
+
+	Returns:
+		None
+	"""
+	global _listener
+
+	formatter = JsonFormatter(datefmt="%Y-%m-%dT%H:%M:%S%z") if json_format else log_fmtter
+	handlers = [handler]
+	handler.setFormatter(formatter)
+	if file:
+		file_handler = RotatingFileHandler(file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+		file_handler.setFormatter(formatter)
+		handlers.append(file_handler)
+
+	# stopping writes out what was queued with the old handlers
+	stop_logging()
+	_listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+	logger.setLevel(level)
+	_listener.start()
+
+def stop_logging() -> None:
+	"""
+	Write out the queued records and stop the listener's thread
+	"""
+	if _listener._thread is None:
+		return
+	_listener.stop()
+	for listener_handler in _listener.handlers:
+		if listener_handler is not handler:
+			listener_handler.close()
+
+atexit.register(stop_logging)
@@ -1,38 +1,194 @@
-import traceback
+import asyncio
 
 import config
 
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from enum import IntEnum, auto
 from discord import Interaction, Thread, Message, errors, ui
 from discord.ext.commands import Bot
 
 from logger import logger
-from typing import List
+from src.cache import entity_cache
+from src.database import Transaction
+from src.messages import delete_bot_messages, edit_coalescer, message_cache
+from src.outbound import outbound, Priority
+from src.scheduler import run_expired, scheduler, AUCTION
+from typing import Dict, List, Optional
+
+# a custom bid cannot be more than this many times the current bid
+MAX_BID_MULTIPLIER = 3
 
 @dataclass
 class AuctionData:
 	bidding_message: int
 	bidding_announcement_message: int
 
-def create_auction_history_table(thread_id: int) -> None:
+class BidStatus(IntEnum):
+	ACCEPTED = auto()
+	NO_AUCTION = auto()
+	ENDED = auto()
+	DOUBLE_BID = auto()
+	TOO_LOW = auto()
+	BELOW_INCREMENT = auto()
+	TOO_HIGH = auto()
+	CONFLICT = auto()
+
+@dataclass
+class BidResult:
+	"""
+	Outcome of a bid. The auction fields hold the state the bid was judged against,
+	bid_current and bid_count are the new values when the bid was accepted.
+	"""
+	status: BidStatus
+	bid_amount: int = 0
+	set_bid: bool = False
+	bid_current: int = 0
+	bid_increment: int = 0
+	bid_count: int = 0
+	end_time: int = 0
+	message_id: int = 0
+	notification_id: int = 0
+
+# one lock per auction, bids on different auctions never wait on each other
+_bid_locks: Dict[int, asyncio.Lock] = {}
+
+async def place_bid(thread_id: int, user_id: int, bid_amount: Optional[int]=None) -> BidResult:
 	"""
-	Initialize a table for auction history
+	Apply a bid to an auction. Bids on the same auction are serialized and written with a
+	compare-and-set on the state they were validated against, so no bid is lost or applied twice.
 	Args:
+		thread_id (int): the auction thread id
+		user_id (int): the bidder
+		bid_amount (int, optional): custom bid amount, None to raise the bid by the increment
+
+	Returns:
+		BidResult
+	"""
+	async with _bid_locks.setdefault(thread_id, asyncio.Lock()):
+		row = await config.queue_db.fetchone("""
+			select auction.bid_increment, auction.bid_current, auction.bid_count, auction.last_bid_user_id,
+				auction.end_time, b.message_id, b.notification_id
+			from auction
+			join auction_info as b
+			on auction.thread_id = b.thread_id
+			where auction.thread_id = ?
+		""", (thread_id,))
+		if row is None:
+			return BidResult(BidStatus.NO_AUCTION)
+
+		bid_increment, bid_current, bid_count, last_bid_user_id, end_time, message_id, notification_id = row
+		result = BidResult(
+			BidStatus.ACCEPTED,
+			bid_current=bid_current,
+			bid_increment=bid_increment,
+			bid_count=bid_count,
+			end_time=end_time,
+			message_id=message_id,
+			notification_id=notification_id
+		)
+
+		if end_time <= datetime.now().timestamp():
+			result.status = BidStatus.ENDED
+			return result
+
+		# checking to see if user was the last person who place a bid
+		if last_bid_user_id == user_id:
+			result.status = BidStatus.DOUBLE_BID
+			return result
+
+		if bid_amount is not None:
+			# user made custom bid
+			result.bid_amount = bid_amount
+			result.set_bid = True
+			if bid_amount <= bid_current:
+				result.status = BidStatus.TOO_LOW
+				return result
+			elif bid_amount - bid_current < bid_increment:
+				result.status = BidStatus.BELOW_INCREMENT
+				return result
+			elif bid_amount > bid_current * MAX_BID_MULTIPLIER:
+				result.status = BidStatus.TOO_HIGH
+				return result
+			new_bid_value = bid_amount
+		elif bid_count == 0:
+			# user made the initial bid, set their bid as the current bid
+			result.bid_amount = bid_current
+			result.set_bid = True
+			new_bid_value = bid_current
+		else:
+			# user made normal bid
+			result.bid_amount = bid_increment
+			new_bid_value = bid_current + bid_increment
+
+		async with config.queue_db.transaction() as tx:
+			changed = await tx.execute("""
+				update auction
+				set
+					bid_current = ?,
+					last_bid_user_id = ?,
+					bid_count = bid_count + 1
+				where thread_id = ? and bid_current = ? and bid_count = ? and last_bid_user_id = ?
+			""", (new_bid_value, user_id, thread_id, bid_current, bid_count, last_bid_user_id))
+			if changed != 1:
+				# the auction changed underneath us (i.e. it was extended, cancelled or bid on by another process)
+				result.status = BidStatus.CONFLICT
+				return result
+
+			await add_auction_bid(tx, thread_id, user_id, result.bid_amount, new_bid_value, result.set_bid)
+
+		result.bid_current = new_bid_value
+		result.bid_count = bid_count + 1
+		return result
+
+async def clear_auction_history(tx: Transaction, thread_id: int) -> None:
+	"""
+	Remove any bid history left over from a previous auction in this thread
+	Args:
+		tx (Transaction): the transaction creating the auction
+		thread_id (int): the thread id
+
+	Returns:
+		None
+	"""
+	logger.info(f"Clearing auction history for thread {thread_id}")
+	await tx.execute("delete from auction_bid where thread_id = ?", (thread_id,))
+
+async def add_auction_bid(tx: Transaction, thread_id: int, user_id: int, bid: int, current_bid: int, set_bid: bool) -> None:
+	"""
+	Append a bid to the auction history
+	Args:
+		tx (Transaction): the transaction updating the auction
 		thread_id (int): the thread id
+		user_id (int): the bidder
+		bid (int): the amount the user bid (the increment or the custom amount)
+		current_bid (int): the auction's current bid after this bid
+		set_bid (bool): whether the bid set a fixed value instead of adding the increment
 
 	Returns:
 		None
 	"""
-	if len(list(config.queue_cursor.execute(f"select tbl_name from sqlite_master where type='table' and tbl_name='auction_history_{thread_id}';").fetchall())) > 0:
-		logger.info(f"Auction history existed for thread {thread_id}. Dropping this table.")
-		config.queue_cursor.execute(f"drop table auction_history_{thread_id}")
+	await tx.execute("""
+		INSERT INTO auction_bid(thread_id, seq, user_id, bid, current_bid, set_bid)
+		VALUES (?, (select coalesce(max(seq), 0) + 1 from auction_bid where thread_id = ?), ?, ?, ?, ?)
+	""", (thread_id, thread_id, user_id, bid, current_bid, set_bid))
+
+async def get_top_bids(thread_id: int, limit: int=10) -> List:
+	"""
+	Get the highest bids of an auction
+	Args:
+		thread_id (int): the thread id
+		limit (int): how many bids to return
 
-	logger.info(f"Initializing table for thread {thread_id}")
-	config.queue_cursor.execute(f"CREATE TABLE IF NOT EXISTS auction_history_{thread_id}(user_id, bid, current_bid, set_bid)")
-	config.queue_connection.commit()
+	Returns:
+		List - (user_id, current_bid) rows, highest first
+	"""
+	return await config.queue_db.read.fetchall(
+		"select user_id, current_bid from auction_bid where thread_id = ? order by current_bid desc limit ?",
+		(thread_id, limit)
+	)
 
-def get_auction_info(thread: Thread, columns: List=None) -> List:
+async def get_auction_info(thread: Thread, columns: List=None) -> List:
 	"""
 	checking to see if this thread has an auction in it
 	Args:
@@ -42,18 +198,18 @@ def get_auction_info(thread: Thread, columns: List=None) -> List:
 		List - a list of threads containing auction information.
 	"""
 
-	thread_ids = config.queue_cursor.execute(f"""
+	thread_ids = await config.queue_db.read.fetchall(f"""
 							select {'*' if columns is None else 'auction.'+','.join(columns)}
 							from auction
 							join auction_info as b
 							on auction.thread_id = b.thread_id
 							where auction.thread_id = {thread.id}
-						""").fetchall()
+						""")
 	if len(thread_ids) == 0:
 		return []
 	return thread_ids
 
-def remove_auction(thread_id: int):
+async def remove_auction(thread_id: int):
 	"""
 	remove auction information from database
 	Args:
@@ -63,139 +219,179 @@ def remove_auction(thread_id: int):
 
 	"""
 
-	# remove auction from master auction tables
-	config.queue_cursor.execute(f"DELETE FROM auction WHERE thread_id = {thread_id}")
-	config.queue_cursor.execute(f"DELETE FROM auction_info WHERE thread_id = {thread_id}")
-	# remove history_table
-	config.queue_cursor.execute(f"drop table auction_history_{thread_id}")
-	config.queue_connection.commit()
+	async with config.queue_db.transaction() as tx:
+		# remove auction from master auction tables
+		await tx.execute(f"DELETE FROM auction WHERE thread_id = {thread_id}")
+		await tx.execute(f"DELETE FROM auction_info WHERE thread_id = {thread_id}")
+		# remove bid history
+		await tx.execute(f"DELETE FROM auction_bid WHERE thread_id = {thread_id}")
+	scheduler.cancel(AUCTION, thread_id)
+	_bid_locks.pop(thread_id, None)
 
-async def auction_task(bot: Bot):
+async def _expire_auction(bot: Bot, row):
 	"""
-	background task for bot to run
+	closes a single expired auction
 	Args:
-		bot ():
+		bot (Bot): the discord bot object
+		row (tuple): the auction row
 
 	Returns:
-
+		None
 	"""
+	try:
+		thread_id = row[0]
+		# every bid that passed the end time check holds the lock until it is written, so the row read under it is final
+		async with _bid_locks.setdefault(thread_id, asyncio.Lock()):
+			final = await config.queue_db.fetchone("""
+				select auction.end_time, auction.bid_current, auction.bid_count, auction.last_bid_user_id, auction.guild_id,
+					b.message_id, b.notification_id
+				from auction
+				join auction_info as b
+				on auction.thread_id = b.thread_id
+				where auction.thread_id = ?
+			""", (thread_id,))
+			if final is None or final[0] > datetime.now().timestamp():
+				# cancelled or extended since it was found expired
+				return
+			end_time, bid_current, bid_count, last_bid_user_id, guild_id, message_id, announcement_msg_id = final
 
-	# check auction if it ended
-	auction_key_count = config.queue_cursor.execute("SELECT count(*) FROM auction").fetchone()[0]
-	if auction_key_count > 0:
-		res = config.queue_cursor.execute(f"SELECT * FROM auction WHERE end_time <= {int(datetime.now().timestamp())}")
-		keys = res.fetchall()
-		for k in keys:
+			# remove auction record from master table, bids waiting on the lock find no auction
+			logger.info("Removing record from master auction table")
+			async with config.queue_db.transaction() as tx:
+				await tx.execute("DELETE FROM auction WHERE thread_id = ?", (thread_id,))
+				await tx.execute("DELETE FROM auction_info WHERE thread_id = ?", (thread_id,))
+		# the next auction in this thread gets a new lock
+		_bid_locks.pop(thread_id, None)
+
+		guild = config.guild(guild_id)
+		# send the last coalesced bid updates, edits asked for later would overwrite the final state
+		await edit_coalescer.close(message_id, announcement_msg_id)
+
+		auction_announcement_chn = bot.get_partial_messageable(guild.auction_public_notifier_channel_id)
+		channel = await entity_cache.channel(guild.auction_channel_id)
+		thread = await entity_cache.channel(thread_id)
+		message: Message = await message_cache.fetch(thread, message_id)
+
+		# remove tags
+		logger.info("Overriding tags to archive")
+		await outbound.run(
+			Priority.NORMAL, thread.id, thread.override_tags,
+			channel.get_tag(guild.auction_status_tags['archived'])
+		)
+
+		# disable buttons
+		logger.info("Disabling buttons")
+		view = ui.View.from_message(message)
+		components = view.children
+		for component in components:
+			component.disabled = True
+
+		await outbound.run(
+			Priority.NORMAL, thread.id, message.edit,
+			view=view
+		)
+
+		# remove all of bot's messages in this thread
+		logger.info("Removing bot messages about the auction")
+		await delete_bot_messages(thread, bot.user.id)
+
+		if last_bid_user_id == -1:
+			# no winner, notify owner of discord server
+			logger.info(
+				f"Auction {thread_id} completed. "
+				f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil]. "
+				f"No Winner."
+			)
+			await outbound.run(
+				Priority.NOTIFICATION, thread.guild.owner_id, (await entity_cache.user(thread.guild.owner_id)).send,
+				f"Auction {thread_id} completed.\n"
+				f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil].\n"
+				f"No Winner."
+			)
+		else:
+			# notify winner
+			winner_info = await entity_cache.user(last_bid_user_id)
 			try:
-				thread_id, end_time, bid_increment, bid_current, bid_count, last_bid_user_id = k
-				_, auction_msg_info_id, message_id, announcement_msg_id = config.queue_cursor.execute(f"SELECT * FROM auction_info where thread_id = {thread_id}").fetchone()
-
-				auction_announcement_chn = await bot.fetch_channel(config.AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID)
-				message: Message = await bot.get_channel(config.AUCTION_CHANNEL_ID).get_thread(thread_id).fetch_message(message_id)
-				channel = await message.guild.fetch_channel(config.AUCTION_CHANNEL_ID)
-				thread = await message.guild.fetch_channel(message.channel.id)
-
-				# remove tags
-				logger.info("Overriding tags to archive")
-				await thread.override_tags(
-					channel.get_tag(config.AUCTION_STATUS_TAGS['archived'])
+				await outbound.run(
+					Priority.NOTIFICATION, last_bid_user_id, winner_info.send,
+					f"# :tada: __Congratulations!__ :tada:\n"
+					f"## You are the winner of an auction in the Weaver's Nest!\n\n"
+					f"The final bid was `{bid_current:,}` Gil\n\n"
+					f"Please see the thread **<#{thread_id}>** in the Weaver's Nest **{channel.name} ** channel.\n"
+					f"Please see reception in-game for your payment.\n"
+					f"-# Your claim to your prize expires <t:{int((datetime.now() + timedelta(minutes=10)).timestamp())}:R>. If you do not accept within this timeframe, your prize will go to the next bidder."
+				)
+			except errors.Forbidden:
+				# cannot dm user (usually permission)
+				await outbound.run(
+					Priority.NOTIFICATION, thread.id, thread.send,
+					f"# :tada: __Congratulations <@{last_bid_user_id}>!__ :tada:\n"
+					f"## You are the winner of an auction in the Weaver's Nest!\n\n"
+					f"The final bid was `{bid_current:,}` Gil\n\n"
+					f"Please see the thread **<#{thread_id}>** in the Weaver's Nest **{channel.name} ** channel.\n"
+					f"Please see reception in-game for your payment.\n"
+					f"-# Your claim to your prize expires <t:{int((datetime.now() + timedelta(minutes=10)).timestamp())}:R>. If you do not accept within this timeframe, your prize will go to the next bidder."
 				)
 
-				# disable buttons
-				logger.info("Disabling buttons")
-				view = ui.View.from_message(message)
-				components = view.children
-				for component in components:
-					component.disabled = True
+			# notify me
+			await outbound.run(
+				Priority.NOTIFICATION, 1082827074189930536, (await entity_cache.user(1082827074189930536)).send,
+				f"Auction {thread_id} completed.\n"
+				f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil].\n"
+				f"Winner: {winner_info.name} ({winner_info.global_name} | {last_bid_user_id})."
+			)
 
-				await message.edit(
-					view=view
-				)
+			logger.info(
+				f"Auction {thread_id} completed. "
+				f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil]. "
+				f"Winner: {winner_info.name} ({last_bid_user_id})"
+			)
 
-				# remove all of bot's messages in this thread
-				logger.info("Removing bot messages about the auction")
-				msgs = thread.history()
-				async for m in msgs:
-					if m.author.id == bot.user.id:
-						await m.delete()
-
-				if last_bid_user_id == -1:
-					# no winner, notify owner of discord server
-					logger.info(
-						f"Auction {thread_id} completed. "
-						f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil]. "
-						f"No Winner."
-					)
-					await bot.get_user(message.guild.owner_id).send(
-						f"Auction {thread_id} completed.\n"
-						f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil].\n"
-						f"No Winner."
-					)
-				else:
-					# notify winner
-					winner_info = bot.get_user(last_bid_user_id)
-					try:
-						await winner_info.send(
-							f"# :tada: __Congratulations!__ :tada:\n"
-							f"## You are the winner of an auction in the Weaver's Nest!\n\n"
-							f"The final bid was `{bid_current:,}` Gil\n\n"
-							f"Please see the thread **<#{thread_id}>** in the Weaver's Nest **{channel.name} ** channel.\n"
-							f"Please see reception in-game for your payment.\n"
-							f"-# Your claim to your prize expires <t:{int((datetime.now() + timedelta(minutes=10)).timestamp())}:R>. If you do not accept within this timeframe, your prize will go to the next bidder."
-						)
-					except errors.Forbidden:
-						# cannot dm user (usually permission)
-						await thread.send(
-							f"# :tada: __Congratulations <@{last_bid_user_id}>!__ :tada:\n"
-							f"## You are the winner of an auction in the Weaver's Nest!\n\n"
-							f"The final bid was `{bid_current:,}` Gil\n\n"
-							f"Please see the thread **<#{thread_id}>** in the Weaver's Nest **{channel.name} ** channel.\n"
-							f"Please see reception in-game for your payment.\n"
-							f"-# Your claim to your prize expires <t:{int((datetime.now() + timedelta(minutes=10)).timestamp())}:R>. If you do not accept within this timeframe, your prize will go to the next bidder."
-						)
-
-					# notify me
-					await bot.get_user(1082827074189930536).send(
-						f"Auction {thread_id} completed.\n"
-						f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil].\n"
-						f"Winner: {winner_info.name} ({winner_info.global_name} | {last_bid_user_id})."
-					)
-
-					logger.info(
-						f"Auction {thread_id} completed. "
-						f"[{channel.name} {thread.name}] auction is finalized with [{bid_current:,} Gil]. "
-						f"Winner: {bot.get_user(last_bid_user_id).name} ({last_bid_user_id})"
-					)
-
-				# remove auction record from master table
-				logger.info("Removing record from master auction table")
-				config.queue_cursor.execute(f"DELETE FROM auction WHERE thread_id = {thread_id}")
-				config.queue_cursor.execute(f"DELETE FROM auction_info WHERE thread_id = {thread_id}")
-				config.queue_connection.commit()
-
-				# post some auction stats
-				logger.info("Posting post-auction stats")
-				await thread.send(
-					"# This auction has ended!\n"
-					f"## There was {bid_count} bid{'' if bid_count == 1 else 's'} made.\n"
-					f"## The final bid was `{bid_current:,}` Gil!\n"
-					f"The winner has been notified. Thank you for your participation!"
-				)
+		# post some auction stats
+		logger.info("Posting post-auction stats")
+		await outbound.run(
+			Priority.NOTIFICATION, thread.id, thread.send,
+			"# This auction has ended!\n"
+			f"## There was {bid_count} bid{'' if bid_count == 1 else 's'} made.\n"
+			f"## The final bid was `{bid_current:,}` Gil!\n"
+			f"The winner has been notified. Thank you for your participation!"
+		)
 
-				# edit announcement message
-				msgs = auction_announcement_chn.history()
-				announcement_msgs = [m async for m in msgs if m.id == announcement_msg_id]
-				if len(announcement_msgs) == 0:
-					await channel.send(
-						"Fatal error has occurred. Current price message is not found.\n"
-						"-# Paging <@1082827074189930536>"
-					)
-				await announcement_msgs[0].edit(
-					content=f"## An auction has ended!\n"
-					f"<#{thread.id}>. The final bid was`{bid_current:,}` Gil.\n"
-					f"There was {bid_count} bids made."
-				)
+		# edit announcement message
+		try:
+			await outbound.run(
+				Priority.NORMAL, auction_announcement_chn.id, message_cache.edit,
+				auction_announcement_chn, announcement_msg_id, content=
+				f"## An auction has ended!\n"
+				f"<#{thread.id}>. The final bid was`{bid_current:,}` Gil.\n"
+				f"There was {bid_count} bids made."
+			)
+		except errors.NotFound:
+			await outbound.run(
+				Priority.NOTIFICATION, channel.id, channel.send,
+				"Fatal error has occurred. Current price message is not found.\n"
+				"-# Paging <@1082827074189930536>"
+			)
+
+	except errors.NotFound as e:
+		logger.error(f"Auction expiry caught an exception: {type(e)} {e}", exc_info=True)
+
+
+async def auction_task(bot: Bot, guild_id: int=None):
+	"""
+	closes every auction whose end time has passed, run by the deadline scheduler
+	Args:
+		bot (Bot): the discord bot object
+		guild_id (int): only close auctions of this guild, every guild when not given
 
-			except errors.NotFound as e:
-				logger.error(f"queue_checker caught an exception: {type(e)} {e}")
-				traceback.print_exc()
\ No newline at end of file
+	Returns:
+		None
+	"""
+
+	# check auction if it ended
+	keys = await config.queue_db.fetchall("""
+		select thread_id, end_time, bid_increment, bid_current, bid_count, last_bid_user_id, guild_id
+		from auction
+		where end_time <= ? and (? is null or guild_id = ?)
+	""", (int(datetime.now().timestamp()), guild_id, guild_id))
+	await run_expired(keys, lambda row: _expire_auction(bot, row), key=lambda row: row[0])
\ No newline at end of file
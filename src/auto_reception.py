@@ -4,12 +4,17 @@ from datetime import datetime, timedelta
 from discord import Message, User, TextChannel, errors
 from logger import logger
 from icecream import ic
+from src.cache import entity_cache
+from src.messages import message_cache
+from src.metrics import ROOM_QUEUE_SIZE
+from src.outbound import outbound, Priority
+from src.report import nightly_report
+from src.scheduler import run_expired, scheduler, ROOM
+from src.telemetry import telemetry, RoomCheckedOut, RoomExtended, RoomRented, RoomReserved
 from typing import List
 
-_queue_size = 0
-
 class CheckInData:
-	def __init__(self, thread_id:int, message: Message, user_id: int, duration: int, end_time: int, cc_user_id: int=None, is_reservation=False):
+	def __init__(self, thread_id:int, message: Message, user_id: int, duration: int, end_time: int, cc_user_id: int=None, is_reservation=False, thread_name: str=None, guild_id: int=0):
 		self.thread_id = thread_id
 		self.message: Message = message
 		self.user_id: int = user_id
@@ -17,17 +22,19 @@ class CheckInData:
 		self.end_time: int = end_time
 		self.cc_user_id: int = cc_user_id
 		self.is_reservation = is_reservation
+		self.thread_name = thread_name
+		self.guild_id = guild_id
 
 
 def log_reception(func):
-	def inner(*args, **kwargs):
-		status = func(*args, **kwargs)
+	async def inner(*args, **kwargs):
+		status = await func(*args, **kwargs)
 
-		logger.info(f"Queue now has {_queue_size} item(s)")
+		logger.info(f"Queue now has {ROOM_QUEUE_SIZE.value:.0f} item(s)")
 		return status
 	return inner
 
-def get_thread_end_times(thread_id: int) -> List:
+async def get_thread_end_times(thread_id: int) -> List:
 	"""
 	returns the message id of this thread that contains the end time
 	Args:
@@ -37,15 +44,15 @@ def get_thread_end_times(thread_id: int) -> List:
 		List: containing the message id and the end time (posix time)
 	"""
 	# get the messages in this thread
-	message_ids = config.queue_cursor.execute(f"""
+	message_ids = await config.queue_db.read.fetchall(f"""
 		select message_id, end_time
 		from queue
 		where thread_id = {thread_id}
-	""").fetchall()
+	""")
 
 	return message_ids
 
-def is_room_occupied(thread_id: int) -> bool:
+async def is_room_occupied(thread_id: int) -> bool:
 	"""
 	Check to see if the room with the specified ID is listed in the queue's master table
 	Args:
@@ -54,10 +61,10 @@ def is_room_occupied(thread_id: int) -> bool:
 	Returns:
 		bool
 	"""
-	return config.queue_cursor.execute(f"select exists(select 1 from queue where thread_id={thread_id} and is_reservation=0 limit 1)").fetchone()[0]
+	return await config.queue_db.read.fetchval(f"select exists(select 1 from queue where thread_id={thread_id} and is_reservation=0 limit 1)")
 
 @log_reception
-def extension(thread_id: int, duration: timedelta) -> None:
+async def extension(thread_id: int, duration: timedelta) -> None:
 	"""
 	Extends the end time of the room in question
 	Args:
@@ -67,89 +74,48 @@ def extension(thread_id: int, duration: timedelta) -> None:
 		None
 	"""
 	# update row
-	thread_data = get_thread_end_times(thread_id)
+	thread_data = await config.queue_db.read.fetchall("select message_id, end_time, guild_id from queue where thread_id = ?", (thread_id,))
 	assert(len(thread_data) == 1)
 
-	old_message_id, old_end_time = thread_data[0]
+	old_message_id, old_end_time, guild_id = thread_data[0]
 	new_end_duration = round((datetime.fromtimestamp(old_end_time) + duration).timestamp())
-	# update room occupation with new time
-	config.queue_cursor.execute(f"""
-		update queue
-		set 
-			end_time = {new_end_duration}
-		where thread_id = {thread_id}
-	""")
+	async with config.queue_db.transaction() as tx:
+		# update room occupation with new time
+		await tx.execute(f"""
+			update queue
+			set 
+				end_time = {new_end_duration}
+			where thread_id = {thread_id}
+		""")
 
-	# add new duration to telemetry
-	config.telemetry_db_cursor.execute(f"""
-		update room_stats
-		set
-			extension_count = extension_count+1,
-			rent_total_time = rent_total_time + {duration.total_seconds() / 3600}
-		where thread_id = {thread_id}
-	""")
+		# the report may have been closed since the check in, so this can add the row again
+		await nightly_report.add(tx, thread_id, duration.total_seconds() / 3600, guild_id=guild_id)
+	scheduler.schedule(ROOM, old_message_id, new_end_duration, guild_id)
 
-	# no need to check, if extension, then an entry should already exists
-	config.queue_cursor.execute(f"""
-	update queue_report
-	set
-		hours = hours+{duration.total_seconds() / 3600}
-	where thread_id = {thread_id}
-	""")
-	config.queue_connection.commit()
-	config.telemetry_db_connection.commit()
+	# add new duration to telemetry
+	telemetry.record(RoomExtended(thread_id, duration.total_seconds() / 3600, guild_id=guild_id))
 
 @log_reception
-def check_in(data: CheckInData):
-	global _queue_size
-	_queue_size += 1
-
-	# add a new entry to the list
-	config.queue_cursor.execute(f"""
-		INSERT INTO queue (thread_id, message_id, user_id, end_time, cc_user, is_reservation)
-		VALUES (?, ?, ?, ?, ?, ?)
-	""", (data.thread_id, data.message.id, data.user_id, data.end_time, data.cc_user_id, data.is_reservation))
-
-	# nighty report insertion / updates
-	if config.queue_cursor.execute(f"select exists(select 1 from queue_report where thread_id={data.thread_id} limit 1)").fetchone()[0]:
-		# no need to check, if extension, then an entry should already exists
-		config.queue_cursor.execute(f"""
-			update queue_report
-			set
-				hours = hours+{data.duration / 3600}
-			where thread_id = {data.thread_id}
-		""")
+async def check_in(data: CheckInData):
+	async with config.queue_db.transaction() as tx:
+		# add a new entry to the list
+		await tx.execute(f"""
+			INSERT INTO queue (thread_id, message_id, user_id, end_time, cc_user, is_reservation, guild_id, start_time)
+			VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+		""", (data.thread_id, data.message.id, data.user_id, data.end_time, data.cc_user_id, data.is_reservation, data.guild_id, int(data.end_time - data.duration)))
+
+		# nighty report insertion / updates
+		await nightly_report.add(tx, data.thread_id, data.duration / 3600, data.thread_name, data.guild_id)
+	scheduler.schedule(ROOM, data.message.id, data.end_time, data.guild_id)
+	ROOM_QUEUE_SIZE.inc()
+
+	if data.is_reservation:
+		telemetry.record(RoomReserved(data.thread_id, data.duration / 3600, guild_id=data.guild_id))
 	else:
-		config.queue_cursor.execute(f"""
-			insert into queue_report(thread_id, hours)
-			values (?, ?)
-		""", (data.thread_id, data.duration / 3600))
-
-
-	config.queue_connection.commit()
-
-	# check telemetry entry if it is created
-	if not data.is_reservation:
-		row_check = config.telemetry_db_cursor.execute(f"select exists(select 1 from room_stats where thread_id={data.thread_id} limit 1)").fetchone()[0]
-		if row_check:
-			# entry exists, we update
-			config.telemetry_db_cursor.execute(f"""
-				update room_stats
-				set
-					rent_count = rent_count + 1,
-					rent_total_time = rent_total_time + {data.duration / 3600}
-				where thread_id = {data.thread_id}
-			""")
-		else:
-			# no data exists, we insert
-			config.telemetry_db_cursor.execute(f"""
-				insert into room_stats(thread_id, rent_count, extension_count, rent_total_time)
-				values (?, ?, ?, ?)
-			""", (data.thread_id, 1, 0, data.duration / 3600))
-		config.telemetry_db_connection.commit()
+		telemetry.record(RoomRented(data.thread_id, data.duration / 3600, guild_id=data.guild_id))
 
 @log_reception
-def check_out(key=0, msg_id=0):
+async def check_out(key=0, msg_id=0):
 	"""
 	Removes check in data from queue by either message id or time
 
@@ -161,78 +127,120 @@ def check_out(key=0, msg_id=0):
 	Returns:
 		list: list of msg id's removed
 	"""
-	global _queue_size
-	_queue_size -= 1
+	now = int(datetime.now().timestamp())
+	async with config.queue_db.transaction() as tx:
+		rows = await tx.fetchall(f"SELECT message_id, thread_id, is_reservation, guild_id, start_time, end_time FROM queue WHERE end_time = {key} or message_id = {msg_id}")
+		for message_id, thread_id, is_reservation, guild_id, start_time, end_time in rows:
+			scheduler.cancel(ROOM, message_id)
+			if not is_reservation:
+				# occupied until now when cleared early, until the end time when expired late
+				occupied = max(0, min(now, end_time) - start_time) / 3600 if start_time is not None else 0
+				telemetry.record(RoomCheckedOut(thread_id, occupied, guild_id=guild_id))
+		# only count rows that were actually removed
+		ROOM_QUEUE_SIZE.dec(await tx.execute(f"DELETE FROM queue WHERE end_time = {key} or message_id = {msg_id}"))
+
+async def load_queue_size() -> None:
+	"""
+	Set the queue size from the database, run once at startup
+	Returns:
+		None
+	"""
+	ROOM_QUEUE_SIZE.set(await config.queue_db.fetchval("select count(*) from queue"))
+
+async def _expire_room(bot, row):
+	"""
+	checks out a single expired queue row
+	Args:
+		bot (Bot): the discord bot object
+		row (tuple): the queue row
+
+	Returns:
+		None
+	"""
+	try:
+		thread_id, message_id, user_id, end_time, cc_user, prereservation, guild_id = row
+		guild = config.guild(guild_id)
+		channel = await entity_cache.channel(guild.forum_channel_id)
+		thread = await entity_cache.channel(thread_id)
+
+		# the time message only needs deleting, no need to fetch it
+		await outbound.run(Priority.NORMAL, thread.id, message_cache.partial(thread, message_id).delete)
+		message_cache.forget(message_id)
+
+		has_reservation = guild.room_status_tags['reserved'] in thread._applied_tags
+
+		room_type = list(set(list(guild.room_type_tags.values())) & set(thread._applied_tags))
+		await outbound.run(
+			Priority.NORMAL, thread.id, thread.override_tags,
+			channel.get_tag(room_type[0]),
+			channel.get_tag(guild.room_status_tags['available']),
+			reason="Autocheck out"
+		)
+		await check_out(msg_id=message_id)
+
+		# ping notification channel
+		target_user_id: int = user_id
+		target_channel: TextChannel = await entity_cache.channel(guild.notification_channel_id)
+		if not prereservation:
+			# normal checkout message, reserved while room is occupied
+			m = (f"<@{target_user_id}>\n" +
+			     f"Room {thread.name} has been auto checked out." + (" This room has reserveration." if has_reservation else "") + "\n")
+
+			if has_reservation:
+				# set up pre-reservation
+				reservation_duration = timedelta(minutes=guild.room_select_frequency_time * 2).total_seconds()
+				msg = await outbound.run(Priority.NORMAL, thread.id, thread.send, f"Reservation ends <t:{end_time + reservation_duration:.0f}:R>")
+				await check_in(
+					CheckInData(
+						thread.id,
+						msg,
+						target_user_id,
+						reservation_duration,
+						int(end_time + reservation_duration),
+						is_reservation=True,
+						thread_name=thread.name,
+						guild_id=guild_id
+					)
+				)
+				await outbound.run(
+					Priority.NORMAL, thread.id, thread.override_tags,
+					channel.get_tag(room_type[0]),
+					channel.get_tag(guild.room_status_tags['reserved']),
+					reason="Autocheck out"
+				)
 
-	config.queue_cursor.execute(f"DELETE FROM queue WHERE end_time = {key} or message_id = {msg_id}")
-	config.queue_connection.commit()
+				target_user: User = await entity_cache.user(user_id)
+				logger.info(
+					f"[{thread.name}] is reserved for the next set of patrons "
+					f"by [{target_user.global_name} ({target_user.name})]"
+				)
+		else:
+			# pre reservation message
+			m = (f"<@{target_user_id}>\n"
+			     f"Room {thread.name}'s resevation has expired.")
 
-async def room_task(bot):
-	key_count = config.queue_cursor.execute("SELECT count(*) FROM queue").fetchone()[0]
-	if key_count > 0:
-		res = config.queue_cursor.execute(f"SELECT * FROM queue WHERE end_time <= {int(datetime.now().timestamp())}")
-		keys = res.fetchall()
+		if cc_user is not None:
+			m += f"-# Also CCing <@{cc_user}>"
 
-		for k in keys:
-			try:
-				thread_id, message_id, user_id, end_time, cc_user, prereservation = k
-				message: Message = await bot.get_channel(config.FORUM_CHANNEL_ID).get_thread(thread_id).fetch_message(message_id)
-				channel = await message.guild.fetch_channel(config.FORUM_CHANNEL_ID)
-				thread = await message.guild.fetch_channel(message.channel.id)
+		await outbound.run(Priority.NOTIFICATION, target_channel.id, target_channel.send, m)
+	except errors.NotFound as e:
+		logger.error(f"Room expiry caught an exception: {type(e)} {e}")
 
-				await message.delete()
+async def room_task(bot, guild_id: int=None):
+	"""
+	checks out every room whose end time has passed, run by the deadline scheduler
+	Args:
+		bot (Bot): the discord bot object
+		guild_id (int): only check out rooms of this guild, every guild when not given
 
-				has_reservation = config.ROOM_STATUS_TAGS['reserved'] in thread._applied_tags
+	Returns:
+		None
+	"""
+	keys = await config.queue_db.fetchall("""
+		select thread_id, message_id, user_id, end_time, cc_user, is_reservation, guild_id
+		from queue
+		where end_time <= ? and (? is null or guild_id = ?)
+	""", (int(datetime.now().timestamp()), guild_id, guild_id))
 
-				room_type = list(set(list(config.ROOM_TYPE_TAGS.values())) & set(thread._applied_tags))
-				await thread.override_tags(
-					channel.get_tag(room_type[0]),
-					channel.get_tag(config.ROOM_STATUS_TAGS['available']),
-					reason="Autocheck out"
-				)
-				check_out(key=end_time)
-
-				# ping notification channel
-				target_user_id: int = user_id
-				target_channel: TextChannel = await message.guild.fetch_channel(config.NOTIFICATION_CHANNEL_ID)
-				if not prereservation:
-					# normal checkout message, reserved while room is occupied
-					m = (f"<@{target_user_id}>\n" +
-					     f"Room {message.channel.name} has been auto checked out." + (" This room has reserveration." if has_reservation else "") + "\n")
-
-					if has_reservation:
-						# set up pre-reservation
-						reservation_duration = timedelta(minutes=config.ROOM_SELECT_DEFAULT_FREQUENCY_TIME * 2).total_seconds()
-						msg = await thread.send(f"Reservation ends <t:{end_time + reservation_duration:.0f}:R>")
-						check_in(
-							CheckInData(
-								thread.id,
-								msg,
-								target_user_id,
-								reservation_duration,
-								int(end_time + reservation_duration),
-								is_reservation=True
-							)
-						)
-						await thread.override_tags(
-							channel.get_tag(room_type[0]),
-							channel.get_tag(config.ROOM_STATUS_TAGS['reserved']),
-							reason="Autocheck out"
-						)
-
-						target_user: User = bot.get_user(user_id)
-						logger.info(
-							f"[{message.channel.name}] is reserved for the next set of patrons "
-							f"by [{target_user.global_name} ({target_user.name})]"
-						)
-				else:
-					# pre reservation message
-					m = (f"<@{target_user_id}>\n"
-					     f"Room {message.channel.name}'s resevation has expired.")
-
-				if cc_user is not None:
-					m += f"-# Also CCing <@{cc_user}>"
-
-				await target_channel.send(m)
-			except errors.NotFound as e:
-				logger.error(f"queue_checker caught an exception: {type(e)} {e}")
+	# unrelated rooms are checked out concurrently, rows of the same thread (room and reservation) stay in order
+	await run_expired(keys, lambda row: _expire_room(bot, row), key=lambda row: row[0])
@@ -0,0 +1,141 @@
+import time
+
+import config
+
+from discord import ForumTag, Thread, User
+from discord.abc import GuildChannel
+from discord.ext.commands import Bot
+from typing import Any, Dict, Optional, Tuple, Union
+
+class _TTLCache:
+	def __init__(self):
+		self._items: Dict[int, Tuple[float, Any]] = {}
+
+	def get(self, key: int) -> Optional[Any]:
+		item = self._items.get(key)
+		if item is None:
+			return None
+
+		expires_at, value = item
+		if expires_at <= time.monotonic():
+			del self._items[key]
+			return None
+		return value
+
+	def put(self, key: int, value: Any, ttl: float) -> Any:
+		self._items[key] = (time.monotonic() + ttl, value)
+		return value
+
+	def pop(self, key: int) -> None:
+		self._items.pop(key, None)
+
+class EntityCache:
+	"""
+	Resolves channels, threads, forum tags and users by id.
+
+	The gateway cache of the bot is checked first, then objects fetched earlier (kept for
+	config.ENTITY_CACHE_TTL seconds), and only on a miss a REST fetch is made.
+	Fetched objects are dropped when a gateway event reports they changed.
+	"""
+	def __init__(self):
+		self._bot: Optional[Bot] = None
+		self._channels = _TTLCache()
+		self._users = _TTLCache()
+
+	def bind(self, bot: Bot) -> None:
+		"""
+		Attach the cache to the bot and listen to the gateway events that invalidate it
+		Args:
+			bot (Bot): the discord bot object
+
+		Returns:
+			None
+		"""
+		self._bot = bot
+		bot.add_listener(self._on_thread_update, "on_thread_update")
+		bot.add_listener(self._on_raw_thread_delete, "on_raw_thread_delete")
+		bot.add_listener(self._on_guild_channel_update, "on_guild_channel_update")
+		bot.add_listener(self._on_guild_channel_delete, "on_guild_channel_delete")
+		bot.add_listener(self._on_user_update, "on_user_update")
+
+	async def channel(self, channel_id: int) -> Union[GuildChannel, Thread]:
+		"""
+		Get a channel, forum channel or thread
+		Args:
+			channel_id (int): the channel or thread id
+
+		Returns:
+			GuildChannel or Thread
+		"""
+		channel = self._bot.get_channel(channel_id)
+		if channel is not None:
+			return channel
+
+		channel = self._channels.get(channel_id)
+		if channel is not None:
+			return channel
+
+		return self._channels.put(channel_id, await self._bot.fetch_channel(channel_id), config.ENTITY_CACHE_TTL)
+
+	async def tag(self, forum_id: int, tag_id: int) -> Optional[ForumTag]:
+		"""
+		Get a tag of a forum channel
+		Args:
+			forum_id (int): the forum channel id
+			tag_id (int): the tag id
+
+		Returns:
+			ForumTag, None if the forum has no such tag
+		"""
+		return (await self.channel(forum_id)).get_tag(tag_id)
+
+	async def user(self, user_id: int) -> User:
+		"""
+		Get a user
+		Args:
+			user_id (int): the user id
+
+		Returns:
+			User
+		"""
+		user = self._bot.get_user(user_id)
+		if user is not None:
+			return user
+
+		user = self._users.get(user_id)
+		if user is not None:
+			return user
+
+		return self._users.put(user_id, await self._bot.fetch_user(user_id), config.ENTITY_CACHE_TTL)
+
+	def invalidate(self, entity_id: int) -> None:
+		"""
+		Forget a fetched channel, thread or user
+		Args:
+			entity_id (int): the id
+
+		Returns:
+			None
+		"""
+		self._channels.pop(entity_id)
+		self._users.pop(entity_id)
+
+	#######################################
+	# GATEWAY EVENTS
+	#######################################
+	async def _on_thread_update(self, before, after):
+		self.invalidate(after.id)
+
+	async def _on_raw_thread_delete(self, payload):
+		self.invalidate(payload.thread_id)
+
+	async def _on_guild_channel_update(self, before, after):
+		self.invalidate(after.id)
+
+	async def _on_guild_channel_delete(self, channel):
+		self.invalidate(channel.id)
+
+	async def _on_user_update(self, before, after):
+		self.invalidate(after.id)
+
+entity_cache = EntityCache()
@@ -0,0 +1,366 @@
+import asyncio
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from src.metrics import DB_CALL
+from src.profiling import profiler
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
+
+class Transaction:
+	"""
+	Statements issued through a transaction run back to back on the database thread
+	and are committed together when the scope exits (or rolled back on an exception).
+
+	Only use it inside `async with database.transaction() as tx:`, and do not await Discord calls
+	inside the scope since every other database user waits for it.
+	"""
+	def __init__(self, database: "Database"):
+		self._database = database
+
+	async def execute(self, sql: str, parameters: Iterable=()) -> int:
+		"""
+		Run a statement
+		Args:
+			sql (str): the statement
+			parameters (Iterable): statement parameters
+
+		Returns:
+			int - number of rows changed
+		"""
+		return await self._database._run(self._database._execute, sql, parameters, False)
+
+	async def executemany(self, sql: str, parameters: Iterable[Iterable]) -> int:
+		"""
+		Run a statement once per parameter set
+		Args:
+			sql (str): the statement
+			parameters (Iterable[Iterable]): a statement parameter set per row
+
+		Returns:
+			int - number of rows changed
+		"""
+		return await self._database._run(self._database._executemany, sql, parameters, False)
+
+	async def fetchall(self, sql: str, parameters: Iterable=()) -> List[Tuple]:
+		"""
+		Run a query and return every row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			List[Tuple] - the rows
+		"""
+		return await self._database._run(self._database._fetchall, sql, parameters)
+
+	async def fetchone(self, sql: str, parameters: Iterable=()) -> Optional[Tuple]:
+		"""
+		Run a query and return the first row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			Tuple - the first row, None if there is none
+		"""
+		return await self._database._run(self._database._fetchone, sql, parameters)
+
+	async def fetchval(self, sql: str, parameters: Iterable=()) -> Any:
+		"""
+		Run a query and return the first column of the first row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			Any - the value, None if there is no row
+		"""
+		row = await self.fetchone(sql, parameters)
+		return None if row is None else row[0]
+
+class _TransactionScope:
+	def __init__(self, database: "Database"):
+		self._database = database
+
+	async def __aenter__(self) -> Transaction:
+		await self._database._lock.acquire()
+		return Transaction(self._database)
+
+	async def __aexit__(self, exc_type, exc, tb):
+		try:
+			if exc_type is None:
+				await self._database._run(self._database._connection.commit)
+			else:
+				await self._database._run(self._database._connection.rollback)
+		finally:
+			self._database._lock.release()
+
+class ReadPool:
+	"""
+	Read-only connections to the same database file, each owned by one pool thread.
+
+	In WAL mode readers see the last committed state and never wait on the writer,
+	so use it for reports and lookups that do not need to happen inside a transaction.
+	"""
+	def __init__(self, database: "Database", size: int):
+		self._database = database
+		self._local = threading.local()
+		self._connections: List[sqlite3.Connection] = []
+		self._connections_lock = threading.Lock()
+		self._executor = ThreadPoolExecutor(
+			max_workers=size,
+			thread_name_prefix=f"sqlite-{Path(database.path).stem}-read",
+			initializer=self._connect
+		)
+
+	def _connect(self) -> None:
+		connection = sqlite3.connect(f"{Path(self._database.path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+		self._database._tune(connection)
+		connection.execute("pragma query_only = 1")
+		self._local.connection = connection
+		with self._connections_lock:
+			self._connections.append(connection)
+
+	def _fetchall(self, sql: str, parameters: Iterable) -> List[Tuple]:
+		return self._local.connection.execute(sql, parameters).fetchall()
+
+	def _fetchone(self, sql: str, parameters: Iterable) -> Optional[Tuple]:
+		return self._local.connection.execute(sql, parameters).fetchone()
+
+	async def _run(self, function: Callable, *args):
+		with DB_CALL.labels(database=self._database.name, operation="read" + function.__name__).time(), profiler.phase("sql"):
+			return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+	async def fetchall(self, sql: str, parameters: Iterable=()) -> List[Tuple]:
+		"""
+		Run a query and return every row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			List[Tuple] - the rows
+		"""
+		return await self._run(self._fetchall, sql, parameters)
+
+	async def fetchone(self, sql: str, parameters: Iterable=()) -> Optional[Tuple]:
+		"""
+		Run a query and return the first row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			Tuple - the first row, None if there is none
+		"""
+		return await self._run(self._fetchone, sql, parameters)
+
+	async def fetchval(self, sql: str, parameters: Iterable=()) -> Any:
+		"""
+		Run a query and return the first column of the first row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			Any - the value, None if there is no row
+		"""
+		row = await self.fetchone(sql, parameters)
+		return None if row is None else row[0]
+
+	def close(self) -> None:
+		self._executor.shutdown()
+		for connection in self._connections:
+			connection.close()
+		self._connections.clear()
+
+class Database:
+	"""
+	A SQLite connection owned by a dedicated thread.
+
+	Every statement runs on that thread behind an awaitable, so disk I/O never blocks the event loop.
+	Single statements are committed on their own, use `transaction()` to group several statements.
+	Queries that can read a committed snapshot go through `read`, a pool of read-only connections.
+	"""
+	def __init__(self, path: str, journal_mode: str="wal", synchronous: str="normal", cache_size: int=-8000,
+	             mmap_size: int=64 * 1024 * 1024, read_connections: int=2):
+		self.path = path
+		self.name = Path(path).stem
+		self.journal_mode = journal_mode
+		self.synchronous = synchronous
+		self.cache_size = cache_size
+		self.mmap_size = mmap_size
+		self._trace: Optional[Callable[[str], None]] = None
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{Path(path).stem}")
+		self._connection: sqlite3.Connection = self._executor.submit(self._open).result()
+		self._lock = asyncio.Lock()
+		self._read_connections = read_connections
+		self._read_pool: Optional[ReadPool] = None
+
+	def _tune(self, connection: sqlite3.Connection) -> None:
+		connection.execute(f"pragma cache_size = {int(self.cache_size)}")
+		connection.execute(f"pragma mmap_size = {int(self.mmap_size)}")
+		connection.set_trace_callback(self._trace)
+
+	def _open(self) -> sqlite3.Connection:
+		connection = sqlite3.connect(self.path, check_same_thread=False)
+		connection.execute(f"pragma journal_mode = {self.journal_mode}")
+		connection.execute(f"pragma synchronous = {self.synchronous}")
+		self._tune(connection)
+		return connection
+
+	@property
+	def read(self) -> Union["ReadPool", "Database"]:
+		"""
+		The read-only connection pool, falls back to the writer connection when the pool is disabled
+		"""
+		if self._read_connections <= 0:
+			return self
+		if self._read_pool is None:
+			self._read_pool = ReadPool(self, self._read_connections)
+		return self._read_pool
+
+	#######################################
+	# DATABASE THREAD
+	#######################################
+	def _execute(self, sql: str, parameters: Iterable, commit: bool) -> int:
+		rowcount = self._connection.execute(sql, parameters).rowcount
+		if commit:
+			self._connection.commit()
+		return rowcount
+
+	def _executemany(self, sql: str, parameters: Iterable[Iterable], commit: bool) -> int:
+		rowcount = self._connection.executemany(sql, parameters).rowcount
+		if commit:
+			self._connection.commit()
+		return rowcount
+
+	def _fetchall(self, sql: str, parameters: Iterable) -> List[Tuple]:
+		return self._connection.execute(sql, parameters).fetchall()
+
+	def _fetchone(self, sql: str, parameters: Iterable) -> Optional[Tuple]:
+		return self._connection.execute(sql, parameters).fetchone()
+
+	async def _run(self, function: Callable, *args):
+		with DB_CALL.labels(database=self.name, operation=function.__name__.strip("_")).time(), profiler.phase("sql"):
+			return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+	#######################################
+	# PUBLIC INTERFACE
+	#######################################
+	def transaction(self) -> _TransactionScope:
+		"""
+		Open a transaction scope
+		Returns:
+			an async context manager yielding a Transaction
+		"""
+		return _TransactionScope(self)
+
+	async def execute(self, sql: str, parameters: Iterable=()) -> int:
+		"""
+		Run and commit a single statement
+		Args:
+			sql (str): the statement
+			parameters (Iterable): statement parameters
+
+		Returns:
+			int - number of rows changed
+		"""
+		async with self._lock:
+			return await self._run(self._execute, sql, parameters, True)
+
+	async def executemany(self, sql: str, parameters: Iterable[Iterable]) -> int:
+		"""
+		Run and commit a statement once per parameter set
+		Args:
+			sql (str): the statement
+			parameters (Iterable[Iterable]): a statement parameter set per row
+
+		Returns:
+			int - number of rows changed
+		"""
+		async with self._lock:
+			return await self._run(self._executemany, sql, parameters, True)
+
+	async def fetchall(self, sql: str, parameters: Iterable=()) -> List[Tuple]:
+		"""
+		Run a query and return every row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			List[Tuple] - the rows
+		"""
+		async with self._lock:
+			return await self._run(self._fetchall, sql, parameters)
+
+	async def fetchone(self, sql: str, parameters: Iterable=()) -> Optional[Tuple]:
+		"""
+		Run a query and return the first row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			Tuple - the first row, None if there is none
+		"""
+		async with self._lock:
+			return await self._run(self._fetchone, sql, parameters)
+
+	async def fetchval(self, sql: str, parameters: Iterable=()) -> Any:
+		"""
+		Run a query and return the first column of the first row
+		Args:
+			sql (str): the query
+			parameters (Iterable): query parameters
+
+		Returns:
+			Any - the value, None if there is no row
+		"""
+		row = await self.fetchone(sql, parameters)
+		return None if row is None else row[0]
+
+	def trace(self, callback: Optional[Callable[[str], None]]) -> None:
+		"""
+		Call callback(sql) for every statement run by the writer and the read connections, None to stop
+		Args:
+			callback (Callable): called on the connection's thread with the statement text
+
+		Returns:
+			None
+		"""
+		self._trace = callback
+		self._connection.set_trace_callback(callback)
+		if self._read_pool is not None:
+			for connection in self._read_pool._connections:
+				connection.set_trace_callback(callback)
+
+	def run_blocking(self, function: Callable[..., Any], *args) -> Any:
+		"""
+		Run function(connection, *args) on the database thread and wait for it.
+		Only meant for startup and shutdown, before or after the event loop runs.
+		Args:
+			function (Callable): called with the sqlite3 connection followed by args
+
+		Returns:
+			Any - what function returned
+		"""
+		return self._executor.submit(function, self._connection, *args).result()
+
+	def close(self) -> None:
+		"""
+		Commit and close the connection, then stop the database thread and the read pool
+		Returns:
+			None
+		"""
+		def _close(connection: sqlite3.Connection):
+			connection.commit()
+			connection.close()
+
+		if self._read_pool is not None:
+			self._read_pool.close()
+		self.run_blocking(_close)
+		self._executor.shutdown()
@@ -0,0 +1,99 @@
+from dataclasses import dataclass, field
+from datetime import timedelta
+from src.misc import format_duration, ChoiceTable
+from src.triggers import parse_triggers, TriggerRule
+from typing import Dict
+
+# the guild id of a venue configured without one, it serves every guild
+ANY_GUILD = 0
+
+# keys a guild entry may set, the top level of the config provides the defaults
+GUILD_KEYS = [
+	"channel_id", "role_notification_id", "thread_status_tags", "triggers",
+	"room_time_selection_frequency", "room_time_selection_count",
+]
+# ids of channels, roles and tags belong to a single guild, every guild entry sets its own
+GUILD_OWN_KEYS = ["channel_id", "role_notification_id", "thread_status_tags"]
+
+@dataclass(frozen=True)
+class GuildConfig:
+	"""
+	The channels, tags, roles and events of one venue (guild)
+	"""
+	guild_id: int
+	notification_channel_id: int
+	forum_channel_id: int
+	auction_channel_id: int
+	auction_public_notifier_channel_id: int
+	honeypot_channel_id: int
+	role_notification_id: Dict
+	room_status_tags: Dict
+	room_type_tags: Dict
+	auction_status_tags: Dict
+	room_select_frequency_time: int
+	room_select_frequency_count: int
+	events_trigger: Dict[str, TriggerRule] = field(default_factory=dict)
+	# room duration autocomplete, built from the two frequency values
+	room_time_choices: ChoiceTable = field(default_factory=lambda: ChoiceTable(()))
+
+def parse_guild(guild_id: int, data: Dict) -> GuildConfig:
+	"""
+	Build the configuration of a guild
+	Args:
+		guild_id (int): the guild id, ANY_GUILD for a config without guilds
+		data (Dict): the guild's keys (channel_id, role_notification_id, thread_status_tags, triggers, room_time_selection_*)
+
+	Returns:
+		GuildConfig
+	"""
+	frequency_time = data['room_time_selection_frequency']
+	frequency_count = data['room_time_selection_count']
+	guild = GuildConfig(
+		guild_id=guild_id,
+		notification_channel_id=data['channel_id']['notifier'],
+		forum_channel_id=data['channel_id']['room'],
+		auction_channel_id=data['channel_id']['auction'],
+		auction_public_notifier_channel_id=data['channel_id']['auction_public_notifier'],
+		honeypot_channel_id=data['channel_id'].get('honeypot', 0),
+		role_notification_id=data['role_notification_id'],
+		room_status_tags=data['thread_status_tags']['room'],
+		room_type_tags=data['thread_status_tags']['room_type'],
+		auction_status_tags=data['thread_status_tags']['auction'],
+		room_select_frequency_time=frequency_time,
+		room_select_frequency_count=frequency_count,
+		events_trigger=parse_triggers(data['triggers']),
+		room_time_choices=ChoiceTable(
+			(format_duration(timedelta(minutes=frequency_time * i)), i)
+			for i in range(1, frequency_count + 1)
+		),
+	)
+
+	assert len(guild.room_status_tags) > 0, f"No status tags for guild {guild_id}, set your tag in config.yml"
+	assert len(guild.room_type_tags) > 0, f"No type tags for guild {guild_id}, set your tag in config.yml"
+	assert guild.forum_channel_id, f"No channel ID for guild {guild_id}, set your channel ID in config.yml"
+	return guild
+
+def parse_guilds(data: Dict) -> Dict[int, GuildConfig]:
+	"""
+	Build the configuration of every guild. Without a guilds section the top level keys configure
+	a single venue, for the guild in guild_id or for any guild when it is not set.
+	Guild entries inherit the top level keys except GUILD_OWN_KEYS, which every entry must set.
+	Args:
+		data (Dict): the whole config
+
+	Returns:
+		Dict[int, GuildConfig] - the configurations by guild id, in config order
+	"""
+	defaults = {key: data[key] for key in GUILD_KEYS if key in data}
+	if not data.get('guilds'):
+		guild_id = int(data.get('guild_id', ANY_GUILD))
+		return {guild_id: parse_guild(guild_id, defaults)}
+
+	inherited = {key: value for key, value in defaults.items() if key not in GUILD_OWN_KEYS}
+	guilds = {}
+	for guild_id, guild_data in data['guilds'].items():
+		guild_data = guild_data or {}
+		missing = [key for key in GUILD_OWN_KEYS if key not in guild_data]
+		assert not missing, f"Guild {guild_id} does not set {', '.join(missing)}, every guild sets its own in config.yml"
+		guilds[int(guild_id)] = parse_guild(int(guild_id), {**inherited, **guild_data})
+	return guilds
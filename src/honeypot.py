@@ -0,0 +1,194 @@
+import asyncio
+import discord
+import time
+
+import config
+
+from dataclasses import dataclass
+from discord import Guild, Member, Message
+from logger import logger
+from pathlib import Path
+from src.cache import entity_cache
+from src.metrics import HONEYPOT_MESSAGES, HONEYPOT_BANS
+from src.outbound import outbound, Priority
+from src.tasks import BackgroundTasks
+from typing import Dict, List, Optional, Tuple
+
+# Discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+
+@dataclass
+class _Catch:
+	guild: Guild
+	author: Member
+	content: str
+
+class Honeypot:
+	"""
+	Handles messages in the honeypot channel, built for raids where hundreds of accounts post at once.
+
+	Every author is banned from a guild once per `dedup_ttl` seconds however often they post, bans run on a pool
+	of `workers` tasks, message contents are buffered and appended to the evidence files from a thread,
+	and the server owner gets one digest of everyone handled every `digest_interval` seconds.
+	"""
+	def __init__(self, directory: str="spammer_content"):
+		self.directory = Path(directory)
+		# (guild id, author id): monotonic time they were first caught, a raid on one guild does not hide it in another
+		self._seen: Dict[Tuple[int, int], float] = {}
+		# (guild id, author id): evidence not written yet
+		self._evidence: Dict[Tuple[int, int], List[str]] = {}
+		# guild id: (guild, digest lines)
+		self._digest: Dict[int, tuple] = {}
+		self._bans: Optional[asyncio.Queue] = None
+		self._tasks = BackgroundTasks()
+		self._next_digest = 0.0
+
+	def _ensure_tasks(self) -> None:
+		if self._tasks.running:
+			return
+		self._bans = asyncio.Queue()
+		self._next_digest = time.monotonic() + config.HONEYPOT_DIGEST_INTERVAL
+		self._tasks.start([self._run(), *(self._ban_worker() for _ in range(config.HONEYPOT_BAN_WORKERS))])
+
+	def catch(self, message: Message) -> bool:
+		"""
+		Keep the message as evidence and queue a ban of its author, unless they are queued or banned already
+		Args:
+			message (Message): a message sent in the honeypot channel
+
+		Returns:
+			bool - True if the author was queued for a ban
+		"""
+		self._ensure_tasks()
+		author = message.author
+		key = (message.guild.id, author.id)
+		message_time = message.created_at
+		self._evidence.setdefault(key, []).append(
+			f"at {message_time.ctime()} ({message_time}) in {message.guild.name} ({message.guild.id})\n{message.content}\n\n"
+		)
+
+		now = time.monotonic()
+		if now - self._seen.get(key, -config.HONEYPOT_DEDUP_TTL) < config.HONEYPOT_DEDUP_TTL:
+			HONEYPOT_MESSAGES.labels(status="duplicate").inc()
+			return False
+
+		self._seen[key] = now
+		HONEYPOT_MESSAGES.labels(status="new").inc()
+		logger.info(f"Spammer detected as {author.display_name} ({author.name}, ID: {author.id})", extra={"user_id": author.id})
+		self._bans.put_nowait(_Catch(message.guild, author, message.content))
+		return True
+
+	#######################################
+	# BANS
+	#######################################
+	async def _ban(self, catch: _Catch) -> None:
+		author = catch.author
+		server_owner = await entity_cache.user(catch.guild.owner_id)
+
+		try:
+			# send message to user, in case that if the user is a real user
+			await outbound.run(Priority.NORMAL, author.id, author.send, (
+				"Hello,\n"
+				f"If you are receiving this message, you have been banned from `{catch.guild.name}` for "
+				"**suspicions of being a spam bot**.\n\n"
+				f"If you think this ban was made in error, please contact {server_owner.display_name} (`{server_owner.name}`)."
+			))
+		except discord.HTTPException:
+			# closed DMs do not keep them in the server
+			pass
+
+		try:
+			await outbound.run(Priority.NORMAL, catch.guild.id, author.ban, delete_message_days=7, reason="Auto-mod banned via honeypot channel.")
+			status = "banned"
+		except discord.Forbidden:
+			status = "no permission"
+
+		HONEYPOT_BANS.labels(status=status.replace(" ", "_")).inc()
+		_, lines = self._digest.setdefault(catch.guild.id, (catch.guild, []))
+		lines.append(f"- {author.display_name} ({author.name}, ID: {author.id}) {status}: `{catch.content[:200]}`")
+
+	async def _ban_worker(self) -> None:
+		while True:
+			catch = await self._bans.get()
+			try:
+				await self._ban(catch)
+			except Exception as e:
+				# the next message of the author queues the ban again
+				self._seen.pop((catch.guild.id, catch.author.id), None)
+				HONEYPOT_BANS.labels(status="failed").inc()
+				logger.error(f"Honeypot could not ban {catch.author.id}: {type(e)} {e}", extra={"user_id": catch.author.id}, exc_info=True)
+
+	#######################################
+	# EVIDENCE AND DIGEST
+	#######################################
+	def _write(self, evidence: Dict[Tuple[int, int], List[str]]) -> None:
+		self.directory.mkdir(exist_ok=True)
+		# one file per author, the entries name the guild
+		for (_, author_id), entries in evidence.items():
+			with (self.directory / f"{author_id}.txt").open("a+") as f:
+				f.writelines(entries)
+
+	async def flush_evidence(self) -> None:
+		"""
+		Append the buffered messages to the evidence files, the file I/O runs in a thread
+		Returns:
+			None
+		"""
+		if not self._evidence:
+			return
+
+		evidence, self._evidence = self._evidence, {}
+		await asyncio.to_thread(self._write, evidence)
+		logger.info(f"Spammer content of {len(evidence)} author(s) has been saved to {self.directory}")
+
+	async def send_digest(self) -> None:
+		"""
+		Send every server owner the authors handled since the last digest
+		Returns:
+			None
+		"""
+		digests, self._digest = self._digest, {}
+		for guild, lines in digests.values():
+			server_owner = await entity_cache.user(guild.owner_id)
+			chunks = [f"## {len(lines)} user(s) were caught by the honeypot channel.\n"]
+			for line in lines:
+				if len(chunks[-1]) + len(line) + 1 > MESSAGE_LIMIT:
+					chunks.append("")
+				chunks[-1] += line[:MESSAGE_LIMIT - 1] + "\n"
+			for chunk in chunks:
+				await outbound.run(Priority.REPORT, server_owner.id, server_owner.send, chunk)
+
+	def _prune(self, now: float) -> None:
+		self._seen = {key: seen for key, seen in self._seen.items() if now - seen < config.HONEYPOT_DEDUP_TTL}
+
+	async def _run(self) -> None:
+		while not self._tasks.closing:
+			await asyncio.sleep(config.HONEYPOT_FLUSH_INTERVAL)
+			try:
+				await self.flush_evidence()
+				now = time.monotonic()
+				if now >= self._next_digest:
+					self._next_digest = now + config.HONEYPOT_DIGEST_INTERVAL
+					self._prune(now)
+					await self.send_digest()
+			except Exception as e:
+				logger.error(f"Honeypot caught an exception: {type(e)} {e}", exc_info=True)
+
+	async def close(self) -> None:
+		"""
+		Stop the workers, write the buffered evidence and send the last digest, queued bans are dropped
+		Returns:
+			None
+		"""
+		if self._tasks.running:
+			await self._tasks.stop()
+			if not self._bans.empty():
+				logger.warning(f"Honeypot dropped {self._bans.qsize()} queued ban(s) on shutdown")
+
+		try:
+			await self.flush_evidence()
+			await self.send_digest()
+		except Exception as e:
+			logger.error(f"Honeypot could not finish on shutdown: {type(e)} {e}")
+
+honeypot = Honeypot()
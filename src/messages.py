@@ -0,0 +1,241 @@
+import asyncio
+
+import config
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from discord import Message, Object, PartialMessage, errors, utils
+from logger import logger
+from src.outbound import outbound, Priority
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+DEFAULT_CACHE_SIZE = 256
+
+# Discord only bulk deletes up to 100 messages per request, and only messages younger than 14 days
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+
+class MessageCache:
+	"""
+	Resolves messages whose id we already stored (price messages, auction info, announcements)
+	without paging through channel history.
+
+	Recently fetched or edited messages are kept in a bounded LRU. A miss on an edit goes through a
+	partial message, so every edit costs a single request.
+	"""
+	def __init__(self, max_size: int=DEFAULT_CACHE_SIZE):
+		self.max_size = max_size
+		self._messages: OrderedDict[int, Message] = OrderedDict()
+
+	def __len__(self):
+		return len(self._messages)
+
+	def _remember(self, message: Message) -> Message:
+		self._messages[message.id] = message
+		self._messages.move_to_end(message.id)
+		while len(self._messages) > self.max_size:
+			self._messages.popitem(last=False)
+		return message
+
+	def forget(self, message_id: int) -> None:
+		"""
+		Drop a message from the cache (i.e. after it was deleted)
+		Args:
+			message_id (int): the message id
+
+		Returns:
+			None
+		"""
+		self._messages.pop(message_id, None)
+
+	def partial(self, channel, message_id: int) -> Union[Message, PartialMessage]:
+		"""
+		Get the cached message, or a partial message that can be edited or deleted without a fetch
+		Args:
+			channel (Messageable): the channel, thread or partial messageable the message is in
+			message_id (int): the message id
+
+		Returns:
+			Message or PartialMessage
+		"""
+		if message_id in self._messages:
+			self._messages.move_to_end(message_id)
+			return self._messages[message_id]
+		return channel.get_partial_message(message_id)
+
+	async def fetch(self, channel, message_id: int) -> Message:
+		"""
+		Get a full message object, fetching it by id on a cache miss
+		Args:
+			channel (Messageable): the channel, thread or partial messageable the message is in
+			message_id (int): the message id
+
+		Returns:
+			Message
+		"""
+		if message_id in self._messages:
+			self._messages.move_to_end(message_id)
+			return self._messages[message_id]
+		return self._remember(await channel.fetch_message(message_id))
+
+	async def edit(self, channel, message_id: int, **kwargs) -> Message:
+		"""
+		Edit a message by id with a single request
+		Args:
+			channel (Messageable): the channel, thread or partial messageable the message is in
+			message_id (int): the message id
+			**kwargs: passed to Message.edit
+
+		Returns:
+			Message - the edited message
+
+		Raises:
+			discord.errors.NotFound: the message does not exist anymore
+		"""
+		try:
+			return self._remember(await self.partial(channel, message_id).edit(**kwargs))
+		except errors.NotFound:
+			self.forget(message_id)
+			raise
+
+class EditCoalescer:
+	"""
+	Debounces edits of frequently updated messages (auction price and announcement messages).
+
+	The first edit of a message goes out right away, after that at most one edit per interval is sent,
+	carrying only the latest content that was asked for. Edits of one message are sent one at a time,
+	so a flush also waits for an edit that is already on its way.
+	"""
+	def __init__(self, cache: MessageCache, interval: float=None):
+		self._cache = cache
+		self._interval = interval
+		self._pending: Dict[int, Tuple[object, Dict]] = {}
+		self._tasks: Dict[int, asyncio.Task] = {}
+		# message_id: held while an edit of the message is being sent
+		self._sending: Dict[int, asyncio.Lock] = {}
+		# messages whose final edit was sent, later edits of them are dropped
+		self._closed: Set[int] = set()
+
+	@property
+	def interval(self) -> float:
+		return config.AUCTION_EDIT_INTERVAL if self._interval is None else self._interval
+
+	def __len__(self):
+		return len(self._pending)
+
+	def schedule(self, channel, message_id: int, **kwargs) -> None:
+		"""
+		Ask for a message to be edited, replacing any edit of it that was not sent yet
+		Args:
+			channel (Messageable): the channel, thread or partial messageable the message is in
+			message_id (int): the message id
+			**kwargs: passed to Message.edit
+
+		Returns:
+			None
+		"""
+		if message_id in self._closed:
+			return
+		self._pending[message_id] = (channel, kwargs)
+		if message_id not in self._tasks:
+			self._tasks[message_id] = asyncio.create_task(self._run(message_id))
+
+	def discard(self, *message_ids: int) -> None:
+		"""
+		Drop edits that were not sent yet (i.e. the message is about to be replaced or deleted)
+		Args:
+			*message_ids (int): the message ids
+
+		Returns:
+			None
+		"""
+		for message_id in message_ids:
+			self._pending.pop(message_id, None)
+
+	async def flush(self, *message_ids: int) -> None:
+		"""
+		Send the pending edits of these messages now
+		Args:
+			*message_ids (int): the message ids
+
+		Returns:
+			None
+		"""
+		await asyncio.gather(*[self._flush(message_id) for message_id in message_ids])
+
+	async def close(self, *message_ids: int) -> None:
+		"""
+		Send the pending edits of these messages now and drop any edit asked for afterwards
+		(i.e. the auction ended and its final state is about to be posted)
+		Args:
+			*message_ids (int): the message ids
+
+		Returns:
+			None
+		"""
+		self._closed.update(message_ids)
+		await self.flush(*message_ids)
+
+	async def _flush(self, message_id: int) -> None:
+		async with self._sending.setdefault(message_id, asyncio.Lock()):
+			pending = self._pending.pop(message_id, None)
+			if pending is None:
+				return
+
+			channel, kwargs = pending
+			try:
+				await outbound.run(Priority.NORMAL, channel.id, self._cache.edit, channel, message_id, **kwargs)
+			except errors.HTTPException as e:
+				logger.error(f"Coalesced edit of message {message_id} failed: {type(e)} {e}")
+
+	async def _run(self, message_id: int) -> None:
+		try:
+			while message_id in self._pending:
+				await self._flush(message_id)
+				await asyncio.sleep(self.interval)
+		finally:
+			self._tasks.pop(message_id, None)
+			self._sending.pop(message_id, None)
+
+async def delete_bot_messages(channel, author_id: int, message_ids: Iterable[int]=None, priority: Priority=Priority.CLEANUP) -> List[int]:
+	"""
+	Delete messages of the bot in a channel or thread with as few requests as possible.
+	Messages are bulk deleted 100 at a time, only messages too old for a bulk delete are deleted one by one.
+	Args:
+		channel (Messageable): the channel or thread
+		author_id (int): the bot user id, used when the channel history has to be read
+		message_ids (Iterable[int]): ids of the messages to delete, the channel history is read once when not given
+		priority (Priority): outbound priority of the delete requests
+
+	Returns:
+		List[int] - ids of the deleted messages
+	"""
+	if message_ids is None:
+		message_ids = [m.id async for m in channel.history() if m.author.id == author_id]
+	message_ids = list(message_ids)
+
+	cutoff = datetime.now(timezone.utc) - BULK_DELETE_MAX_AGE
+	recent = [message_id for message_id in message_ids if utils.snowflake_time(message_id) > cutoff]
+	old = [message_id for message_id in message_ids if utils.snowflake_time(message_id) <= cutoff]
+
+	deleted = []
+	for i in range(0, len(recent), BULK_DELETE_LIMIT):
+		chunk = recent[i:i + BULK_DELETE_LIMIT]
+		await outbound.run(priority, channel.id, channel.delete_messages, [Object(id=message_id) for message_id in chunk])
+		deleted.extend(chunk)
+
+	for message_id in old:
+		try:
+			await outbound.run(priority, channel.id, channel.get_partial_message(message_id).delete)
+		except errors.NotFound:
+			pass
+		deleted.append(message_id)
+
+	for message_id in deleted:
+		message_cache.forget(message_id)
+
+	logger.info(f"Deleted {len(deleted)} bot message(s) in [{channel.id}] ({len(old)} too old to bulk delete)")
+	return deleted
+
+message_cache = MessageCache()
+edit_coalescer = EditCoalescer(message_cache)
@@ -0,0 +1,231 @@
+import functools
+import math
+import time
+
+from aiohttp import web
+from contextlib import contextmanager
+from logger import logger
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# latency buckets in seconds, from a cached lookup up to a slow Discord request
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str="") -> str:
+	pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+	if extra:
+		pairs.append(extra)
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+	if math.isinf(value):
+		return "+Inf" if value > 0 else "-Inf"
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+	kind = ""
+
+	def __init__(self, name: str, description: str, labels: Sequence[str]=()):
+		self.name = name
+		self.description = description
+		self.label_names = tuple(labels)
+		self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+	def labels(self, **labels) -> "_Metric":
+		"""
+		Get the series of this metric with the given label values
+		"""
+		key = tuple(str(labels[name]) for name in self.label_names)
+		if key not in self._children:
+			self._children[key] = self._child()
+		return self._children[key]
+
+	def _child(self) -> "_Metric":
+		return type(self)(self.name, self.description)
+
+	def _series(self) -> Iterator[Tuple[Tuple[str, ...], "_Metric"]]:
+		if self.label_names:
+			yield from self._children.items()
+		else:
+			yield (), self
+
+	def render(self) -> str:
+		lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+		for labels, series in self._series():
+			lines.extend(series._render_samples(self.name, self.label_names, labels))
+		return "\n".join(lines)
+
+class Counter(_Metric):
+	"""
+	A value that only goes up
+	"""
+	kind = "counter"
+
+	def __init__(self, name: str, description: str, labels: Sequence[str]=()):
+		super().__init__(name, description, labels)
+		self.value = 0
+
+	def inc(self, amount: float=1) -> None:
+		self.value += amount
+
+	def _render_samples(self, name: str, label_names, labels) -> List[str]:
+		return [f"{name}{_format_labels(label_names, labels)} {_format_value(self.value)}"]
+
+class Gauge(_Metric):
+	"""
+	A value that goes up and down
+	"""
+	kind = "gauge"
+
+	def __init__(self, name: str, description: str, labels: Sequence[str]=()):
+		super().__init__(name, description, labels)
+		self.value = 0
+
+	def set(self, value: float) -> None:
+		self.value = value
+
+	def inc(self, amount: float=1) -> None:
+		self.value += amount
+
+	def dec(self, amount: float=1) -> None:
+		self.value -= amount
+
+	def _render_samples(self, name: str, label_names, labels) -> List[str]:
+		return [f"{name}{_format_labels(label_names, labels)} {_format_value(self.value)}"]
+
+class Histogram(_Metric):
+	"""
+	Distribution of observed values (usually durations in seconds) over fixed buckets
+	"""
+	kind = "histogram"
+
+	def __init__(self, name: str, description: str, labels: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_BUCKETS):
+		super().__init__(name, description, labels)
+		self.buckets = tuple(sorted(buckets)) + (math.inf,)
+		self.counts = [0] * len(self.buckets)
+		self.sum = 0.0
+		self.count = 0
+
+	def _child(self) -> "Histogram":
+		return Histogram(self.name, self.description, buckets=self.buckets[:-1])
+
+	def observe(self, value: float) -> None:
+		self.sum += value
+		self.count += 1
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+
+	@contextmanager
+	def time(self):
+		"""
+		Observe how long the scope took, also when it raises
+		"""
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - started)
+
+	def _render_samples(self, name: str, label_names, labels) -> List[str]:
+		lines = []
+		cumulative = 0
+		for bound, count in zip(self.buckets, self.counts):
+			cumulative += count
+			le = f'le="{_format_value(bound)}"'
+			lines.append(f"{name}_bucket{_format_labels(label_names, labels, le)} {cumulative}")
+		lines.append(f"{name}_sum{_format_labels(label_names, labels)} {_format_value(self.sum)}")
+		lines.append(f"{name}_count{_format_labels(label_names, labels)} {self.count}")
+		return lines
+
+def timed(histogram: Histogram):
+	"""
+	Decorator observing how long each call of a coroutine function takes
+	"""
+	def decorator(function: Callable[..., Awaitable]):
+		@functools.wraps(function)
+		async def inner(*args, **kwargs):
+			with histogram.time():
+				return await function(*args, **kwargs)
+		return inner
+	return decorator
+
+class Registry:
+	def __init__(self):
+		self._metrics: Dict[str, _Metric] = {}
+
+	def register(self, metric: _Metric) -> _Metric:
+		self._metrics[metric.name] = metric
+		return metric
+
+	def render(self) -> str:
+		"""
+		Every metric in the Prometheus text exposition format
+		"""
+		return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+registry = Registry()
+
+def counter(name: str, description: str, labels: Sequence[str]=()) -> Counter:
+	return registry.register(Counter(name, description, labels))
+
+def gauge(name: str, description: str, labels: Sequence[str]=()) -> Gauge:
+	return registry.register(Gauge(name, description, labels))
+
+def histogram(name: str, description: str, labels: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_BUCKETS) -> Histogram:
+	return registry.register(Histogram(name, description, labels, buckets))
+
+#####################################################################
+# BOT METRICS
+#####################################################################
+
+COMMAND_LATENCY = histogram("bot_command_seconds", "Time from an app command interaction to its completion", ["command"])
+BID_LATENCY = histogram("bot_bid_seconds", "Time to handle a bid button or custom bid")
+BIDS = counter("bot_bids_total", "Bids by outcome", ["status"])
+TRIGGERS = counter("bot_triggers_total", "Scheduled events by outcome", ["event", "outcome"])
+EXPIRY_RUN = histogram("bot_expiry_run_seconds", "Duration of a deadline scheduler handler run", ["kind"])
+ROOM_QUEUE_SIZE = gauge("bot_room_queue_size", "Rooms and reservations in the queue")
+DB_CALL = histogram("bot_db_call_seconds", "Duration of a database call on its thread, including the wait for it", ["database", "operation"])
+OUTBOUND_PENDING = gauge("bot_outbound_pending", "Outbound Discord requests waiting for a worker")
+OUTBOUND_WAIT = histogram("bot_outbound_wait_seconds", "Time an outbound Discord request waited in the queue", ["priority"])
+OUTBOUND_REQUEST = histogram("bot_outbound_request_seconds", "Duration of an outbound Discord request", ["priority"])
+OUTBOUND_ERRORS = counter("bot_outbound_errors_total", "Outbound Discord requests that raised", ["priority"])
+HONEYPOT_MESSAGES = counter("bot_honeypot_messages_total", "Messages in the honeypot channel, duplicate when the author was already caught", ["status"])
+HONEYPOT_BANS = counter("bot_honeypot_bans_total", "Honeypot bans by outcome", ["status"])
+
+class MetricsServer:
+	"""
+	Serves the registry on http://host:port/metrics
+	"""
+	def __init__(self):
+		self._runner: Optional[web.AppRunner] = None
+
+	async def _metrics(self, request: web.Request) -> web.Response:
+		return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+	async def start(self, host: str, port: int) -> None:
+		"""
+		Start listening
+		Args:
+			host (str): the interface to bind, keep it local
+			port (int): the port
+
+		Returns:
+			None
+		"""
+		app = web.Application()
+		app.router.add_get("/metrics", self._metrics)
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		await web.TCPSite(self._runner, host, port).start()
+		logger.info(f"Metrics are served on http://{host}:{port}/metrics")
+
+	async def close(self) -> None:
+		if self._runner is not None:
+			await self._runner.cleanup()
+			self._runner = None
+
+metrics_server = MetricsServer()
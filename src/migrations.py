@@ -0,0 +1,283 @@
+import sqlite3
+
+from logger import logger
+from typing import Callable, List, Tuple
+
+# (version, description, function applying the change to the connection)
+Migration = Tuple[int, str, Callable[[sqlite3.Connection], None]]
+
+def migrate(connection: sqlite3.Connection, migrations: List[Migration]) -> None:
+	"""
+	Bring a database up to date by applying every migration newer than its schema_version.
+	Each migration runs in its own transaction, together with the version bump.
+	Args:
+		connection (sqlite3.Connection): the database connection
+		migrations (List[Migration]): the migrations of this database, in version order
+
+	Returns:
+		None
+	"""
+	connection.execute("create table if not exists schema_version(version integer not null)")
+	connection.commit()
+	current_version = connection.execute("select coalesce(max(version), 0) from schema_version").fetchone()[0]
+
+	for version, description, function in migrations:
+		if version <= current_version:
+			continue
+
+		logger.info(f"Migrating database to version {version}: {description}")
+		connection.execute("begin")
+		try:
+			function(connection)
+			connection.execute("insert into schema_version(version) values (?)", (version,))
+			connection.commit()
+		except Exception:
+			connection.rollback()
+			raise
+
+def _rebuild_table(connection: sqlite3.Connection, table: str, definition: str, select: str) -> None:
+	"""
+	Recreate a table with a new definition, keeping its rows
+	Args:
+		connection (sqlite3.Connection): the database connection
+		table (str): the table name
+		definition (str): the column definitions of the new table
+		select (str): query over the old table producing the new rows
+
+	Returns:
+		None
+	"""
+	connection.execute(f"create table {table}_new({definition})")
+	connection.execute(f"insert into {table}_new {select.format(table=table)}")
+	connection.execute(f"drop table {table}")
+	connection.execute(f"alter table {table}_new rename to {table}")
+
+#####################################################################
+# QUEUE DATABASE
+#####################################################################
+
+def _queue_initial_tables(connection: sqlite3.Connection):
+	# create hotel queue table
+	connection.execute("""
+		CREATE TABLE IF NOT EXISTS queue(
+	        thread_id, message_id, user_id, end_time, cc_user, is_reservation
+	    )
+	""")
+
+	# create hotel nightly report table
+	# this table should be cleared nightly after "close" event is triggered
+	connection.execute("""
+		CREATE TABLE IF NOT EXISTS queue_report(
+			thread_id, hours
+		)
+	""")
+
+	# create information table
+	connection.execute("""
+		CREATE TABLE IF NOT EXISTS auction_info(
+			thread_id primary key,
+			auction_info_msg_id,
+			message_id,
+			notification_id
+		)
+	""")
+
+	# create auction history table
+	connection.execute("""
+		CREATE TABLE IF NOT EXISTS auction(
+			thread_id primary key,
+			end_time,
+			bid_increment,
+			bid_current,
+			bid_count,
+			last_bid_user_id
+		)
+	""")
+
+def _queue_auction_bid_table(connection: sqlite3.Connection):
+	# create auction bid history table, shared by every auction
+	connection.execute("""
+		CREATE TABLE IF NOT EXISTS auction_bid(
+			thread_id integer not null,
+			seq integer not null,
+			user_id integer not null,
+			bid integer,
+			current_bid integer,
+			set_bid integer,
+			primary key (thread_id, seq)
+		)
+	""")
+	connection.execute("CREATE INDEX IF NOT EXISTS auction_bid_thread_current_bid ON auction_bid(thread_id, current_bid DESC)")
+	connection.execute("CREATE INDEX IF NOT EXISTS auction_bid_user ON auction_bid(user_id)")
+
+	# move the rows of the old per-thread auction_history_{thread_id} tables
+	tables = connection.execute("select tbl_name from sqlite_master where type='table' and tbl_name glob 'auction_history_*'").fetchall()
+	for table_name, in tables:
+		thread_id = int(table_name.removeprefix("auction_history_"))
+		connection.execute(f"""
+			insert into auction_bid(thread_id, seq, user_id, bid, current_bid, set_bid)
+			select ?, rowid, user_id, bid, current_bid, set_bid
+			from {table_name}
+			order by rowid
+		""", (thread_id,))
+		connection.execute(f"drop table {table_name}")
+		logger.info(f"Moved auction history of thread {thread_id} into auction_bid")
+
+def _queue_typed_tables(connection: sqlite3.Connection):
+	# column order is kept, callers unpack `select *` rows positionally
+	_rebuild_table(connection, "queue", """
+		thread_id integer not null,
+		message_id integer not null,
+		user_id integer not null,
+		end_time integer not null,
+		cc_user integer,
+		is_reservation integer not null default 0
+	""", "select thread_id, message_id, user_id, end_time, cc_user, is_reservation from {table}")
+	connection.execute("create index queue_end_time on queue(end_time)")
+	connection.execute("create index queue_thread_id on queue(thread_id, is_reservation)")
+	connection.execute("create index queue_message_id on queue(message_id)")
+
+	_rebuild_table(connection, "queue_report", """
+		thread_id integer primary key,
+		hours real not null default 0
+	""", "select thread_id, sum(hours) from {table} group by thread_id")
+
+	_rebuild_table(connection, "auction_info", """
+		thread_id integer primary key,
+		auction_info_msg_id integer not null,
+		message_id integer not null,
+		notification_id integer not null
+	""", "select thread_id, auction_info_msg_id, message_id, notification_id from {table}")
+
+	_rebuild_table(connection, "auction", """
+		thread_id integer primary key,
+		end_time integer not null,
+		bid_increment integer not null,
+		bid_current integer not null,
+		bid_count integer not null default 0,
+		last_bid_user_id integer not null default -1
+	""", "select thread_id, end_time, bid_increment, bid_current, bid_count, last_bid_user_id from {table}")
+	connection.execute("create index auction_end_time on auction(end_time)")
+
+def _queue_start_times(connection: sqlite3.Connection):
+	# posix time a room was checked in, so the check out knows how long it was occupied. null for older rows
+	connection.execute("alter table queue add column start_time integer")
+
+def _queue_report_history(connection: sqlite3.Connection):
+	# thread names are kept with the totals, so the report does not resolve threads
+	connection.execute("alter table queue_report add column name text")
+
+	# nightly reports are archived here when the "close" event clears queue_report
+	connection.execute("""
+		create table queue_report_history(
+			report_time integer not null,
+			thread_id integer not null,
+			name text,
+			hours real not null,
+			primary key (report_time, thread_id)
+		)
+	""")
+
+def _queue_trigger_state(connection: sqlite3.Connection):
+	# posix time of the occurrence each scheduled event last fired for
+	connection.execute("""
+		create table trigger_state(
+			name text primary key,
+			last_fired integer not null
+		)
+	""")
+
+def _queue_bot_state(connection: sqlite3.Connection):
+	# small values the bot keeps across restarts, such as the hash of the last synced command tree
+	connection.execute("""
+		create table bot_state(
+			key text primary key,
+			value text not null
+		)
+	""")
+
+def _queue_guild_ids(connection: sqlite3.Connection):
+	# rows from before guilds were stored keep 0, config.guild() maps it to the first venue
+	for table in ("queue", "auction", "queue_report", "queue_report_history"):
+		connection.execute(f"alter table {table} add column guild_id integer not null default 0")
+	connection.execute("create index queue_guild_id on queue(guild_id, end_time)")
+	connection.execute("create index auction_guild_id on auction(guild_id, end_time)")
+
+	# the same event name is a different event in every guild
+	_rebuild_table(connection, "trigger_state", """
+		guild_id integer not null default 0,
+		name text not null,
+		last_fired integer not null,
+		primary key (guild_id, name)
+	""", "select 0, name, last_fired from {table}")
+
+QUEUE_MIGRATIONS: List[Migration] = [
+	(1, "initial tables", _queue_initial_tables),
+	(2, "shared auction_bid table", _queue_auction_bid_table),
+	(3, "typed tables and indexes on the expiry and lookup columns", _queue_typed_tables),
+	(4, "check in time of every room", _queue_start_times),
+	(5, "nightly report names and history", _queue_report_history),
+	(6, "last fired time of the scheduled events", _queue_trigger_state),
+	(7, "bot state", _queue_bot_state),
+	(8, "guild id of every room, auction, report and event", _queue_guild_ids),
+]
+
+#####################################################################
+# TELEMETRY DATABASE
+#####################################################################
+
+def _telemetry_initial_tables(connection: sqlite3.Connection):
+	# creates hotel room telemetry table
+	connection.execute("create table if not exists room_stats(thread_id, rent_count, extension_count, rent_total_time)")
+
+def _telemetry_typed_tables(connection: sqlite3.Connection):
+	_rebuild_table(connection, "room_stats", """
+		thread_id integer primary key,
+		rent_count integer not null default 0,
+		extension_count integer not null default 0,
+		rent_total_time real not null default 0
+	""", "select thread_id, sum(rent_count), sum(extension_count), sum(rent_total_time) from {table} group by thread_id")
+
+def _telemetry_rental_events(connection: sqlite3.Connection):
+	# append-only log of every check in, extension, check out and reservation
+	connection.execute("""
+		create table rental_event(
+			id integer primary key,
+			thread_id integer not null,
+			kind text not null,
+			time integer not null,
+			hours real not null default 0
+		)
+	""")
+	connection.execute("create index rental_event_time on rental_event(time)")
+	connection.execute("create index rental_event_thread_id on rental_event(thread_id, time)")
+
+	# rollups of rental_event, bucket is the posix time the hour / local day starts
+	# hours count rented time, occupied_hours the time until check out
+	for table in ("rental_hourly", "rental_daily"):
+		connection.execute(f"""
+			create table {table}(
+				bucket integer not null,
+				thread_id integer not null,
+				check_ins integer not null default 0,
+				extensions integer not null default 0,
+				check_outs integer not null default 0,
+				reservations integer not null default 0,
+				hours real not null default 0,
+				occupied_hours real not null default 0,
+				primary key (bucket, thread_id)
+			)
+		""")
+
+def _telemetry_guild_ids(connection: sqlite3.Connection):
+	# rows from before guilds were stored keep 0
+	for table in ("room_stats", "rental_event", "rental_hourly", "rental_daily"):
+		connection.execute(f"alter table {table} add column guild_id integer not null default 0")
+	connection.execute("create index rental_event_guild_id on rental_event(guild_id, time)")
+
+TELEMETRY_MIGRATIONS: List[Migration] = [
+	(1, "initial tables", _telemetry_initial_tables),
+	(2, "typed room_stats keyed by thread", _telemetry_typed_tables),
+	(3, "rental event log with hourly and daily rollups", _telemetry_rental_events),
+	(4, "guild id of every room statistic and rental event", _telemetry_guild_ids),
+]
@@ -1,43 +1,10 @@
-import re
-import logger
-from datetime import datetime, timedelta
-
-def number_abbreviation_parser(value: str):
-	regex = re.compile(
-		r'((?P<millions>\d+?\.?\d*?)m)?'
-		r'((?P<thousands>\d+?\.?\d*?)k)?'
-		r'(?P<ones>\d*\.?\d*)?'
-	)
-	# ?((\d+?\.\d*?)k)?(\d*\.\d*?)
-	try:
-		match = regex.match(value)
-		group_dict = match.groupdict()
-		group_dict = {k: float(v) if v else 0 for k, v in group_dict.items()}
-
-		return int((group_dict['millions'] * 1000000) + (group_dict['thousands'] * 1000) + (group_dict['ones']))
-	except ValueError:
-		logger.warning(f"number abbreviation parser cannot parse input value {value}")
-		return None
-
-def parse_duration(duration: str, current_time: datetime=None):
-	"""
-	parse a duration to timedelta and timestamp from now to duration
-	Args:
-		duration (str): a human-readable duration (e.g. 1d, 2h, 300s)
-		current_time (datetime, optional): a datetime object of the desired time (defaults to datetime.now())
-	Returns:
-		tuple - timedelta of duration and timestamp of current_time + duration
-	"""
-	# parse duration and set up times
-	regex = re.compile(r'((?P<days>\d+?)d)?((?P<hours>\d+?)hr?)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?')
-	match = regex.match(duration)
-	duration_dict = match.groupdict()
-	duration_dict = {k: int(v) if v is not None else 0 for k, v in duration_dict.items()}
+from datetime import timedelta
+from discord import app_commands
+from types import MappingProxyType
+from typing import Any, Iterable, List, Tuple
 
-	d = timedelta(**duration_dict)
-	timestamp = int(((datetime.now() if current_time is None else current_time) + d).timestamp())
-
-	return d, timestamp
+# Discord shows at most this many autocomplete choices
+MAX_CHOICES = 25
 
 def number_suffix(value: int):
 	if (value // 10) % 10 == 1:
@@ -50,4 +17,45 @@ def number_suffix(value: int):
 	elif value % 10 == 3:
 		return f"{value}rd"
 
-	return f"{value}th"
\ No newline at end of file
+	return f"{value}th"
+
+def format_duration(duration: timedelta) -> str:
+	"""
+	format a duration as hours and minutes (e.g. 1h 30m, 26h 0m)
+	Args:
+		duration (timedelta): the duration
+
+	Returns:
+		str - the formatted duration
+	"""
+	minutes = int(duration.total_seconds()) // 60
+	return f"{minutes // 60}h {minutes % 60}m"
+
+class ChoiceTable:
+	"""
+	Immutable autocomplete choices with an index from every typed prefix to the choices it matches.
+	A prefix matches a choice name with or without its spaces and in any case, so "1h3", "1H 3" and "1h 30m" all find "1h 30m".
+	"""
+	def __init__(self, choices: Iterable[Tuple[str, Any]]):
+		self.choices: Tuple[app_commands.Choice, ...] = tuple(app_commands.Choice(name=name, value=value) for name, value in choices)
+
+		index = {}
+		for choice in self.choices:
+			name = choice.name.lower()
+			keys = {name[:end] for end in range(1, len(name) + 1)}
+			keys |= {name.replace(" ", "")[:end] for end in range(1, len(name) + 1)}
+			for key in keys:
+				index.setdefault(key, []).append(choice)
+		self._index = MappingProxyType({key: tuple(matches[:MAX_CHOICES]) for key, matches in index.items()})
+
+	def __len__(self):
+		return len(self.choices)
+
+	def match(self, current: str) -> List[app_commands.Choice]:
+		"""
+		the choices starting with what the user typed so far, every choice (up to Discord's limit) when nothing is typed
+		"""
+		current = current.strip().lower()
+		if not current:
+			return list(self.choices[:MAX_CHOICES])
+		return list(self._index.get(current, ()))
@@ -0,0 +1,221 @@
+import asyncio
+import bisect
+import itertools
+import time
+
+import config
+
+from dataclasses import dataclass, field
+from enum import IntEnum
+from src.metrics import OUTBOUND_ERRORS, OUTBOUND_PENDING, OUTBOUND_REQUEST, OUTBOUND_WAIT
+from src.profiling import profiler
+from src.tasks import BackgroundTasks
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+class Priority(IntEnum):
+	"""
+	Lower values are sent first.
+	Interaction responses themselves are answered inline and never queued, INTERACTION is for
+	the other requests a command makes on behalf of a waiting user. They do not wait for the route
+	budget, Discord's own limits still apply to them.
+	"""
+	INTERACTION = 0
+	NOTIFICATION = 1
+	NORMAL = 2
+	CLEANUP = 3
+	REPORT = 4
+
+# the most urgent priority every worker takes, reserved workers only take actions up to URGENT
+URGENT = Priority.NOTIFICATION
+# seconds between sweeps of the budgets of idle routes
+PRUNE_INTERVAL = 60
+
+class RouteBudget:
+	"""
+	Token bucket of one route (usually a channel, thread or DM).
+	Holds up to `burst` requests and refills `rate` requests per second.
+	"""
+	def __init__(self, rate: float, burst: int):
+		self.rate = rate
+		self.burst = burst
+		self._tokens = float(burst)
+		self._updated = time.monotonic()
+
+	def _refill(self, now: float) -> None:
+		self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def wait_time(self, now: float) -> float:
+		"""
+		Seconds until a request can be sent on this route, 0 if it can be sent now
+		"""
+		self._refill(now)
+		return 0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+	def take(self, now: float) -> None:
+		self._refill(now)
+		self._tokens -= 1
+
+	def full(self, now: float) -> bool:
+		"""
+		Whether the bucket refilled completely, a full bucket is the same as a new one
+		"""
+		self._refill(now)
+		return self._tokens >= self.burst
+
+@dataclass(order=True)
+class _Action:
+	priority: int
+	seq: int
+	route: Hashable = field(compare=False)
+	function: Callable[..., Awaitable] = field(compare=False)
+	args: tuple = field(compare=False)
+	kwargs: dict = field(compare=False)
+	future: asyncio.Future = field(compare=False)
+	queued_at: float = field(compare=False)
+
+class OutboundQueue:
+	"""
+	Central queue for outbound Discord requests from background tasks and commands.
+
+	Workers always pick the most urgent action whose route still has budget, so a bulk cleanup
+	on one channel cannot hold back a winner notification or a command follow up.
+	Reserved workers only take INTERACTION and NOTIFICATION actions, so they are free for them
+	even while long cleanups and reports hold every other worker.
+	"""
+	def __init__(self, workers: int=None, route_rate: float=None, route_burst: int=None, reserved_workers: int=None):
+		self._workers = workers
+		self._reserved_workers = reserved_workers
+		self._route_rate = route_rate
+		self._route_burst = route_burst
+		self._pending: List[_Action] = []
+		self._budgets: Dict[Hashable, RouteBudget] = {}
+		self._pruned_at = time.monotonic()
+		self._seq = itertools.count()
+		self._tasks = BackgroundTasks()
+
+	def __len__(self):
+		return len(self._pending)
+
+	def _budget(self, route: Hashable) -> RouteBudget:
+		if route not in self._budgets:
+			self._budgets[route] = RouteBudget(
+				config.OUTBOUND_ROUTE_RATE if self._route_rate is None else self._route_rate,
+				config.OUTBOUND_ROUTE_BURST if self._route_burst is None else self._route_burst,
+			)
+		return self._budgets[route]
+
+	def _prune(self, now: float) -> None:
+		# buckets of routes that were used once (e.g. DMs, ended threads) would pile up otherwise
+		if now - self._pruned_at < PRUNE_INTERVAL:
+			return
+		self._pruned_at = now
+		busy = {action.route for action in self._pending}
+		for route in [route for route, budget in self._budgets.items() if route not in busy and budget.full(now)]:
+			del self._budgets[route]
+
+	def _ensure_workers(self) -> None:
+		if self._tasks.running:
+			return
+		workers = config.OUTBOUND_WORKERS if self._workers is None else self._workers
+		reserved_workers = config.OUTBOUND_RESERVED_WORKERS if self._reserved_workers is None else self._reserved_workers
+		self._tasks.start([
+			*(self._worker(Priority.REPORT) for _ in range(workers)),
+			*(self._worker(URGENT) for _ in range(reserved_workers)),
+		])
+
+	def submit(self, priority: Priority, route: Hashable, function: Callable[..., Awaitable], *args, **kwargs) -> asyncio.Future:
+		"""
+		Queue function(*args, **kwargs)
+		Args:
+			priority (Priority): how urgent the request is
+			route (Hashable): the rate limit route, usually the channel id the request goes to
+			function (Callable): coroutine function making the request
+
+		Returns:
+			asyncio.Future - resolved with the result of the request
+		"""
+		self._ensure_workers()
+		future = asyncio.get_running_loop().create_future()
+		bisect.insort(self._pending, _Action(int(priority), next(self._seq), route, function, args, kwargs, future, time.monotonic()))
+		OUTBOUND_PENDING.set(len(self._pending))
+		self._tasks.wakeup.set()
+		return future
+
+	async def run(self, priority: Priority, route: Hashable, function: Callable[..., Awaitable], *args, **kwargs) -> Any:
+		"""
+		Queue function(*args, **kwargs) and wait for its result
+		Args:
+			priority (Priority): how urgent the request is
+			route (Hashable): the rate limit route, usually the channel id the request goes to
+			function (Callable): coroutine function making the request
+
+		Returns:
+			Any - the result of the request, its exception is raised here
+		"""
+		with profiler.phase("discord"):
+			return await self.submit(priority, route, function, *args, **kwargs)
+
+	def _take(self, now: float, max_priority: Priority=Priority.REPORT) -> Optional[_Action]:
+		for index, action in enumerate(self._pending):
+			if action.priority > max_priority:
+				# pending actions are sorted by priority
+				break
+			budget = self._budget(action.route)
+			# a user is waiting on interactions, they still spend the budget of the other requests
+			if action.priority == Priority.INTERACTION or budget.wait_time(now) == 0:
+				budget.take(now)
+				action = self._pending.pop(index)
+				OUTBOUND_PENDING.set(len(self._pending))
+				return action
+		self._prune(now)
+		return None
+
+	def _next_ready(self, now: float, max_priority: Priority=Priority.REPORT) -> Optional[float]:
+		return min((
+			0 if action.priority == Priority.INTERACTION else self._budget(action.route).wait_time(now)
+			for action in self._pending if action.priority <= max_priority
+		), default=None)
+
+	async def _worker(self, max_priority: Priority) -> None:
+		wakeup = self._tasks.wakeup
+		while not self._tasks.closing:
+			action = self._take(time.monotonic(), max_priority)
+			if action is None:
+				wakeup.clear()
+				try:
+					await asyncio.wait_for(wakeup.wait(), timeout=self._next_ready(time.monotonic(), max_priority))
+				except asyncio.TimeoutError:
+					pass
+				continue
+
+			if action.future.cancelled():
+				continue
+
+			priority = Priority(action.priority).name.lower()
+			OUTBOUND_WAIT.labels(priority=priority).observe(time.monotonic() - action.queued_at)
+			try:
+				with OUTBOUND_REQUEST.labels(priority=priority).time():
+					result = await action.function(*action.args, **action.kwargs)
+			except Exception as e:
+				OUTBOUND_ERRORS.labels(priority=priority).inc()
+				if not action.future.cancelled():
+					action.future.set_exception(e)
+			else:
+				if not action.future.cancelled():
+					action.future.set_result(result)
+
+	async def close(self) -> None:
+		"""
+		Stop the workers, pending requests are cancelled
+		Returns:
+			None
+		"""
+		await self._tasks.stop()
+
+		for action in self._pending:
+			action.future.cancel()
+		self._pending.clear()
+		OUTBOUND_PENDING.set(0)
+
+outbound = OutboundQueue()
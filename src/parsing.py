@@ -0,0 +1,107 @@
+import re
+
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+# 1m, 1.5m, 300k, 1m250k, 1m 250k, 500000, 500,000
+# commas only separate thousands and spaces only come before a k part, so 1,5m and 1m 5 are rejected
+_INTEGER = r"(?:\d{1,3}(?:,\d{3})+|\d+)"
+_NUMBER = rf"(?:{_INTEGER}(?:\.\d*)?|\.\d+)"
+AMOUNT_GRAMMAR = re.compile(
+	rf"(?:(?P<millions>{_NUMBER})m)?"
+	rf"(?:\s*(?P<thousands>{_NUMBER})k)?"
+	rf"(?P<ones>{_NUMBER})?"
+)
+# 1d, 2h, 2hr, 30m, 45s or any combination in that order (e.g. 1d3h), spaces are ignored
+DURATION_GRAMMAR = re.compile(r"(?:(?P<days>\d+)d)?(?:(?P<hours>\d+)hr?)?(?:(?P<minutes>\d+)m)?(?:(?P<seconds>\d+)s)?")
+
+# largest value an integer column holds
+MAX_AMOUNT = 2 ** 63 - 1
+MAX_DURATION = timedelta(days=365)
+# longer inputs are rejected before matching, no valid amount or duration comes close
+MAX_INPUT_LENGTH = 32
+# distinct inputs kept by each parser, bids repeat the same few values
+CACHE_SIZE = 1024
+
+_AMOUNT_MULTIPLIERS = {"millions": 1_000_000, "thousands": 1_000, "ones": 1}
+_DURATION_SECONDS = {"days": 86400, "hours": 3600, "minutes": 60, "seconds": 1}
+
+class ParseError(ValueError):
+	"""
+	Raised when user input does not follow a grammar
+	"""
+	def __init__(self, value: str, reason: str):
+		super().__init__(f"cannot parse {value!r}: {reason}")
+		self.value = value
+		self.reason = reason
+
+def _normalize_amount(value: str) -> str:
+	return value.strip().lower()
+
+def _normalize_duration(value: str) -> str:
+	return value.replace(" ", "").lower()
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_amount(value: str) -> int:
+	if len(value) > MAX_INPUT_LENGTH:
+		raise ParseError(value[:MAX_INPUT_LENGTH] + "...", "the input is too long")
+	match = AMOUNT_GRAMMAR.fullmatch(value)
+	if match is None or not value:
+		raise ParseError(value, "expected an amount such as 1m, 300k or 500000")
+
+	# decimal, so 1.1m is exactly 1,100,000 and not 1,100,000.0000000002
+	total = sum(Decimal(part.replace(",", "")) * _AMOUNT_MULTIPLIERS[name] for name, part in match.groupdict().items() if part)
+	if total > MAX_AMOUNT:
+		raise ParseError(value, "the amount is too large")
+	if total != total.to_integral_value():
+		raise ParseError(value, "the amount must be a whole number of Gil")
+	amount = int(total)
+	if amount <= 0:
+		raise ParseError(value, "the amount must be positive")
+	return amount
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_duration(value: str) -> timedelta:
+	if len(value) > MAX_INPUT_LENGTH:
+		raise ParseError(value[:MAX_INPUT_LENGTH] + "...", "the input is too long")
+	match = DURATION_GRAMMAR.fullmatch(value)
+	if match is None or not value:
+		raise ParseError(value, "expected a duration such as 1d3h, 2h or 30m")
+
+	# summed as an integer first, timedelta overflows on huge values
+	seconds = sum(int(part) * _DURATION_SECONDS[name] for name, part in match.groupdict().items() if part)
+	if seconds > MAX_DURATION.total_seconds():
+		raise ParseError(value, "the duration is too long")
+	duration = timedelta(seconds=seconds)
+	if duration <= timedelta(0):
+		raise ParseError(value, "the duration must be positive")
+	return duration
+
+def parse_amount(value: str) -> int:
+	"""
+	Parse a Gil amount with optional m and k abbreviations
+	Args:
+		value (str): user input (e.g. 1m, 1.5m, "500,000", 1m250k)
+
+	Returns:
+		int - the amount, always positive
+
+	Raises:
+		ParseError: the input is not an amount
+	"""
+	return _parse_amount(_normalize_amount(value))
+
+def parse_duration(value: str) -> timedelta:
+	"""
+	Parse a human-readable duration
+	Args:
+		value (str): user input (e.g. 1d, 2h, 1d3h, 300s)
+
+	Returns:
+		timedelta - the duration, positive and at most MAX_DURATION
+
+	Raises:
+		ParseError: the input is not a duration
+	"""
+	return _parse_duration(_normalize_duration(value))
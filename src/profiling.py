@@ -0,0 +1,210 @@
+import functools
+import sys
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from discord import app_commands
+from logger import logger
+from pathlib import Path
+from tabulate import tabulate
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# phase durations of the profiled handler the current task runs for, None when nothing is profiled
+_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("profiling_phases", default=None)
+
+# deepest stack kept per sample, the outer frames are the event loop itself
+MAX_STACK_DEPTH = 64
+
+class Profiler:
+	"""
+	Opt-in profiling of command handlers and background loops.
+
+	While enabled, a sampling thread records the call stacks of every other thread,
+	and each profiled handler records how long it spent in SQLite ("sql") and in outbound Discord
+	requests ("discord"), the rest of its time is Python work such as building messages.
+	`dump` writes the timings and the sampled stacks (folded, one stack per line) to a file.
+	"""
+	def __init__(self):
+		self.enabled = False
+		self.interval = 0.01
+		self.path = Path("profile.txt")
+		self._started_at: Optional[datetime] = None
+		self._samples = 0
+		self._stacks: Counter = Counter()
+		# handler: phase: [calls, total seconds, max seconds]
+		self._timings: Dict[str, Dict[str, List[float]]] = {}
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	#######################################
+	# SAMPLING THREAD
+	#######################################
+	def _sample(self) -> None:
+		own_id = threading.get_ident()
+		names = {thread.ident: thread.name for thread in threading.enumerate()}
+		stacks = []
+		for thread_id, frame in sys._current_frames().items():
+			if thread_id == own_id:
+				continue
+
+			stack = []
+			while frame is not None and len(stack) < MAX_STACK_DEPTH:
+				stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+				frame = frame.f_back
+			stack.append(names.get(thread_id, str(thread_id)))
+			stacks.append(";".join(reversed(stack)))
+
+		with self._lock:
+			self._samples += 1
+			self._stacks.update(stacks)
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			self._sample()
+
+	#######################################
+	# PUBLIC INTERFACE
+	#######################################
+	def start(self, interval: float=None, path: str=None) -> None:
+		"""
+		Clear the previous profile and start profiling
+		Args:
+			interval (float): seconds between stack samples
+			path (str): file `dump` writes to
+
+		Returns:
+			None
+		"""
+		if self.enabled:
+			return
+
+		self.interval = interval or self.interval
+		self.path = Path(path) if path else self.path
+		with self._lock:
+			self._samples = 0
+			self._stacks.clear()
+			self._timings.clear()
+		self._started_at = datetime.now()
+
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+		self._thread.start()
+		self.enabled = True
+		logger.info(f"Profiling started, sampling every {self.interval * 1000:g} ms")
+
+	def stop(self) -> Optional[Path]:
+		"""
+		Stop profiling and dump the profile
+		Returns:
+			Path - the dumped profile, None if profiling was not running
+		"""
+		if not self.enabled:
+			return None
+
+		self.enabled = False
+		self._stop.set()
+		self._thread.join()
+		self._thread = None
+		return self.dump()
+
+	@contextmanager
+	def phase(self, name: str):
+		"""
+		Add the time spent in the scope to a phase of the handler being profiled
+		"""
+		phases = _phases.get()
+		if phases is None:
+			yield
+			return
+
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			phases[name] = phases.get(name, 0) + time.perf_counter() - started
+
+	def profiled(self, name: str):
+		"""
+		Decorator profiling each call of a coroutine function as handler `name` while profiling is enabled
+		"""
+		def decorator(function: Callable[..., Awaitable]):
+			@functools.wraps(function)
+			async def inner(*args, **kwargs):
+				if not self.enabled:
+					return await function(*args, **kwargs)
+
+				phases = {}
+				token = _phases.set(phases)
+				started = time.perf_counter()
+				try:
+					return await function(*args, **kwargs)
+				finally:
+					_phases.reset(token)
+					phases["total"] = time.perf_counter() - started
+					self._record(name, phases)
+			return inner
+		return decorator
+
+	def instrument(self, tree: app_commands.CommandTree) -> None:
+		"""
+		Profile every app command of the tree, run once after the cogs are added
+		Args:
+			tree (CommandTree): the bot's command tree
+
+		Returns:
+			None
+		"""
+		for command in tree.walk_commands():
+			if isinstance(command, app_commands.Command):
+				# the parameters were parsed from the callback already, only the invoked function changes
+				command._callback = self.profiled(f"/{command.qualified_name}")(command._callback)
+
+	def _record(self, name: str, phases: Dict[str, float]) -> None:
+		with self._lock:
+			timings = self._timings.setdefault(name, {})
+			for phase, seconds in phases.items():
+				timing = timings.setdefault(phase, [0, 0.0, 0.0])
+				timing[0] += 1
+				timing[1] += seconds
+				timing[2] = max(timing[2], seconds)
+
+	def dump(self, path: str=None) -> Path:
+		"""
+		Write the profile collected so far
+		Args:
+			path (str): where to write it, defaults to the configured path
+
+		Returns:
+			Path - the written file
+		"""
+		path = Path(path) if path else self.path
+		with self._lock:
+			timings = {name: {phase: list(timing) for phase, timing in phases.items()} for name, phases in self._timings.items()}
+			stacks = self._stacks.most_common()
+			samples = self._samples
+
+		table = []
+		for name, phases in sorted(timings.items(), key=lambda item: -item[1]["total"][1]):
+			calls, total, longest = phases["total"]
+			sql = phases.get("sql", [0, 0.0, 0.0])[1]
+			discord = phases.get("discord", [0, 0.0, 0.0])[1]
+			table.append([name, calls, total, total / calls, longest, sql, discord, max(0.0, total - sql - discord)])
+
+		with path.open("w") as f:
+			f.write(f"# Profile from {self._started_at} to {datetime.now()}\n")
+			f.write(f"# {samples} stack samples every {self.interval * 1000:g} ms\n\n")
+			f.write("## Handler timings (seconds)\n")
+			f.write(tabulate(table, headers=["Handler", "Calls", "Total", "Mean", "Max", "SQL", "Discord", "Other"], floatfmt=".4f"))
+			f.write("\n\n## Sampled stacks (folded, sample count)\n")
+			for stack, count in stacks:
+				f.write(f"{stack} {count}\n")
+
+		logger.info(f"Profile written to {path}")
+		return path
+
+profiler = Profiler()
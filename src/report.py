@@ -0,0 +1,117 @@
+import time
+
+import config
+
+from logger import logger
+from src.database import Transaction
+from typing import Dict, List, Optional, Tuple
+
+class NightlyReport:
+	"""
+	Running totals of the rooms rented since the last "close" event.
+
+	The totals live in queue_report and are mirrored in memory together with the thread names,
+	so the report renders without reading the table or resolving threads.
+	Closing the night moves the rows to queue_report_history instead of deleting them.
+	Every guild has its own night, closed by its own "close" event. Rows written before guilds were stored
+	(guild 0) belong to the guild config.guild resolves them to.
+	"""
+	def __init__(self):
+		# thread_id: [name, hours, guild_id]
+		self._rooms: Dict[int, List] = {}
+		# thread_id: name, kept across nights for extensions of rooms checked in before the close
+		self._names: Dict[int, str] = {}
+
+	def __len__(self):
+		return len(self._rooms)
+
+	async def load(self) -> None:
+		"""
+		Fill the in memory totals from queue_report
+		Returns:
+			None
+		"""
+		rows = await config.queue_db.fetchall("select thread_id, name, hours, guild_id from queue_report")
+		self._rooms = {thread_id: [name, hours, guild_id] for thread_id, name, hours, guild_id in rows}
+		self._names.update({thread_id: name for thread_id, name, _, _ in rows if name is not None})
+		logger.info(f"Nightly report loaded {len(self)} room(s)")
+
+	async def add(self, tx: Transaction, thread_id: int, hours: float, name: str=None, guild_id: int=0) -> None:
+		"""
+		Add rented hours of a room to tonight's report
+		Args:
+			tx (Transaction): transaction of the check in or extension
+			thread_id (int): the room thread id
+			hours (float): the rented hours
+			name (str): the room name, the last known name is kept when not given
+			guild_id (int): the guild of the room
+
+		Returns:
+			None
+		"""
+		if name is not None:
+			self._names[thread_id] = name
+		name = self._names.get(thread_id)
+
+		await tx.execute("""
+			insert into queue_report(thread_id, name, hours, guild_id)
+			values (?, ?, ?, ?)
+			on conflict(thread_id) do update set
+				hours = hours + excluded.hours,
+				name = coalesce(excluded.name, name),
+				guild_id = excluded.guild_id
+		""", (thread_id, name, hours, guild_id))
+
+		room = self._rooms.setdefault(thread_id, [None, 0, guild_id])
+		room[0] = name
+		room[1] += hours
+		room[2] = guild_id
+
+	@staticmethod
+	def _in_guild(room_guild_id: int, guild_id: Optional[int]) -> bool:
+		if guild_id is None or room_guild_id == guild_id:
+			return True
+		guild = config.guild(guild_id)
+		return guild is not None and config.guild(room_guild_id) is guild
+
+	def rows(self, guild_id: int=None) -> List[Tuple[int, Optional[str], float]]:
+		"""
+		Tonight's totals
+		Args:
+			guild_id (int): only rooms of this guild, every room when not given
+
+		Returns:
+			List[Tuple] - (thread_id, name, hours) rows
+		"""
+		return [
+			(thread_id, name, hours) for thread_id, (name, hours, room_guild_id) in self._rooms.items()
+			if self._in_guild(room_guild_id, guild_id)
+		]
+
+	async def close_night(self, guild_id: int=None) -> List[Tuple[int, Optional[str], float]]:
+		"""
+		Archive tonight's totals to queue_report_history and start a new report
+		Args:
+			guild_id (int): close the night of this guild, of every guild when not given
+
+		Returns:
+			List[Tuple] - the archived (thread_id, name, hours) rows
+		"""
+		report_time = int(time.time())
+		async with config.queue_db.transaction() as tx:
+			stored = [row_guild_id for row_guild_id, in await tx.fetchall("select distinct guild_id from queue_report")]
+			guild_ids = [row_guild_id for row_guild_id in stored if self._in_guild(row_guild_id, guild_id)]
+			placeholders = ", ".join("?" * len(guild_ids))
+			await tx.execute(f"""
+				insert into queue_report_history(report_time, thread_id, name, hours, guild_id)
+				select ?, thread_id, name, hours, guild_id from queue_report where guild_id in ({placeholders})
+			""", (report_time, *guild_ids))
+			await tx.execute(f"delete from queue_report where guild_id in ({placeholders})", guild_ids)
+
+			# check ins wait for this transaction, so the totals in memory match the archived rows
+			rows = self.rows(guild_id)
+			for thread_id, _, _ in rows:
+				del self._rooms[thread_id]
+		return rows
+
+nightly_report = NightlyReport()
@@ -0,0 +1,402 @@
+import asyncio
+import heapq
+import time
+
+import config
+
+from logger import logger
+from datetime import datetime
+from src.metrics import EXPIRY_RUN, TRIGGERS
+from src.profiling import profiler
+from src.triggers import TriggerRule, CATCH_UP_SKIP
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+ROOM = "room"
+AUCTION = "auction"
+
+# upper bound on a single sleep, so a wall clock jump cannot leave a deadline unnoticed for long
+MAX_SLEEP_SECONDS = 60
+# a row still past due after its handler ran is retried, the wait doubles after every failed attempt
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 300
+
+# keys of the rows of a guild that are past due, by kind
+_PAST_DUE = {
+	ROOM: "select message_id from queue where end_time <= ? and guild_id = ?",
+	AUCTION: "select thread_id from auction where end_time <= ? and guild_id = ?",
+}
+
+class DeadlineScheduler:
+	"""
+	Keeps the end times of every pending room and auction in a heap and sleeps until the earliest one.
+
+	Entries are keyed by (kind, key), where key is the queue message id for rooms and the thread id for auctions.
+	Rescheduling or cancelling an entry does not touch the heap, stale heap items are skipped when popped.
+	Due work is partitioned by (kind, guild), every partition runs as its own task so a slow guild does not hold up the others,
+	and a partition never runs twice at once. A row the handler could not expire is scheduled again with a backoff.
+	"""
+	def __init__(self):
+		self._heap: List[Tuple[int, str, int]] = []
+		self._deadlines: Dict[Tuple[str, int], int] = {}
+		# (kind, key): guild id of the entry
+		self._guilds: Dict[Tuple[str, int], int] = {}
+		# (kind, key): failed expiry attempts of the entry
+		self._retries: Dict[Tuple[str, int], int] = {}
+		self._handlers: Dict[str, Callable[..., Awaitable]] = {}
+		# (kind, guild id): task running the handler of the partition
+		self._running: Dict[Tuple[str, int], asyncio.Task] = {}
+		# (kind, guild id): keys that came due while the partition was running
+		self._pending: Dict[Tuple[str, int], List[int]] = {}
+		self._wakeup = asyncio.Event()
+
+	def __len__(self):
+		return len(self._deadlines)
+
+	def register(self, kind: str, handler: Callable[..., Awaitable]) -> None:
+		"""
+		Set the coroutine function to run when a deadline of this kind is due
+		Args:
+			kind (str): ROOM or AUCTION
+			handler (Callable): coroutine function that takes the bot object and a guild id
+
+		Returns:
+			None
+		"""
+		self._handlers[kind] = handler
+
+	def schedule(self, kind: str, key: int, end_time: int, guild_id: int=None) -> None:
+		"""
+		Add or move a deadline
+		Args:
+			kind (str): ROOM or AUCTION
+			key (int): message id for rooms, thread id for auctions
+			end_time (int): posix time of the deadline
+			guild_id (int): guild of the room or auction, a moved deadline keeps its guild when not given
+
+		Returns:
+			None
+		"""
+		end_time = int(end_time)
+		self._deadlines[(kind, key)] = end_time
+		if guild_id is not None or (kind, key) not in self._guilds:
+			self._guilds[(kind, key)] = guild_id or 0
+		heapq.heappush(self._heap, (end_time, kind, key))
+
+		# only wake the runner when the earliest deadline moved forward
+		if self._heap[0] == (end_time, kind, key):
+			self._wakeup.set()
+
+	def cancel(self, kind: str, key: int) -> None:
+		"""
+		Forget a deadline, nothing happens if it is not scheduled
+		Args:
+			kind (str): ROOM or AUCTION
+			key (int): message id for rooms, thread id for auctions
+
+		Returns:
+			None
+		"""
+		self._deadlines.pop((kind, key), None)
+		self._guilds.pop((kind, key), None)
+		self._retries.pop((kind, key), None)
+
+	async def load(self) -> None:
+		"""
+		Fill the scheduler with every pending room and auction in the database
+		Returns:
+			None
+		"""
+		for message_id, end_time, guild_id in await config.queue_db.fetchall("select message_id, end_time, guild_id from queue"):
+			self.schedule(ROOM, message_id, end_time, guild_id)
+
+		for thread_id, end_time, guild_id in await config.queue_db.fetchall("select thread_id, end_time, guild_id from auction"):
+			self.schedule(AUCTION, thread_id, end_time, guild_id)
+
+		logger.info(f"Deadline scheduler loaded {len(self)} pending deadline(s)")
+
+	def _next_deadline(self):
+		# drop heap items that were cancelled or rescheduled since they were pushed
+		while self._heap:
+			end_time, kind, key = self._heap[0]
+			if self._deadlines.get((kind, key)) == end_time:
+				return end_time
+			heapq.heappop(self._heap)
+		return None
+
+	def _pop_due(self, now: float) -> Dict[Tuple[str, int], List[int]]:
+		"""
+		Remove every due entry, grouped by (kind, guild id) in deadline order
+		"""
+		due: Dict[Tuple[str, int], List[int]] = {}
+		while (end_time := self._next_deadline()) is not None and end_time <= now:
+			_, kind, key = heapq.heappop(self._heap)
+			del self._deadlines[(kind, key)]
+			due.setdefault((kind, self._guilds.pop((kind, key), 0)), []).append(key)
+		return due
+
+	async def _rearm(self, kind: str, guild_id: int, keys: List[int], started: float) -> None:
+		"""
+		Schedule a retry of every row of the partition that is still past due after the handler ran
+		"""
+		past_due = {key for key, in await config.queue_db.fetchall(_PAST_DUE[kind], (int(started), guild_id))}
+		for key in keys:
+			if key not in past_due:
+				self._retries.pop((kind, key), None)
+
+		for key in past_due:
+			if (kind, key) in self._deadlines:
+				# moved (i.e. extended) while the handler ran
+				continue
+			attempts = self._retries.get((kind, key), 0)
+			self._retries[(kind, key)] = attempts + 1
+			delay = min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_SECONDS)
+			logger.warning(f"[{kind}] {key} of guild [{guild_id}] is still past due, retrying in {delay} s")
+			self.schedule(kind, key, time.time() + delay, guild_id)
+
+	async def _run_handler(self, bot, kind: str, guild_id: int, keys: List[int]) -> None:
+		started = time.time()
+		try:
+			with EXPIRY_RUN.labels(kind=kind).time():
+				await self._handlers[kind](bot, guild_id)
+		except Exception as e:
+			logger.error(f"Deadline scheduler caught an exception while running [{kind}] of guild [{guild_id}]: {type(e)} {e}", exc_info=True)
+
+		try:
+			await self._rearm(kind, guild_id, keys, started)
+		except Exception as e:
+			logger.error(f"Deadline scheduler could not retry [{kind}] of guild [{guild_id}]: {type(e)} {e}", exc_info=True)
+
+	async def _run_partition(self, bot, kind: str, guild_id: int, keys: List[int]) -> None:
+		partition = (kind, guild_id)
+		try:
+			while keys:
+				await self._run_handler(bot, kind, guild_id, keys)
+				# the handler may have read the rows before these came due
+				keys = self._pending.pop(partition, [])
+		finally:
+			self._pending.pop(partition, None)
+			del self._running[partition]
+
+	def _start(self, bot, kind: str, guild_id: int, keys: List[int]) -> None:
+		"""
+		Run the handler of a partition in a task, keys of a partition that is already running wait for it to finish
+		"""
+		partition = (kind, guild_id)
+		if partition in self._running:
+			self._pending.setdefault(partition, []).extend(keys)
+			return
+		self._running[partition] = asyncio.create_task(self._run_partition(bot, kind, guild_id, keys))
+
+	async def run(self, bot) -> None:
+		"""
+		Sleep until the next deadline and run the handler of every kind and guild that is due
+		Args:
+			bot (Bot): the discord bot object, passed to the handlers
+
+		Returns:
+			None
+		"""
+		await bot.wait_until_ready()
+
+		while not bot.is_closed():
+			self._wakeup.clear()
+			end_time = self._next_deadline()
+			delay = MAX_SLEEP_SECONDS if end_time is None else min(end_time - time.time(), MAX_SLEEP_SECONDS)
+
+			if delay > 0:
+				try:
+					await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+				except asyncio.TimeoutError:
+					pass
+				continue
+
+			for (kind, guild_id), keys in self._pop_due(time.time()).items():
+				self._start(bot, kind, guild_id, keys)
+
+class TriggerEngine:
+	"""
+	Fires the configured events of every guild (GuildConfig.events_trigger) at their scheduled times, sleeping until the next one is due.
+
+	The occurrence each event last fired for is kept in the trigger_state table, so a restart neither repeats an event
+	nor forgets one that came due while the bot was down. An occurrence found late is fired or skipped by its catch_up policy.
+	"""
+	def __init__(self):
+		# (guild id, event name): posix time of the occurrence it last fired (or skipped) for
+		self._last_fired: Dict[Tuple[int, str], int] = {}
+		self._handler: Optional[Callable[..., Awaitable]] = None
+		# guild id: task firing the events of the guild
+		self._running: Dict[int, asyncio.Task] = {}
+		self._wakeup = asyncio.Event()
+
+	def register(self, handler: Callable[..., Awaitable]) -> None:
+		"""
+		Set the coroutine function firing an event
+		Args:
+			handler (Callable): coroutine function that takes the bot object, the event name and the guild id
+
+		Returns:
+			None
+		"""
+		self._handler = handler
+
+	async def load(self) -> None:
+		"""
+		Read when every event last fired, events new to the database start counting from now
+		Returns:
+			None
+		"""
+		rows = await config.queue_db.fetchall("select guild_id, name, last_fired from trigger_state")
+		self._last_fired = {(guild_id, name): last_fired for guild_id, name, last_fired in rows}
+		now = int(time.time())
+		for guild_id, rule in self._rules():
+			if (guild_id, rule.name) not in self._last_fired:
+				await self._save(guild_id, rule.name, now)
+		logger.info(f"Trigger engine loaded {len(self._rules())} event(s) of {len(config.GUILDS)} guild(s)")
+
+	def _rules(self) -> List[Tuple[int, TriggerRule]]:
+		return [(guild_id, rule) for guild_id, guild in config.GUILDS.items() for rule in guild.events_trigger.values()]
+
+	async def _save(self, guild_id: int, name: str, occurrence: int) -> None:
+		async with config.queue_db.transaction() as tx:
+			await tx.execute("""
+				insert into trigger_state(guild_id, name, last_fired) values (?, ?, ?)
+				on conflict(guild_id, name) do update set last_fired = excluded.last_fired
+			""", (guild_id, name, occurrence))
+		self._last_fired[(guild_id, name)] = occurrence
+
+	def _due(self, guild_id: int, rule: TriggerRule, now: datetime) -> Optional[datetime]:
+		occurrence = rule.previous_fire(now)
+		if occurrence is None or occurrence.timestamp() <= self._last_fired.get((guild_id, rule.name), 0):
+			return None
+		return occurrence
+
+	def next_fire(self, now: datetime) -> Optional[datetime]:
+		"""
+		The earliest occurrence of any event of any guild after now
+		"""
+		fires = [fire for _, rule in self._rules() if (fire := rule.next_fire(now)) is not None]
+		return min(fires, default=None)
+
+	async def mark_fired(self, name: str, guild_id: int) -> None:
+		"""
+		Record the latest occurrence of a guild's event as fired, so it does not fire again until the next one
+		"""
+		guild = config.guild(guild_id)
+		if guild is None or name not in guild.events_trigger:
+			return
+		occurrence = guild.events_trigger[name].previous_fire(datetime.now().astimezone())
+		if occurrence is not None:
+			await self._save(guild.guild_id, name, int(occurrence.timestamp()))
+
+	async def _fire(self, bot, guild_id: int, rule: TriggerRule, now: datetime) -> None:
+		occurrence = self._due(guild_id, rule, now)
+		if occurrence is None:
+			return
+
+		late = (now - occurrence).total_seconds()
+		if late > rule.grace and rule.catch_up == CATCH_UP_SKIP:
+			logger.warning(f"Skipping event [{rule.name}] of guild [{guild_id}] of {occurrence}, it is {late:.0f} s late")
+			TRIGGERS.labels(event=rule.name, outcome="skipped").inc()
+		else:
+			if late > rule.grace:
+				logger.info(f"Catching up on event [{rule.name}] of guild [{guild_id}] of {occurrence}, {late:.0f} s late")
+			try:
+				await self._handler(bot, rule.name, guild_id)
+				TRIGGERS.labels(event=rule.name, outcome="fired").inc()
+			except Exception as e:
+				# recorded as fired all the same, retrying would repeat whatever part was already sent
+				TRIGGERS.labels(event=rule.name, outcome="failed").inc()
+				logger.error(f"Trigger engine caught an exception while firing [{rule.name}] of guild [{guild_id}]: {type(e)} {e}", exc_info=True)
+
+		await self._save(guild_id, rule.name, int(occurrence.timestamp()))
+
+	@profiler.profiled("triggers")
+	async def tick(self, bot, now: datetime) -> None:
+		"""
+		Fire or skip every event with an occurrence at or before now that it has not fired for.
+		The events of one guild fire in config order in a task of their own, a guild whose task is still running is skipped
+		and picked up again by the tick that follows it.
+		Args:
+			bot (Bot): the discord bot object, passed to the handler
+			now (datetime): the current time, aware
+
+		Returns:
+			None
+		"""
+		async def fire_guild(guild_id: int, rules: Iterable[TriggerRule]) -> None:
+			try:
+				for rule in rules:
+					await self._fire(bot, guild_id, rule, now)
+			except Exception as e:
+				logger.error(f"Trigger engine caught an exception while firing the events of guild [{guild_id}]: {type(e)} {e}", exc_info=True)
+			finally:
+				del self._running[guild_id]
+				# look again for events that came due while this guild was busy
+				self._wakeup.set()
+
+		for guild_id, guild in config.GUILDS.items():
+			if guild_id in self._running:
+				continue
+			rules = [rule for rule in guild.events_trigger.values() if self._due(guild_id, rule, now) is not None]
+			if rules:
+				self._running[guild_id] = asyncio.create_task(fire_guild(guild_id, rules))
+
+	async def run(self, bot) -> None:
+		"""
+		Fire due events and sleep until the next one
+		Args:
+			bot (Bot): the discord bot object, passed to the handler
+
+		Returns:
+			None
+		"""
+		await bot.wait_until_ready()
+
+		while not bot.is_closed():
+			self._wakeup.clear()
+			now = datetime.now().astimezone()
+			await self.tick(bot, now)
+
+			fire = self.next_fire(now)
+			delay = MAX_SLEEP_SECONDS if fire is None else min(fire.timestamp() - time.time(), MAX_SLEEP_SECONDS)
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0))
+			except asyncio.TimeoutError:
+				pass
+
+async def run_expired(items: Iterable[Any], handler: Callable[[Any], Awaitable], key: Callable[[Any], Hashable], limit: int=None) -> None:
+	"""
+	Run handler(item) for every expired item, at most `limit` groups at a time.
+	Items with the same key (i.e. the same thread) run one after another in their original order,
+	an exception of one item is logged and does not stop the others.
+	Args:
+		items (Iterable): the expired rows
+		handler (Callable): coroutine function handling a single row
+		key (Callable): returns the group of a row
+		limit (int): maximum groups handled concurrently, defaults to config.EXPIRY_CONCURRENCY
+
+	Returns:
+		None
+	"""
+	groups: Dict[Hashable, List[Any]] = {}
+	for item in items:
+		groups.setdefault(key(item), []).append(item)
+
+	semaphore = asyncio.Semaphore(config.EXPIRY_CONCURRENCY if limit is None else limit)
+
+	async def run_group(group_key: Hashable, group: List[Any]) -> None:
+		async with semaphore:
+			for item in group:
+				started = time.perf_counter()
+				try:
+					await handler(item)
+				except Exception as e:
+					logger.error(f"Expiry of [{group_key}] caught an exception: {type(e)} {e}", extra={"thread_id": group_key}, exc_info=True)
+				else:
+					duration_ms = (time.perf_counter() - started) * 1000
+					logger.info(f"Expiry of [{group_key}] took {duration_ms:.1f} ms", extra={"thread_id": group_key, "duration_ms": round(duration_ms, 1)})
+
+	await asyncio.gather(*[run_group(group_key, group) for group_key, group in groups.items()])
+
+scheduler = DeadlineScheduler()
+trigger_engine = TriggerEngine()
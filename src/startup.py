@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import time
+
+import config
+
+from contextlib import contextmanager
+from discord import app_commands, Client, HTTPException
+from logger import logger
+from typing import List, Optional, Tuple
+
+# bot_state key of the hash of the last command tree synced to Discord
+COMMAND_TREE_HASH = "command_tree_hash"
+
+def command_tree_hash(tree: app_commands.CommandTree, application_id: Optional[int]) -> str:
+	"""
+	Hash of the global commands as they are sent to Discord on sync
+	Args:
+		tree (CommandTree): the bot's command tree
+		application_id (int): the application the commands are synced to, a different bot always syncs
+
+	Returns:
+		str - hex digest, equal for equal trees
+	"""
+	payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command: (command["type"], command["name"]))
+	serialized = json.dumps([application_id, payload], sort_keys=True, default=str)
+	return hashlib.sha256(serialized.encode()).hexdigest()
+
+async def get_state(key: str) -> Optional[str]:
+	return await config.queue_db.fetchval("select value from bot_state where key = ?", (key,))
+
+async def set_state(key: str, value: str) -> None:
+	async with config.queue_db.transaction() as tx:
+		await tx.execute("""
+			insert into bot_state(key, value) values (?, ?)
+			on conflict(key) do update set value = excluded.value
+		""", (key, value))
+
+async def check_forum_tags(bot: Client) -> None:
+	"""
+	Check that every configured thread tag exists in its guild's forum, a tag of another forum fails every tag update.
+	Runs before the gateway connects, the forums are fetched at once and not kept in the entity cache,
+	the gateway has them once the bot is ready.
+	Args:
+		bot (Client): the discord bot object
+
+	Returns:
+		None
+
+	Raises:
+		ValueError: a forum cannot be fetched or a tag id is not a tag of its forum
+	"""
+	forum_ids = list({forum_id for guild in config.GUILDS.values() for forum_id in (guild.forum_channel_id, guild.auction_channel_id)})
+	fetched = await asyncio.gather(*[bot.fetch_channel(forum_id) for forum_id in forum_ids], return_exceptions=True)
+	forums = dict(zip(forum_ids, fetched))
+
+	unknown = []
+	for guild in config.GUILDS.values():
+		for forum_id, section, tags in (
+			(guild.forum_channel_id, "room", guild.room_status_tags),
+			(guild.forum_channel_id, "room_type", guild.room_type_tags),
+			(guild.auction_channel_id, "auction", guild.auction_status_tags),
+		):
+			forum = forums[forum_id]
+			if isinstance(forum, HTTPException):
+				unknown.append(f"forum {forum_id} of thread_status_tags.{section} of guild {guild.guild_id} cannot be fetched: {forum.status} {forum.text}")
+				continue
+			if isinstance(forum, BaseException):
+				raise forum
+			unknown += [
+				f"thread_status_tags.{section}.{name} ({tag_id}) of guild {guild.guild_id} is not a tag of forum {forum_id}"
+				for name, tag_id in tags.items() if forum.get_tag(int(tag_id)) is None
+			]
+
+	if unknown:
+		raise ValueError("Unknown forums or thread tags in config.yml:\n" + "\n".join(unknown))
+
+class StartupTimer:
+	"""
+	Times the phases of the startup and logs them in one line
+	"""
+	def __init__(self):
+		self._started = time.perf_counter()
+		self._phases: List[Tuple[str, float]] = []
+
+	@contextmanager
+	def phase(self, name: str):
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self._phases.append((name, time.perf_counter() - started))
+
+	def log(self) -> None:
+		total_ms = (time.perf_counter() - self._started) * 1000
+		phases = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self._phases)
+		logger.info(f"Startup took {total_ms:.1f} ms ({phases})", extra={"duration_ms": round(total_ms, 1)})
@@ -0,0 +1,47 @@
+import asyncio
+
+from typing import Coroutine, Iterable, List, Optional
+
+class BackgroundTasks:
+	"""
+	The background loops of one component, started together on first use and stopped together on close.
+
+	Loops run `while not tasks.closing` and are cancelled as well: wait_for can swallow a cancellation
+	that races with the wakeup, the flag ends the loop either way.
+	"""
+	def __init__(self):
+		self._tasks: List[asyncio.Task] = []
+		self.closing = False
+		# set to wake the loops early, e.g. when new work arrives or on close
+		self.wakeup: Optional[asyncio.Event] = None
+
+	@property
+	def running(self) -> bool:
+		return bool(self._tasks)
+
+	def start(self, coroutines: Iterable[Coroutine]) -> None:
+		"""
+		Run the loops as tasks of the running event loop
+		Args:
+			coroutines (Iterable[Coroutine]): the loops, they start running after the wakeup event exists
+
+		Returns:
+			None
+		"""
+		self.closing = False
+		self.wakeup = asyncio.Event()
+		self._tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+
+	async def stop(self) -> None:
+		"""
+		Stop the loops and wait until every one of them ended
+		Returns:
+			None
+		"""
+		self.closing = True
+		if self.wakeup is not None:
+			self.wakeup.set()
+		for task in self._tasks:
+			task.cancel()
+		await asyncio.gather(*self._tasks, return_exceptions=True)
+		self._tasks = []
@@ -0,0 +1,229 @@
+import asyncio
+import time
+
+import config
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from logger import logger
+from src.tasks import BackgroundTasks
+from typing import ClassVar, Dict, List, Optional, Tuple, Union
+
+def _now() -> int:
+	return int(time.time())
+
+@dataclass(frozen=True)
+class RoomRented:
+	thread_id: int
+	hours: float
+	time: int = field(default_factory=_now)
+	guild_id: int = 0
+	kind: ClassVar[str] = "check_in"
+
+@dataclass(frozen=True)
+class RoomExtended:
+	thread_id: int
+	hours: float
+	time: int = field(default_factory=_now)
+	guild_id: int = 0
+	kind: ClassVar[str] = "extension"
+
+@dataclass(frozen=True)
+class RoomCheckedOut:
+	thread_id: int
+	# hours the room was actually occupied, 0 when the check in time is unknown
+	hours: float = 0
+	time: int = field(default_factory=_now)
+	guild_id: int = 0
+	kind: ClassVar[str] = "check_out"
+
+@dataclass(frozen=True)
+class RoomReserved:
+	thread_id: int
+	hours: float
+	time: int = field(default_factory=_now)
+	guild_id: int = 0
+	kind: ClassVar[str] = "reservation"
+
+TelemetryEvent = Union[RoomRented, RoomExtended, RoomCheckedOut, RoomReserved]
+
+# rollup column counting each event kind, rollup hours count rented time and occupied_hours the time until check out
+_ROLLUP_COUNTERS = ("check_in", "extension", "check_out", "reservation")
+_ROLLUP_TABLES = ("rental_hourly", "rental_daily")
+
+def _hour_bucket(timestamp: int) -> int:
+	return timestamp - timestamp % 3600
+
+def _day_bucket(timestamp: int) -> int:
+	return int(datetime.fromtimestamp(timestamp).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+class TelemetryWriter:
+	"""
+	Buffers telemetry events in memory and writes them to the telemetry database in the background.
+
+	Every event is appended to rental_event, and room_stats plus the hourly and daily rollups are
+	folded per bucket and upserted in the same transaction, every `interval` seconds or as soon
+	as `batch_size` events are waiting, so recording an event never waits on the database.
+	"""
+	def __init__(self, interval: float=None, batch_size: int=None):
+		self._interval = interval
+		self._batch_size = batch_size
+		self._buffer: List[TelemetryEvent] = []
+		self._tasks = BackgroundTasks()
+
+	@property
+	def interval(self) -> float:
+		return config.TELEMETRY_FLUSH_INTERVAL if self._interval is None else self._interval
+
+	@property
+	def batch_size(self) -> int:
+		return config.TELEMETRY_BATCH_SIZE if self._batch_size is None else self._batch_size
+
+	def __len__(self):
+		return len(self._buffer)
+
+	def record(self, event: TelemetryEvent) -> None:
+		"""
+		Queue an event for the background writer
+		Args:
+			event (TelemetryEvent): the event
+
+		Returns:
+			None
+		"""
+		if not self._tasks.running:
+			self._tasks.start([self._run()])
+
+		self._buffer.append(event)
+		if len(self._buffer) >= self.batch_size:
+			self._tasks.wakeup.set()
+
+	async def flush(self) -> None:
+		"""
+		Write every buffered event now, the events are kept for the next flush if the write fails
+		Returns:
+			None
+		"""
+		if not self._buffer:
+			return
+
+		events, self._buffer = self._buffer, []
+
+		# thread_id: [rent_count, extension_count, rent_total_time, guild_id]
+		room_stats: Dict[int, List] = {}
+		# (bucket, thread_id): [check_ins, extensions, check_outs, reservations, hours, occupied_hours, guild_id]
+		rollups: Dict[str, Dict[Tuple[int, int], List]] = {table: {} for table in _ROLLUP_TABLES}
+		for event in events:
+			rented = isinstance(event, (RoomRented, RoomExtended))
+			if rented:
+				stats = room_stats.setdefault(event.thread_id, [0, 0, 0.0, event.guild_id])
+				stats[0 if isinstance(event, RoomRented) else 1] += 1
+				stats[2] += event.hours
+
+			for table, bucket in zip(_ROLLUP_TABLES, (_hour_bucket(event.time), _day_bucket(event.time))):
+				rollup = rollups[table].setdefault((bucket, event.thread_id), [0, 0, 0, 0, 0.0, 0.0, event.guild_id])
+				rollup[_ROLLUP_COUNTERS.index(event.kind)] += 1
+				if rented:
+					rollup[4] += event.hours
+				elif isinstance(event, RoomCheckedOut):
+					rollup[5] += event.hours
+
+		try:
+			async with config.telemetry_db.transaction() as tx:
+				await tx.executemany(
+					"insert into rental_event(thread_id, kind, time, hours, guild_id) values (?, ?, ?, ?, ?)",
+					[(event.thread_id, event.kind, event.time, event.hours, event.guild_id) for event in events]
+				)
+
+				if room_stats:
+					await tx.executemany("""
+						insert into room_stats(thread_id, rent_count, extension_count, rent_total_time, guild_id)
+						values (?, ?, ?, ?, ?)
+						on conflict(thread_id) do update set
+							rent_count = rent_count + excluded.rent_count,
+							extension_count = extension_count + excluded.extension_count,
+							rent_total_time = rent_total_time + excluded.rent_total_time
+					""", [(thread_id, *stats) for thread_id, stats in room_stats.items()])
+
+				for table, rollup in rollups.items():
+					await tx.executemany(f"""
+						insert into {table}(bucket, thread_id, check_ins, extensions, check_outs, reservations, hours, occupied_hours, guild_id)
+						values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+						on conflict(bucket, thread_id) do update set
+							check_ins = check_ins + excluded.check_ins,
+							extensions = extensions + excluded.extensions,
+							check_outs = check_outs + excluded.check_outs,
+							reservations = reservations + excluded.reservations,
+							hours = hours + excluded.hours,
+							occupied_hours = occupied_hours + excluded.occupied_hours
+					""", [(*key, *counters) for key, counters in rollup.items()])
+		except BaseException:
+			# also on cancellation, so close() can still write them
+			self._buffer[:0] = events
+			raise
+
+	async def _run(self) -> None:
+		wakeup = self._tasks.wakeup
+		while not self._tasks.closing:
+			try:
+				await asyncio.wait_for(wakeup.wait(), timeout=self.interval)
+			except asyncio.TimeoutError:
+				pass
+			wakeup.clear()
+
+			try:
+				await self.flush()
+			except Exception as e:
+				logger.error(f"Telemetry writer caught an exception: {type(e)} {e}", exc_info=True)
+
+	async def close(self) -> None:
+		"""
+		Stop the background writer and write what is left in the buffer
+		Returns:
+			None
+		"""
+		await self._tasks.stop()
+
+		try:
+			await self.flush()
+		except Exception as e:
+			logger.error(f"Telemetry writer could not write {len(self._buffer)} event(s) on shutdown: {type(e)} {e}")
+
+async def _get_rollup(table: str, since: int, until: int, thread_id: Optional[int], guild_id: Optional[int]) -> List[Tuple]:
+	return await config.telemetry_db.read.fetchall(f"""
+		select bucket, sum(check_ins), sum(extensions), sum(check_outs), sum(reservations), sum(hours), sum(occupied_hours)
+		from {table}
+		where bucket >= ? and bucket < ? and (? is null or thread_id = ?) and (? is null or guild_id = ?)
+		group by bucket
+		order by bucket
+	""", (since, until, thread_id, thread_id, guild_id, guild_id))
+
+async def get_hourly_usage(since: int, until: int=None, thread_id: int=None, guild_id: int=None) -> List[Tuple]:
+	"""
+	Rental activity per hour, read from the hourly rollup
+	Args:
+		since (int): posix time of the first hour
+		until (int): posix time the range ends (exclusive), defaults to now
+		thread_id (int): only count this room, every room when not given
+		guild_id (int): only count rooms of this guild, every guild when not given
+
+	Returns:
+		List[Tuple] - (hour, check_ins, extensions, check_outs, reservations, hours, occupied_hours) rows, oldest first
+	"""
+	return await _get_rollup("rental_hourly", since, _now() if until is None else until, thread_id, guild_id)
+
+async def get_daily_usage(since: int, until: int=None, thread_id: int=None, guild_id: int=None) -> List[Tuple]:
+	"""
+	Rental activity per local day, read from the daily rollup
+	Args:
+		since (int): posix time of the first day
+		until (int): posix time the range ends (exclusive), defaults to now
+		thread_id (int): only count this room, every room when not given
+		guild_id (int): only count rooms of this guild, every guild when not given
+
+	Returns:
+		List[Tuple] - (day, check_ins, extensions, check_outs, reservations, hours, occupied_hours) rows, oldest first
+	"""
+	return await _get_rollup("rental_daily", since, _now() if until is None else until, thread_id, guild_id)
+
+telemetry = TelemetryWriter()
@@ -0,0 +1,133 @@
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+EVERY_DAY = 0b1111111
+WEEKEND = 0b1100000
+# events that used to be hardcoded to the weekend, kept as their default when the config sets no days
+WEEKEND_EVENTS = ["open", "close", "last_call"]
+
+# catch up policies for an event whose time passed while the bot was down or busy
+# skip: fire only if it is at most `grace` seconds late
+# once: fire the latest missed occurrence once, however late
+CATCH_UP_SKIP = "skip"
+CATCH_UP_ONCE = "once"
+
+@dataclass(frozen=True)
+class TriggerRule:
+	"""
+	An event posted at the same local time on some days of the week
+	"""
+	name: str
+	time: time
+	message: str
+	remindee: List[int] = field(default_factory=list)
+	# bit 0 is Monday, bit 6 is Sunday
+	days: int = EVERY_DAY
+	# None is the system's time zone
+	timezone: Optional[ZoneInfo] = None
+	catch_up: str = CATCH_UP_SKIP
+	grace: int = 300
+
+	def _at(self, day: date) -> datetime:
+		if self.timezone is None:
+			# a naive time is taken as local time, daylight saving included
+			return datetime.combine(day, self.time).astimezone()
+		return datetime.combine(day, self.time, tzinfo=self.timezone)
+
+	def _today(self, moment: datetime) -> date:
+		return (moment.astimezone(self.timezone) if self.timezone else moment.astimezone()).date()
+
+	def next_fire(self, after: datetime) -> Optional[datetime]:
+		"""
+		First occurrence strictly after `after` (aware), None if the rule has no days
+		"""
+		today = self._today(after)
+		for offset in range(8):
+			day = today + timedelta(days=offset)
+			if self.days >> day.weekday() & 1:
+				fire = self._at(day)
+				if fire > after:
+					return fire
+		return None
+
+	def previous_fire(self, before: datetime) -> Optional[datetime]:
+		"""
+		Last occurrence at or before `before` (aware), None if the rule has no days
+		"""
+		today = self._today(before)
+		for offset in range(8):
+			day = today - timedelta(days=offset)
+			if self.days >> day.weekday() & 1:
+				fire = self._at(day)
+				if fire <= before:
+					return fire
+		return None
+
+def _day_index(day) -> int:
+	day = str(day).strip().lower()[:3]
+	if day not in DAY_NAMES:
+		raise ValueError(f"unknown day {day!r}, use {', '.join(DAY_NAMES)}")
+	return DAY_NAMES.index(day)
+
+def parse_days(value) -> int:
+	"""
+	Parse the days of an event into a mask
+	Args:
+		value: "daily", "weekdays", "weekend", a range such as "mon-fri", or a list of day names (e.g. [sat, sun])
+
+	Returns:
+		int - the day mask, bit 0 is Monday
+
+	Raises:
+		ValueError: a day is not a day name
+	"""
+	if isinstance(value, str):
+		value = value.strip().lower()
+		if value in ("daily", "every day", "*"):
+			return EVERY_DAY
+		if value == "weekdays":
+			return EVERY_DAY & ~WEEKEND
+		if value == "weekend":
+			return WEEKEND
+		if "-" in value:
+			first, last = (_day_index(day) for day in value.split("-", 1))
+			days = range(first, last + 1) if first <= last else [*range(first, 7), *range(0, last + 1)]
+			return sum(1 << day for day in days)
+		value = value.split(",")
+
+	mask = 0
+	for day in value:
+		mask |= 1 << _day_index(day)
+	return mask
+
+def parse_triggers(data: Dict) -> Dict[str, TriggerRule]:
+	"""
+	Parse the triggers section of the config
+	Args:
+		data (Dict): event name: {time, message, remindee, days, timezone, catch_up, grace}
+
+	Returns:
+		Dict[str, TriggerRule] - the rules by event name
+	"""
+	rules = {}
+	for name, event in (data or {}).items():
+		try:
+			days = parse_days(event.get("days", "weekend" if name in WEEKEND_EVENTS else "daily"))
+		except ValueError as e:
+			raise ValueError(f"days of trigger {name}: {e}") from None
+		catch_up = event.get("catch_up", CATCH_UP_SKIP)
+		assert catch_up in (CATCH_UP_SKIP, CATCH_UP_ONCE), f"catch_up of trigger {name} must be {CATCH_UP_SKIP} or {CATCH_UP_ONCE}"
+		rules[name] = TriggerRule(
+			name=name,
+			time=datetime.strptime(event["time"], "%I:%M %p").time(),
+			message=event["message"],
+			remindee=list(event.get("remindee") or []),
+			days=days,
+			timezone=ZoneInfo(event["timezone"]) if event.get("timezone") else None,
+			catch_up=catch_up,
+			grace=int(event.get("grace", 300)),
+		)
+	return rules
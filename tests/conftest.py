@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# the bot imports its modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+from src.database import Database
+from src.migrations import migrate, QUEUE_MIGRATIONS, TELEMETRY_MIGRATIONS
+
+@pytest.fixture
+def databases(tmp_path):
+	"""
+	Fresh, migrated queue and telemetry databases set on config
+	"""
+	config.queue_db = Database(str(tmp_path / "queue.db"), read_connections=0)
+	config.telemetry_db = Database(str(tmp_path / "telemetry.db"), read_connections=0)
+	config.queue_db.run_blocking(migrate, QUEUE_MIGRATIONS)
+	config.telemetry_db.run_blocking(migrate, TELEMETRY_MIGRATIONS)
+	yield config.queue_db, config.telemetry_db
+	config.queue_db.close()
+	config.telemetry_db.close()
+	config.queue_db = config.telemetry_db = None
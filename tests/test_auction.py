@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import pytest
+
+import config
+
+from benchmarks.fakes import FakeBot
+from benchmarks.harness import BENCHMARK_CONFIG, AUCTION_CHANNEL_ID, AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID, AUCTION_STATUS_TAGS
+from src import auction
+from src.auction import place_bid, BidStatus
+from src.cache import entity_cache
+from src.guilds import parse_guilds
+from src.messages import edit_coalescer
+from src.outbound import outbound
+
+@pytest.fixture(autouse=True)
+def bid_locks(monkeypatch):
+	# the locks belong to the event loop of one test
+	monkeypatch.setattr(auction, "_bid_locks", {})
+
+async def _start_auction(thread_id: int, end_time: int, bid_current: int=1_000, bid_count: int=0, last_bid_user_id: int=-1, message_ids=(1, 2, 3)):
+	async with config.queue_db.transaction() as tx:
+		await tx.execute(
+			"insert into auction(thread_id, end_time, bid_increment, bid_current, bid_count, last_bid_user_id) values (?, ?, ?, ?, ?, ?)",
+			(thread_id, end_time, 100, bid_current, bid_count, last_bid_user_id)
+		)
+		await tx.execute("insert into auction_info values (?, ?, ?, ?)", (thread_id, *message_ids))
+
+def test_concurrent_bids_are_applied_in_order(databases):
+	async def main():
+		await _start_auction(1, int(time.time()) + 3600)
+		results = await asyncio.gather(*[place_bid(1, user_id) for user_id in range(10, 15)])
+
+		assert [result.status for result in results] == [BidStatus.ACCEPTED] * 5
+		# the first bid takes the starting price, every later one adds the increment
+		assert [result.bid_current for result in results] == [1_000, 1_100, 1_200, 1_300, 1_400]
+		assert [result.bid_count for result in results] == [1, 2, 3, 4, 5]
+		assert await config.queue_db.fetchall("select seq, user_id, current_bid from auction_bid where thread_id = 1 order by seq") == [
+			(1, 10, 1_000), (2, 11, 1_100), (3, 12, 1_200), (4, 13, 1_300), (5, 14, 1_400)
+		]
+
+	asyncio.run(main())
+
+def test_double_bid_and_too_high(databases):
+	async def main():
+		await _start_auction(1, int(time.time()) + 3600)
+		first, second = await asyncio.gather(place_bid(1, 10), place_bid(1, 10))
+		assert (first.status, second.status) == (BidStatus.ACCEPTED, BidStatus.DOUBLE_BID)
+
+		too_high, allowed = await asyncio.gather(place_bid(1, 11, 3_001), place_bid(1, 11, 3_000))
+		assert (too_high.status, allowed.status) == (BidStatus.TOO_HIGH, BidStatus.ACCEPTED)
+		assert allowed.bid_current == 3_000
+
+	asyncio.run(main())
+
+def test_ended_and_missing_auctions(databases):
+	async def main():
+		await _start_auction(1, int(time.time()) - 1)
+		assert (await place_bid(1, 10)).status == BidStatus.ENDED
+		assert (await place_bid(2, 10)).status == BidStatus.NO_AUCTION
+		assert await config.queue_db.fetchval("select bid_count from auction where thread_id = 1") == 0
+
+	asyncio.run(main())
+
+def test_auction_changed_by_another_writer_is_a_conflict(databases, monkeypatch):
+	async def main():
+		await _start_auction(1, int(time.time()) + 3600)
+		fetchone = config.queue_db.fetchone
+
+		async def fetch_then_bid_elsewhere(*args, **kwargs):
+			row = await fetchone(*args, **kwargs)
+			await config.queue_db.execute("update auction set bid_current = 2000, bid_count = 1, last_bid_user_id = 99 where thread_id = 1")
+			return row
+		monkeypatch.setattr(config.queue_db, "fetchone", fetch_then_bid_elsewhere)
+
+		result = await place_bid(1, 10)
+		assert result.status == BidStatus.CONFLICT
+		assert await config.queue_db.fetchone("select bid_current, last_bid_user_id from auction where thread_id = 1") == (2_000, 99)
+		assert await config.queue_db.fetchval("select count(*) from auction_bid") == 0
+
+	asyncio.run(main())
+
+def test_expiry_waits_for_a_bid_in_flight(databases, monkeypatch):
+	monkeypatch.setattr(config, "GUILDS", parse_guilds(BENCHMARK_CONFIG))
+	monkeypatch.setattr(config, "OUTBOUND_ROUTE_RATE", 1_000_000)
+	monkeypatch.setattr(config, "OUTBOUND_ROUTE_BURST", 1_000_000)
+
+	async def main():
+		bot = FakeBot()
+		bot.add_channel(AUCTION_CHANNEL_ID, "auctions", AUCTION_STATUS_TAGS.values())
+		announcements = bot.add_channel(AUCTION_PUBLIC_NOTIFIER_CHANNEL_ID, "auction announcements")
+		entity_cache.bind(bot)
+		thread = bot.add_channel(4000, "Auction")
+		info = thread.add_message(bot.user, "Auction info")
+		price = thread.add_message(bot.user, "Current bid")
+		announcement = announcements.add_message(bot.user, "An auction has started")
+		await _start_auction(thread.id, int(time.time()) - 1, 1_000, 1, 5000, (info.id, price.id, announcement.id))
+
+		# a bid passed the end time check and holds the lock while it is written
+		lock = auction._bid_locks.setdefault(thread.id, asyncio.Lock())
+		await lock.acquire()
+		expiry = asyncio.create_task(auction._expire_auction(bot, (thread.id,)))
+		await asyncio.sleep(0.05)
+		assert not expiry.done()
+		await config.queue_db.execute("update auction set bid_current = 1100, bid_count = 2, last_bid_user_id = 5001 where thread_id = ?", (thread.id,))
+		lock.release()
+		edit_coalescer.schedule(announcements, announcement.id, content="## An auction has been extended!")
+		await expiry
+
+		# the winner and the final price include the bid
+		assert 5001 in bot.users and 5000 not in bot.users
+		assert any("final bid was `1,100`" in message.content for message in thread.messages.values())
+		assert announcement.content.startswith("## An auction has ended!")
+		assert auction._bid_locks == {}
+
+		# bids and edits that come after the close change nothing
+		assert (await place_bid(thread.id, 5002)).status == BidStatus.NO_AUCTION
+		edit_coalescer.schedule(announcements, announcement.id, content="## An auction has been extended!")
+		await edit_coalescer.flush(announcement.id)
+		assert announcement.content.startswith("## An auction has ended!")
+
+		await outbound.close()
+
+	asyncio.run(main())
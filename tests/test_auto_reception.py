@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+import config
+
+from benchmarks.fakes import FakeBot
+from benchmarks.harness import BENCHMARK_CONFIG, FORUM_CHANNEL_ID, NOTIFICATION_CHANNEL_ID, ROOM_STATUS_TAGS, ROOM_TYPE_TAGS
+from src import auto_reception
+from src.cache import entity_cache
+from src.guilds import parse_guilds, GUILD_OWN_KEYS
+from src.outbound import outbound
+from src.telemetry import telemetry
+
+def test_room_expiry_leaves_rooms_sharing_the_end_time(databases, monkeypatch):
+	# two venues, the second one has its own forum
+	own_keys = {key: BENCHMARK_CONFIG[key] for key in GUILD_OWN_KEYS}
+	monkeypatch.setattr(config, "GUILDS", parse_guilds({
+		**BENCHMARK_CONFIG,
+		"guilds": {1: own_keys, 2: {**own_keys, "channel_id": {**BENCHMARK_CONFIG["channel_id"], "room": FORUM_CHANNEL_ID + 100}}},
+	}))
+
+	async def main():
+		bot = FakeBot()
+		bot.add_channel(FORUM_CHANNEL_ID, "rooms", [*ROOM_STATUS_TAGS.values(), *ROOM_TYPE_TAGS.values()])
+		bot.add_channel(FORUM_CHANNEL_ID + 100, "rooms", [*ROOM_STATUS_TAGS.values(), *ROOM_TYPE_TAGS.values()])
+		bot.add_channel(NOTIFICATION_CHANNEL_ID, "notifications")
+		entity_cache.bind(bot)
+
+		end_time = int(time.time()) - 1
+		for thread_id, guild_id in ((200, 1), (201, 1), (300, 2)):
+			thread = bot.add_channel(thread_id, f"Room {thread_id}")
+			thread._applied_tags = [ROOM_TYPE_TAGS["vanilla"], ROOM_STATUS_TAGS["occupied"]]
+			message = thread.add_message(bot.user, "Check out time")
+			await auto_reception.check_in(auto_reception.CheckInData(thread.id, message, 3000, 3600, end_time, guild_id=guild_id))
+
+		# a single room of the first guild expires, its neighbour and the other guild's room share the end time
+		row = await config.queue_db.fetchone(
+			"select thread_id, message_id, user_id, end_time, cc_user, is_reservation, guild_id from queue where thread_id = 200"
+		)
+		await auto_reception._expire_room(bot, row)
+		assert sorted(await config.queue_db.fetchall("select thread_id from queue")) == [(201,), (300,)]
+
+		# the guild's expiry run leaves the other guild alone
+		await auto_reception.room_task(bot, 1)
+		assert await config.queue_db.fetchall("select thread_id from queue") == [(300,)]
+
+		await telemetry.close()
+		await outbound.close()
+
+	asyncio.run(main())
@@ -0,0 +1,29 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from src.database import Database, ReadPool
+
+def test_read_pool_sees_committed_writes_and_refuses_to_write(tmp_path):
+	database = Database(str(tmp_path / "queue.db"), read_connections=2)
+	database.run_blocking(lambda connection: connection.execute("create table queue(user_id integer)"))
+
+	async def main():
+		assert isinstance(database.read, ReadPool)
+		assert await database.read.fetchall("select user_id from queue") == []
+
+		async with database.transaction() as tx:
+			await tx.execute("insert into queue values (?)", (1,))
+			await tx.execute("insert into queue values (?)", (2,))
+		assert await database.read.fetchall("select user_id from queue order by user_id") == [(1,), (2,)]
+		assert await database.read.fetchval("select count(*) from queue") == 2
+
+		with pytest.raises(sqlite3.OperationalError):
+			await database.read.fetchall("insert into queue values (3)")
+		assert await database.fetchval("select count(*) from queue") == 2
+
+	try:
+		asyncio.run(main())
+	finally:
+		database.close()
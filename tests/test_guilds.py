@@ -0,0 +1,80 @@
+import asyncio
+
+import discord
+import pytest
+
+import config
+
+from types import SimpleNamespace
+from benchmarks.fakes import FakeBot
+from benchmarks.harness import BENCHMARK_CONFIG, FORUM_CHANNEL_ID, AUCTION_CHANNEL_ID, ROOM_STATUS_TAGS, ROOM_TYPE_TAGS, AUCTION_STATUS_TAGS
+from src.cache import entity_cache
+from src.guilds import parse_guilds, ANY_GUILD, GUILD_OWN_KEYS
+from src.startup import check_forum_tags
+
+OWN_KEYS = {key: BENCHMARK_CONFIG[key] for key in GUILD_OWN_KEYS}
+
+def test_top_level_keys_configure_a_single_guild():
+	assert list(parse_guilds(BENCHMARK_CONFIG)) == [ANY_GUILD]
+	assert list(parse_guilds({**BENCHMARK_CONFIG, "guild_id": 5})) == [5]
+
+def test_guilds_inherit_the_top_level_defaults_they_do_not_set():
+	guilds = parse_guilds({
+		**BENCHMARK_CONFIG,
+		"triggers": {"open": {"time": "6:00 PM", "message": "open"}},
+		"guilds": {
+			1: OWN_KEYS,
+			2: {**OWN_KEYS, "room_time_selection_count": 4, "triggers": {}},
+		},
+	})
+
+	assert list(guilds) == [1, 2]
+	assert list(guilds[1].events_trigger) == ["open"]
+	assert guilds[1].room_select_frequency_count == 10
+	assert guilds[2].events_trigger == {}
+	assert guilds[2].room_select_frequency_count == 4
+	assert len(guilds[2].room_time_choices) == 4
+
+@pytest.mark.parametrize("key", GUILD_OWN_KEYS)
+def test_guilds_set_their_own_channels_roles_and_tags(key):
+	guild_data = {k: v for k, v in OWN_KEYS.items() if k != key}
+	with pytest.raises(AssertionError, match=f"Guild 2 does not set {key}"):
+		parse_guilds({**BENCHMARK_CONFIG, "guilds": {1: OWN_KEYS, 2: guild_data}})
+
+def test_check_forum_tags_rejects_tags_of_another_forum(databases, monkeypatch):
+	monkeypatch.setattr(config, "GUILDS", parse_guilds(BENCHMARK_CONFIG))
+
+	async def main():
+		bot = FakeBot()
+		forum = bot.add_channel(FORUM_CHANNEL_ID, "rooms", [*ROOM_STATUS_TAGS.values(), *ROOM_TYPE_TAGS.values()])
+		bot.add_channel(AUCTION_CHANNEL_ID, "auctions", AUCTION_STATUS_TAGS.values())
+		entity_cache.bind(bot)
+		await check_forum_tags(bot)
+		# one fetch per forum, none kept in the entity cache
+		assert bot.http.calls["bot.fetch_channel"] == 2
+		assert entity_cache._channels.get(FORUM_CHANNEL_ID) is None
+
+		del forum._tags[ROOM_TYPE_TAGS["spice"]]
+		with pytest.raises(ValueError, match=r"thread_status_tags.room_type.spice \(105\) of guild 0 is not a tag of forum 10"):
+			await check_forum_tags(bot)
+
+	asyncio.run(main())
+
+def test_check_forum_tags_rejects_forums_it_cannot_fetch(databases, monkeypatch):
+	monkeypatch.setattr(config, "GUILDS", parse_guilds(BENCHMARK_CONFIG))
+
+	async def main():
+		bot = FakeBot()
+		bot.add_channel(FORUM_CHANNEL_ID, "rooms", [*ROOM_STATUS_TAGS.values(), *ROOM_TYPE_TAGS.values()])
+		fetch_channel = bot.fetch_channel
+
+		async def fetch_or_not_found(channel_id):
+			if channel_id == AUCTION_CHANNEL_ID:
+				raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Channel")
+			return await fetch_channel(channel_id)
+		monkeypatch.setattr(bot, "fetch_channel", fetch_or_not_found)
+
+		with pytest.raises(ValueError, match=r"forum 11 of thread_status_tags.auction of guild 0 cannot be fetched: 404 Unknown Channel"):
+			await check_forum_tags(bot)
+
+	asyncio.run(main())
@@ -0,0 +1,78 @@
+import asyncio
+
+from datetime import datetime
+from types import SimpleNamespace
+from src.cache import entity_cache
+from src.honeypot import Honeypot
+from src.outbound import outbound
+
+def test_failed_ban_is_retried_on_the_next_message(tmp_path, monkeypatch):
+	async def owner(user_id):
+		return SimpleNamespace(id=user_id, name="owner", display_name="Owner", send=send)
+	monkeypatch.setattr(entity_cache, "user", owner)
+
+	async def send(*args, **kwargs):
+		pass
+
+	async def main():
+		bans = []
+
+		async def ban(**kwargs):
+			bans.append(kwargs)
+			if len(bans) == 1:
+				raise RuntimeError("gateway timeout")
+
+		honeypot = Honeypot(str(tmp_path))
+		guild = SimpleNamespace(id=1, owner_id=2, name="guild")
+		author = SimpleNamespace(id=3, name="spammer", display_name="Spammer", send=send, ban=ban)
+		message = lambda: SimpleNamespace(author=author, guild=guild, content="spam", created_at=datetime.now())
+
+		assert honeypot.catch(message())
+		assert not honeypot.catch(message())
+		await asyncio.sleep(0.05)
+
+		# the first ban failed, so the author is not deduplicated any more
+		assert honeypot.catch(message())
+		await asyncio.sleep(0.05)
+		assert len(bans) == 2
+		assert not honeypot.catch(message())
+
+		await honeypot.close()
+		await outbound.close()
+
+	asyncio.run(main())
+
+def test_author_is_banned_in_every_guild_they_raid(tmp_path, monkeypatch):
+	async def owner(user_id):
+		return SimpleNamespace(id=user_id, name="owner", display_name="Owner", send=send)
+	monkeypatch.setattr(entity_cache, "user", owner)
+
+	async def send(*args, **kwargs):
+		pass
+
+	async def main():
+		bans = []
+
+		async def ban(**kwargs):
+			bans.append(kwargs)
+
+		honeypot = Honeypot(str(tmp_path))
+		author = SimpleNamespace(id=3, name="spammer", display_name="Spammer", send=send, ban=ban)
+		guilds = [SimpleNamespace(id=guild_id, owner_id=2, name=f"guild {guild_id}") for guild_id in (1, 4)]
+		message = lambda guild: SimpleNamespace(author=author, guild=guild, content="spam", created_at=datetime.now())
+
+		# the same account posts in both honeypots, one ban does not cover the other guild
+		assert honeypot.catch(message(guilds[0]))
+		assert honeypot.catch(message(guilds[1]))
+		assert not honeypot.catch(message(guilds[1]))
+		await asyncio.sleep(0.05)
+		assert len(bans) == 2
+
+		await honeypot.flush_evidence()
+		evidence = (tmp_path / "3.txt").read_text()
+		assert "in guild 1 (1)" in evidence and evidence.count("in guild 4 (4)") == 2
+
+		await honeypot.close()
+		await outbound.close()
+
+	asyncio.run(main())
@@ -0,0 +1,63 @@
+import asyncio
+
+import config
+
+from benchmarks.fakes import FakeBot
+from src.messages import EditCoalescer, MessageCache
+from src.outbound import outbound
+
+def _channel():
+	bot = FakeBot()
+	channel = bot.add_channel(4000, "Auction")
+	return bot, channel, channel.add_message(bot.user, "Current bid: 0")
+
+def test_edits_within_one_interval_are_coalesced(monkeypatch):
+	monkeypatch.setattr(config, "OUTBOUND_ROUTE_RATE", 1_000_000)
+	monkeypatch.setattr(config, "OUTBOUND_ROUTE_BURST", 1_000_000)
+
+	async def main():
+		bot, channel, message = _channel()
+		coalescer = EditCoalescer(MessageCache(), interval=0.2)
+
+		for bid in range(1, 11):
+			coalescer.schedule(channel, message.id, content=f"Current bid: {bid}")
+		await asyncio.sleep(0.1)
+
+		# only the latest content was sent and nothing is left to send
+		assert bot.http.calls["message.edit"] == 1
+		assert message.content == "Current bid: 10"
+		assert len(coalescer) == 0
+
+		await asyncio.sleep(0.2)
+		assert bot.http.calls["message.edit"] == 1
+		await outbound.close()
+
+	asyncio.run(main())
+
+def test_flush_sends_the_pending_edit_at_once(monkeypatch):
+	monkeypatch.setattr(config, "OUTBOUND_ROUTE_RATE", 1_000_000)
+	monkeypatch.setattr(config, "OUTBOUND_ROUTE_BURST", 1_000_000)
+
+	async def main():
+		bot, channel, message = _channel()
+		coalescer = EditCoalescer(MessageCache(), interval=60)
+
+		coalescer.schedule(channel, message.id, content="Current bid: 1")
+		await asyncio.sleep(0.05)
+		# the next edit would wait out the interval
+		coalescer.schedule(channel, message.id, content="Current bid: 2")
+		await asyncio.sleep(0.05)
+		assert message.content == "Current bid: 1"
+
+		await asyncio.wait_for(coalescer.flush(message.id), 1)
+		assert bot.http.calls["message.edit"] == 2
+		assert message.content == "Current bid: 2"
+
+		# edits of a closed message are dropped
+		await coalescer.close(message.id)
+		coalescer.schedule(channel, message.id, content="Current bid: 3")
+		assert len(coalescer) == 0
+		assert message.content == "Current bid: 2"
+		await outbound.close()
+
+	asyncio.run(main())
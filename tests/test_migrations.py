@@ -0,0 +1,67 @@
+import sqlite3
+
+from src.migrations import migrate, QUEUE_MIGRATIONS, TELEMETRY_MIGRATIONS
+
+def _legacy_queue_db() -> sqlite3.Connection:
+	"""
+	A queue database as the bot created it before migrations, untyped with per-thread bid tables
+	"""
+	connection = sqlite3.connect(":memory:")
+	connection.execute("CREATE TABLE queue(thread_id, message_id, user_id, end_time, cc_user, is_reservation)")
+	connection.execute("CREATE TABLE queue_report(thread_id, hours)")
+	connection.execute("CREATE TABLE auction_info(thread_id primary key, auction_info_msg_id, message_id, notification_id)")
+	connection.execute("CREATE TABLE auction(thread_id primary key, end_time, bid_increment, bid_current, bid_count, last_bid_user_id)")
+	connection.execute("CREATE TABLE auction_history_42(user_id, bid, current_bid, set_bid)")
+
+	connection.execute("insert into queue values (1, 2, 3, 1700000000, null, 0)")
+	connection.executemany("insert into queue_report values (?, ?)", [(1, 1.5), (1, 0.5), (7, 2)])
+	connection.execute("insert into auction values (42, 1700000000, 100, 1200, 2, 9)")
+	connection.execute("insert into auction_info values (42, 10, 11, 12)")
+	connection.executemany("insert into auction_history_42 values (?, ?, ?, ?)", [(8, 100, 1100, 0), (9, 100, 1200, 0)])
+	connection.commit()
+	return connection
+
+def _columns(connection: sqlite3.Connection, table: str):
+	return [row[1] for row in connection.execute(f"pragma table_info({table})")]
+
+def test_queue_migrations_keep_legacy_rows():
+	connection = _legacy_queue_db()
+	migrate(connection, QUEUE_MIGRATIONS)
+
+	assert connection.execute("select max(version) from schema_version").fetchone()[0] == QUEUE_MIGRATIONS[-1][0]
+	assert connection.execute("select * from queue").fetchall() == [(1, 2, 3, 1700000000, None, 0, None, 0)]
+	# duplicate report rows are summed into one row per thread
+	assert connection.execute("select thread_id, hours from queue_report order by thread_id").fetchall() == [(1, 2.0), (7, 2.0)]
+	assert connection.execute("select * from auction").fetchall() == [(42, 1700000000, 100, 1200, 2, 9, 0)]
+	assert connection.execute("select thread_id, seq, user_id, current_bid from auction_bid order by seq").fetchall() == [
+		(42, 1, 8, 1100), (42, 2, 9, 1200)
+	]
+	assert connection.execute("select count(*) from sqlite_master where name = 'auction_history_42'").fetchone()[0] == 0
+	assert _columns(connection, "trigger_state") == ["guild_id", "name", "last_fired"]
+
+def test_migrate_is_idempotent():
+	connection = _legacy_queue_db()
+	migrate(connection, QUEUE_MIGRATIONS)
+	migrate(connection, QUEUE_MIGRATIONS)
+
+	assert connection.execute("select count(*) from schema_version").fetchone()[0] == len(QUEUE_MIGRATIONS)
+	assert connection.execute("select count(*) from queue").fetchone()[0] == 1
+
+def test_trigger_state_moves_to_guild_zero():
+	connection = sqlite3.connect(":memory:")
+	migrate(connection, [migration for migration in QUEUE_MIGRATIONS if migration[0] <= 6])
+	connection.execute("insert into trigger_state values ('close', 1700000000)")
+	connection.commit()
+	migrate(connection, QUEUE_MIGRATIONS)
+
+	assert connection.execute("select * from trigger_state").fetchall() == [(0, "close", 1700000000)]
+
+def test_telemetry_migrations_keep_legacy_rows():
+	connection = sqlite3.connect(":memory:")
+	connection.execute("create table room_stats(thread_id, rent_count, extension_count, rent_total_time)")
+	connection.executemany("insert into room_stats values (?, ?, ?, ?)", [(1, 1, 0, 2.0), (1, 2, 1, 3.0)])
+	connection.commit()
+	migrate(connection, TELEMETRY_MIGRATIONS)
+
+	assert connection.execute("select * from room_stats").fetchall() == [(1, 3, 1, 5.0, 0)]
+	assert "guild_id" in _columns(connection, "rental_event")
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from src.misc import format_duration, number_suffix, ChoiceTable, MAX_CHOICES
+
+def _names(choices):
+	return [choice.name for choice in choices]
+
+def test_choice_table_matches_prefixes_with_or_without_spaces():
+	table = ChoiceTable((format_duration(timedelta(minutes=30 * i)), i) for i in range(1, 11))
+
+	assert _names(table.match("1h")) == ["1h 0m", "1h 30m"]
+	assert _names(table.match("1h3")) == ["1h 30m"]
+	assert _names(table.match(" 1H 3 ")) == ["1h 30m"]
+	assert table.match("1h 30m")[0].value == 3
+	assert table.match("7h") == []
+
+def test_choice_table_without_input_lists_up_to_the_discord_limit():
+	table = ChoiceTable((str(i), i) for i in range(40))
+
+	assert len(table) == 40
+	assert len(table.match("")) == MAX_CHOICES
+	assert len(table.match("1")) == 11
+
+def test_format_duration_and_number_suffix():
+	assert format_duration(timedelta(hours=26)) == "26h 0m"
+	assert format_duration(timedelta(minutes=90)) == "1h 30m"
+	assert [number_suffix(day) for day in (1, 2, 3, 4, 11, 12, 13, 21, 22, 23)] == [
+		"1st", "2nd", "3rd", "4th", "11th", "12th", "13th", "21st", "22nd", "23rd"
+	]
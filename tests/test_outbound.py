@@ -0,0 +1,81 @@
+import asyncio
+
+from src import outbound
+from src.outbound import OutboundQueue, Priority
+
+def test_reserved_worker_sends_notifications_during_long_cleanup():
+	async def main():
+		queue = OutboundQueue(workers=1, route_rate=1000, route_burst=1000, reserved_workers=1)
+		release = asyncio.Event()
+
+		async def long_cleanup():
+			await release.wait()
+			return "cleaned"
+
+		async def notify():
+			return "notified"
+
+		cleanups = [queue.submit(Priority.CLEANUP, 1, long_cleanup) for _ in range(2)]
+		# the general worker is busy with the first cleanup, the reserved one must not take the second
+		assert await asyncio.wait_for(queue.run(Priority.NOTIFICATION, 2, notify), timeout=1) == "notified"
+		assert len(queue) == 1
+
+		release.set()
+		assert await asyncio.gather(*cleanups) == ["cleaned", "cleaned"]
+		await queue.close()
+
+	asyncio.run(main())
+
+def test_actions_are_sent_by_priority():
+	async def main():
+		queue = OutboundQueue(workers=1, route_rate=1000, route_burst=1000, reserved_workers=0)
+		sent = []
+
+		async def send(name):
+			sent.append(name)
+
+		futures = [queue.submit(priority, 1, send, priority.name) for priority in (Priority.REPORT, Priority.CLEANUP, Priority.INTERACTION)]
+		await asyncio.gather(*futures)
+		assert sent == ["INTERACTION", "CLEANUP", "REPORT"]
+		await queue.close()
+
+	asyncio.run(main())
+
+def test_interactions_do_not_wait_for_the_route_budget():
+	async def main():
+		queue = OutboundQueue(workers=1, route_rate=0.1, route_burst=1, reserved_workers=0)
+
+		async def send(name):
+			return name
+
+		# the cleanup spends the only request of the route, the next one would wait 10 seconds
+		assert await queue.run(Priority.CLEANUP, 1, send, "cleanup") == "cleanup"
+		assert await asyncio.wait_for(queue.run(Priority.INTERACTION, 1, send, "interaction"), timeout=1) == "interaction"
+
+		# the interaction still counts against the route
+		cleanup = queue.submit(Priority.CLEANUP, 1, send, "cleanup")
+		await asyncio.sleep(0.05)
+		assert not cleanup.done()
+		await queue.close()
+
+	asyncio.run(main())
+
+def test_budgets_of_idle_routes_are_pruned(monkeypatch):
+	monkeypatch.setattr(outbound, "PRUNE_INTERVAL", 0)
+
+	async def main():
+		queue = OutboundQueue(workers=1, route_rate=1000, route_burst=1, reserved_workers=0)
+
+		async def send():
+			pass
+
+		await asyncio.gather(*[queue.run(Priority.NORMAL, route, send) for route in range(10)])
+		assert len(queue._budgets) == 10
+		await asyncio.sleep(0.05)
+		# the worker goes idle after the next request, by then the other buckets are full again
+		await queue.run(Priority.NORMAL, 10, send)
+		await asyncio.sleep(0.01)
+		assert set(queue._budgets) <= {10}
+		await queue.close()
+
+	asyncio.run(main())
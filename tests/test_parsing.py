@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+import pytest
+
+from benchmarks.parsing import fuzz
+from src.parsing import parse_amount, parse_duration, ParseError, MAX_DURATION
+
+@pytest.mark.parametrize("value, expected", [
+	("1m", 1_000_000), ("1.5m", 1_500_000), ("300k", 300_000), ("1m250k", 1_250_000), ("1m 250k", 1_250_000),
+	("500000", 500_000), ("500,000", 500_000), ("1,000,000", 1_000_000), (" 2M ", 2_000_000),
+	("1.1m", 1_100_000), (".5m", 500_000), ("12.k", 12_000), ("1,000.5k", 1_000_500), ("2.0", 2),
+])
+def test_parse_amount(value, expected):
+	assert parse_amount(value) == expected
+
+@pytest.mark.parametrize("value, reason", [
+	("", "expected an amount"), ("m", "expected an amount"), ("k", "expected an amount"), ("1x", "expected an amount"),
+	("1k1m", "expected an amount"), ("1..5m", "expected an amount"), ("-5", "expected an amount"), ("1e9", "expected an amount"),
+	("0", "must be positive"), ("0k", "must be positive"), ("9" * 40, "too long"), ("9" * 20, "too large"),
+	# commas only separate thousands, a space only comes before a k part
+	("1,5m", "expected an amount"), ("1,2,3", "expected an amount"), ("1,0000", "expected an amount"), ("1m 5", "expected an amount"),
+	("2.5", "whole number"), ("1.0005k", "whole number"),
+])
+def test_parse_amount_rejects(value, reason):
+	with pytest.raises(ParseError) as error:
+		parse_amount(value)
+	assert reason in error.value.reason
+
+@pytest.mark.parametrize("value, expected", [
+	("1d", timedelta(days=1)), ("2h", timedelta(hours=2)), ("2hr", timedelta(hours=2)), ("30m", timedelta(minutes=30)),
+	("45s", timedelta(seconds=45)), ("1d3h", timedelta(days=1, hours=3)), ("1d2h3m4s", timedelta(days=1, hours=2, minutes=3, seconds=4)),
+	(" 1D 3H ", timedelta(days=1, hours=3)), ("90m", timedelta(minutes=90)), ("365d", MAX_DURATION),
+])
+def test_parse_duration(value, expected):
+	assert parse_duration(value) == expected
+
+@pytest.mark.parametrize("value, reason", [
+	("", "expected a duration"), ("d", "expected a duration"), ("3h1d", "expected a duration"), ("1.5h", "expected a duration"),
+	("-1h", "expected a duration"), ("1,0d", "expected a duration"), ("0h", "must be positive"), ("0d0h0m0s", "must be positive"),
+	("366d", "too long"), ("100000000000h", "too long"), ("9" * 40, "too long"),
+])
+def test_parse_duration_rejects(value, reason):
+	with pytest.raises(ParseError) as error:
+		parse_duration(value)
+	assert reason in error.value.reason
+
+def test_fuzz():
+	checked, failures = fuzz(2000, 0)
+	assert checked > 2000
+	assert failures == []
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+import config
+
+from src.report import NightlyReport
+
+def test_close_night_takes_legacy_rows_of_the_first_guild(databases, monkeypatch):
+	monkeypatch.setattr(config, "GUILDS", {10: SimpleNamespace(guild_id=10), 20: SimpleNamespace(guild_id=20)})
+
+	async def main():
+		# written before guilds were stored
+		await config.queue_db.execute("insert into queue_report(thread_id, name, hours, guild_id) values (1, 'legacy', 2, 0)")
+		report = NightlyReport()
+		await report.load()
+		async with config.queue_db.transaction() as tx:
+			await report.add(tx, 2, 1, "first", 10)
+			await report.add(tx, 3, 3, "second", 20)
+
+		assert sorted(report.rows(10)) == [(1, "legacy", 2), (2, "first", 1)]
+		assert sorted(await report.close_night(10)) == [(1, "legacy", 2), (2, "first", 1)]
+		assert report.rows() == [(3, "second", 3)]
+		assert await config.queue_db.fetchall("select thread_id from queue_report") == [(3,)]
+		assert sorted(await config.queue_db.fetchall("select thread_id, guild_id from queue_report_history")) == [(1, 0), (2, 10)]
+
+	asyncio.run(main())
+
+def test_add_moves_a_legacy_row_to_its_guild(databases, monkeypatch):
+	monkeypatch.setattr(config, "GUILDS", {10: SimpleNamespace(guild_id=10)})
+
+	async def main():
+		report = NightlyReport()
+		async with config.queue_db.transaction() as tx:
+			await report.add(tx, 1, 2, "room", 0)
+			await report.add(tx, 1, 1, guild_id=10)
+
+		assert await config.queue_db.fetchall("select name, hours, guild_id from queue_report") == [("room", 3, 10)]
+		assert report._rooms == {1: ["room", 3, 10]}
+
+	asyncio.run(main())
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import config
+
+from src.scheduler import DeadlineScheduler, TriggerEngine, ROOM, AUCTION, RETRY_BASE_SECONDS
+from src.triggers import TriggerRule
+
+def test_pop_due_in_deadline_order():
+	scheduler = DeadlineScheduler()
+	scheduler.schedule(ROOM, 1, 300, 10)
+	scheduler.schedule(AUCTION, 2, 100, 10)
+	scheduler.schedule(ROOM, 3, 200, 10)
+	scheduler.schedule(ROOM, 4, 1000, 10)
+
+	assert scheduler._pop_due(500) == {(AUCTION, 10): [2], (ROOM, 10): [3, 1]}
+	assert len(scheduler) == 1
+	assert scheduler._next_deadline() == 1000
+
+def test_pop_due_partitions_by_guild():
+	scheduler = DeadlineScheduler()
+	scheduler.schedule(ROOM, 1, 100, 10)
+	scheduler.schedule(ROOM, 2, 100, 20)
+	scheduler.schedule(ROOM, 3, 100)
+
+	assert scheduler._pop_due(100) == {(ROOM, 10): [1], (ROOM, 20): [2], (ROOM, 0): [3]}
+
+def test_cancel_and_reschedule_skip_stale_heap_items():
+	scheduler = DeadlineScheduler()
+	scheduler.schedule(ROOM, 1, 100, 10)
+	scheduler.schedule(ROOM, 2, 150, 10)
+	scheduler.cancel(ROOM, 1)
+	# moved later, the item pushed first is stale and keeps its guild
+	scheduler.schedule(ROOM, 2, 400)
+
+	assert scheduler._next_deadline() == 400
+	assert scheduler._pop_due(300) == {}
+	assert scheduler._pop_due(400) == {(ROOM, 10): [2]}
+	assert len(scheduler) == 0
+
+def test_cancel_unknown_entry_is_ignored():
+	scheduler = DeadlineScheduler()
+	scheduler.cancel(AUCTION, 1)
+	assert len(scheduler) == 0
+
+def test_failed_expiry_is_retried_with_backoff(databases):
+	async def main():
+		scheduler = DeadlineScheduler()
+		end_time = int(time.time()) - 5
+		await config.queue_db.execute(
+			"insert into queue(thread_id, message_id, user_id, end_time, guild_id) values (1, 2, 3, ?, 10)", (end_time,)
+		)
+		scheduler.schedule(ROOM, 2, end_time, 10)
+		attempts = []
+
+		async def failing(bot, guild_id):
+			attempts.append(guild_id)
+			raise RuntimeError("discord is down")
+		scheduler.register(ROOM, failing)
+
+		delays = []
+		for _ in range(3):
+			keys = scheduler._pop_due(float("inf"))[(ROOM, 10)]
+			await scheduler._run_handler(None, ROOM, 10, keys)
+			delays.append(scheduler._deadlines[(ROOM, 2)] - time.time())
+		assert attempts == [10, 10, 10]
+		assert [round(delay / RETRY_BASE_SECONDS) for delay in delays] == [1, 2, 4]
+
+		# the expiry goes through, the row is gone and nothing is scheduled again
+		async def succeeding(bot, guild_id):
+			await config.queue_db.execute("delete from queue where guild_id = ?", (guild_id,))
+		scheduler.register(ROOM, succeeding)
+		await scheduler._run_handler(None, ROOM, 10, scheduler._pop_due(float("inf"))[(ROOM, 10)])
+		assert len(scheduler) == 0
+		assert scheduler._retries == {}
+
+	asyncio.run(main())
+
+def test_slow_partition_does_not_block_the_others_nor_run_twice(databases):
+	async def main():
+		scheduler = DeadlineScheduler()
+		release = asyncio.Event()
+		runs = []
+
+		async def handler(bot, guild_id):
+			runs.append(guild_id)
+			if guild_id == 10:
+				await release.wait()
+		scheduler.register(ROOM, handler)
+
+		scheduler.schedule(ROOM, 1, 100, 10)
+		scheduler.schedule(ROOM, 2, 100, 20)
+		for (kind, guild_id), keys in scheduler._pop_due(100).items():
+			scheduler._start(None, kind, guild_id, keys)
+		await asyncio.sleep(0.01)
+		# guild 20 is done while guild 10 is still running
+		assert runs == [10, 20]
+		assert list(scheduler._running) == [(ROOM, 10)]
+
+		# guild 10 comes due again while running, it waits for the run in flight
+		scheduler.schedule(ROOM, 3, 200, 10)
+		for (kind, guild_id), keys in scheduler._pop_due(200).items():
+			scheduler._start(None, kind, guild_id, keys)
+		await asyncio.sleep(0.01)
+		assert runs == [10, 20]
+
+		release.set()
+		await asyncio.sleep(0.01)
+		assert runs == [10, 20, 10]
+		assert scheduler._running == {}
+
+	asyncio.run(main())
+
+def test_trigger_engine_does_not_wait_for_a_busy_guild(databases, monkeypatch):
+	async def main():
+		now = datetime.now().astimezone()
+		rule = TriggerRule(name="open", time=(now - timedelta(minutes=1)).time().replace(second=0, microsecond=0), message="open")
+		monkeypatch.setattr(config, "GUILDS", {10: SimpleNamespace(events_trigger={"open": rule}), 20: SimpleNamespace(events_trigger={"open": rule})})
+		engine = TriggerEngine()
+		release = asyncio.Event()
+		fired = []
+
+		async def handler(bot, name, guild_id):
+			fired.append(guild_id)
+			if guild_id == 10:
+				await release.wait()
+		engine.register(handler)
+
+		await engine.tick(None, now)
+		await asyncio.sleep(0.01)
+		assert fired == [10, 20]
+		assert list(engine._running) == [10]
+
+		# the busy guild is not fired again, the other one has nothing due
+		await engine.tick(None, now)
+		await asyncio.sleep(0.01)
+		assert fired == [10, 20]
+		assert list(engine._running) == [10]
+
+		release.set()
+		await asyncio.sleep(0.01)
+		assert engine._running == {}
+		assert engine._due(10, rule, now) is None
+
+	asyncio.run(main())
@@ -0,0 +1,36 @@
+import asyncio
+
+import discord
+
+from discord import app_commands
+from src.startup import command_tree_hash, get_state, set_state, COMMAND_TREE_HASH
+
+def _tree(description: str="Show the queue") -> app_commands.CommandTree:
+	# a new client and tree each time, as after a restart
+	tree = app_commands.CommandTree(discord.Client(intents=discord.Intents.default()))
+
+	@tree.command(name="queue", description=description)
+	async def queue(interaction: discord.Interaction, page: int=1):
+		pass
+
+	@tree.command(name="ping", description="Check the bot is alive")
+	async def ping(interaction: discord.Interaction):
+		pass
+
+	return tree
+
+def test_command_tree_hash_is_stable_across_restarts(databases):
+	async def main():
+		await set_state(COMMAND_TREE_HASH, command_tree_hash(_tree(), 1))
+		assert await get_state(COMMAND_TREE_HASH) == command_tree_hash(_tree(), 1)
+
+	asyncio.run(main())
+
+def test_command_tree_hash_changes_with_the_commands():
+	tree_hash = command_tree_hash(_tree(), 1)
+	assert command_tree_hash(_tree("Show the waiting queue"), 1) != tree_hash
+	assert command_tree_hash(_tree(), 2) != tree_hash
+
+	tree = _tree()
+	tree.remove_command("ping")
+	assert command_tree_hash(tree, 1) != tree_hash
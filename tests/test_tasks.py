@@ -0,0 +1,29 @@
+import asyncio
+
+from src.tasks import BackgroundTasks
+
+def test_stop_ends_loops_and_start_runs_them_again():
+	async def main():
+		tasks = BackgroundTasks()
+		ticks = []
+
+		async def loop(name):
+			while not tasks.closing:
+				tasks.wakeup.clear()
+				await tasks.wakeup.wait()
+				ticks.append(name)
+
+		tasks.start([loop("a"), loop("b")])
+		assert tasks.running
+		await asyncio.sleep(0)
+		await tasks.stop()
+		assert not tasks.running
+
+		tasks.start([loop("c")])
+		await asyncio.sleep(0)
+		tasks.wakeup.set()
+		await asyncio.sleep(0)
+		await tasks.stop()
+		assert "c" in ticks
+
+	asyncio.run(main())
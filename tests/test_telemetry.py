@@ -0,0 +1,21 @@
+import asyncio
+
+from src.telemetry import get_daily_usage, get_hourly_usage, TelemetryWriter, RoomCheckedOut, RoomExtended, RoomRented
+
+def test_rollups_keep_rented_and_occupied_hours_apart(databases):
+	async def main():
+		writer = TelemetryWriter(interval=60, batch_size=100)
+		hour = 1_700_000_000 - 1_700_000_000 % 3600
+		writer.record(RoomRented(1, 2.0, hour + 60, guild_id=10))
+		writer.record(RoomExtended(1, 1.0, hour + 120, guild_id=10))
+		# checked out early, after an hour and a half of the three rented
+		writer.record(RoomCheckedOut(1, 1.5, hour + 180, guild_id=10))
+		writer.record(RoomRented(2, 4.0, hour + 240, guild_id=20))
+		await writer.close()
+
+		assert await get_hourly_usage(hour, hour + 3600, guild_id=10) == [(hour, 1, 1, 1, 0, 3.0, 1.5)]
+		assert await get_hourly_usage(hour, hour + 3600) == [(hour, 2, 1, 1, 0, 7.0, 1.5)]
+		assert await get_hourly_usage(hour, hour + 3600, thread_id=2) == [(hour, 1, 0, 0, 0, 4.0, 0.0)]
+		assert [row[1:] for row in await get_daily_usage(hour - 86400, hour + 3600, guild_id=20)] == [(1, 0, 0, 0, 4.0, 0.0)]
+
+	asyncio.run(main())
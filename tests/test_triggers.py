@@ -0,0 +1,58 @@
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from src.triggers import TriggerRule, parse_days, parse_triggers, EVERY_DAY, WEEKEND
+
+NEW_YORK = ZoneInfo("America/New_York")
+
+def _rule(days=EVERY_DAY):
+	return TriggerRule(name="open", time=time(18), message="open", days=days, timezone=NEW_YORK)
+
+def test_next_fire_keeps_local_time_across_daylight_saving():
+	rule = _rule()
+
+	# clocks go forward on 2026-03-08, the day is 23 hours long
+	before = datetime(2026, 3, 7, 18, tzinfo=NEW_YORK)
+	spring = rule.next_fire(before)
+	assert spring == datetime(2026, 3, 8, 18, tzinfo=NEW_YORK)
+	assert spring.astimezone(timezone.utc) - before.astimezone(timezone.utc) == timedelta(hours=23)
+	assert spring.astimezone(timezone.utc).hour == 22
+
+	# clocks go back on 2026-11-01, the day is 25 hours long
+	before = datetime(2026, 10, 31, 18, tzinfo=NEW_YORK)
+	fall = rule.next_fire(before)
+	assert fall.astimezone(timezone.utc) - before.astimezone(timezone.utc) == timedelta(hours=25)
+	assert fall.astimezone(timezone.utc).hour == 23
+
+	assert rule.previous_fire(fall) == fall
+	assert rule.previous_fire(fall - timedelta(seconds=1)) == before
+
+def test_fires_only_on_the_days_of_the_mask():
+	rule = _rule(WEEKEND)
+	# a Wednesday
+	wednesday = datetime(2026, 10, 14, 12, tzinfo=NEW_YORK)
+	assert wednesday.weekday() == 2
+
+	assert rule.next_fire(wednesday) == datetime(2026, 10, 17, 18, tzinfo=NEW_YORK)
+	assert rule.previous_fire(wednesday) == datetime(2026, 10, 11, 18, tzinfo=NEW_YORK)
+	# past the Saturday occurrence the next one is on Sunday
+	assert rule.next_fire(datetime(2026, 10, 17, 18, tzinfo=NEW_YORK)) == datetime(2026, 10, 18, 18, tzinfo=NEW_YORK)
+
+	assert _rule(0).next_fire(wednesday) is None
+	assert _rule(0).previous_fire(wednesday) is None
+
+def test_parse_days():
+	assert parse_days("daily") == EVERY_DAY
+	assert parse_days("weekdays") == 0b0011111
+	assert parse_days("Weekend") == WEEKEND
+	assert parse_days("mon-wed") == 0b0000111
+	assert parse_days("fri-mon") == 0b1110001
+	assert parse_days("sat, sunday") == WEEKEND
+	assert parse_days(["Mon", "fri"]) == 0b0010001
+
+@pytest.mark.parametrize("days", ["fri-xyz", "mon,funday", ["sat", "xx"]])
+def test_parse_triggers_names_the_event_and_the_bad_day(days):
+	with pytest.raises(ValueError, match=r"days of trigger open: unknown day '(xyz|fun|xx)'"):
+		parse_triggers({"open": {"time": "6:00 PM", "message": "open", "days": days}})